@@ -1,19 +1,54 @@
 import streamlit as st
+import time
 import traceback
+import uuid
 # This import depends on utils/__init__.py being correct (empty)
-from utils.llm_api import get_response, APIError
+from utils.llm_api import get_response, stream_response, response_cache_stats, APIError
+from utils.client_pool import pool_stats
+from utils.context import ChatMessage, build_context
+from utils.providers import PROVIDERS, secrets_key_mapping
+from utils.resilience import provider_health, resilience_stats
+from utils.retrieval import ChunkIndex, augment_prompt
+from utils.history_view import DEFAULT_PAGE_SIZE, render_history
+from utils.conversation_store import get_store
+from utils.scheduler import configure_scheduler, scheduler_stats
+from utils.hedging import HedgePolicy, hedging_stats
+from utils.metrics import enable_jsonl, metrics_summary, serve_prometheus
 
 # --- Secrets Key Mapping ---
-# Maps the user-facing model name to the key name in secrets.toml
-SECRETS_KEY_MAPPING = {
-    "OpenAI": "OPENAI_API_KEY",
-    "Gemini": "GOOGLE_API_KEY",
-    "Claude": "ANTHROPIC_API_KEY",
-    "Mistral": "MISTRAL_API_KEY",
-    "Groq": "GROQ_API_KEY", # Assuming you add GROQ_API_KEY to secrets if using Groq
-    "NVIDIA Mistral Small": "NVIDIA_Mistral_Small_24B_Instruct",
-    "NVIDIA DeepSeek Qwen": "NVIDIA_DeepSeek_R1_Distill_Qwen_32B",
-}
+# Maps the user-facing model name to the key name in secrets.toml (declared in utils/providers.py)
+SECRETS_KEY_MAPPING = secrets_key_mapping()
+
+# --- Optional Metrics Exports (process-wide; repeated calls on rerun are no-ops) ---
+def enable_metrics_exports():
+    if st.secrets.get("METRICS_JSONL_PATH"):
+        enable_jsonl(st.secrets["METRICS_JSONL_PATH"])
+    if st.secrets.get("METRICS_PORT"):
+        try:
+            serve_prometheus(int(st.secrets["METRICS_PORT"])) # Prometheus text format at /metrics
+        except OSError as e: # Optional exporter; the chat keeps working without it
+            st.warning(f"Metrics endpoint disabled: could not listen on port {st.secrets['METRICS_PORT']} ({e}).")
+
+# --- Request Scheduler Limits (process-wide) ---
+# Optional [SCHEDULER_LIMITS] table in secrets.toml: provider = max in-flight calls, e.g. Claude = 4
+def configure_scheduler_limits():
+    if st.secrets.get("SCHEDULER_LIMITS"):
+        configure_scheduler({provider: int(limit) for provider, limit in st.secrets["SCHEDULER_LIMITS"].items()})
+
+# --- Conversation Store ---
+# Off by default. Set CONVERSATION_DB_PATH in secrets.toml to save chats to SQLite. Each user sees only
+# their own chats: per login (st.login) when auth is configured, otherwise per browser session.
+MAX_LOADED_MESSAGES = 300 # Older messages leave session state (they stay in the store, if enabled)
+
+def conversation_store():
+    path = st.secrets.get("CONVERSATION_DB_PATH", "")
+    return get_store(path) if path else None
+
+def conversation_owner(client_session):
+    user = getattr(st, "user", None) # Streamlit >= 1.42
+    if user is not None and user.get("is_logged_in") and user.get("email"):
+        return f"user:{user['email']}"
+    return f"session:{client_session}"
 
 # --- Function to load local CSS ---
 def load_css(file_path):
@@ -29,10 +64,62 @@ def load_css(file_path):
 try:
     st.set_page_config(page_title="LLM Chat App", layout="wide")
     load_css("css/style.css") # Load CSS
+    enable_metrics_exports()
+    configure_scheduler_limits()
     st.markdown("# 🧠 LLM Chat Interface") # Title
 
+    # --- Chat History Initialization ---
+    store = conversation_store()
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = []
+        st.session_state.conversation_id = None # Created in the store with the first message
+        st.session_state.history_first_seq = 0 # Messages before this one are only in the store
+    # Identifies this browser session to the shared scheduler (fair queuing across users)
+    client_session = st.session_state.setdefault("client_session", uuid.uuid4().hex)
+    owner = conversation_owner(client_session) # Scopes which stored chats this user can list and open
+
+    def open_conversation(conversation_id):
+        # Only the newest page is read; earlier pages load when the user scrolls back
+        messages, first_seq = store.load_messages(conversation_id, owner, DEFAULT_PAGE_SIZE)
+        st.session_state.update(chat_history=messages, conversation_id=conversation_id,
+                                history_first_seq=first_seq, history_pages=1)
+
+    def new_conversation():
+        st.session_state.update(chat_history=[], conversation_id=None, history_first_seq=0, history_pages=1)
+
+    def load_stored_page():
+        messages, first_seq = store.load_messages(st.session_state.conversation_id, owner, DEFAULT_PAGE_SIZE,
+                                                  before_seq=st.session_state.history_first_seq)
+        st.session_state.chat_history[:0] = messages
+        st.session_state.history_first_seq = first_seq
+
+    def add_message(role, content):
+        message = ChatMessage(role, content)
+        history = st.session_state.chat_history
+        history.append(message)
+        excess = len(history) - MAX_LOADED_MESSAGES
+        if excess > 0: # Bounded with or without a store
+            del history[:excess]
+            st.session_state.history_first_seq += excess
+        if store is None:
+            return
+        if st.session_state.conversation_id is None:
+            st.session_state.conversation_id = store.create_session(owner, title=content, model=model_name)
+        store.append_message(st.session_state.conversation_id, message) # Queued; written in the background
+
     # --- Sidebar Configuration ---
     with st.sidebar:
+        # Saved Conversations (most recently active first)
+        if store is not None:
+            st.header("Conversations")
+            st.button("➕ New chat", on_click=new_conversation, use_container_width=True)
+            for saved in store.list_sessions(owner, limit=10):
+                st.button(
+                    f"{saved.title or 'Untitled'} ({saved.message_count})", key=f"conversation_{saved.id}",
+                    on_click=open_conversation, args=(saved.id,), use_container_width=True,
+                    disabled=saved.id == st.session_state.conversation_id,
+                )
+
         st.header("Model Settings")
 
         # Define all models potentially available
@@ -49,12 +136,19 @@ try:
              st.warning("Please add your API keys to the secrets file.")
              st.stop() # Halt execution if no models can be used
 
-        # Model Selection Dropdown
+        # Model Selection Dropdown (models whose provider keeps failing are flagged)
+        def model_label(name):
+            health = provider_health(PROVIDERS[name].provider)
+            return {"open": f"⚠️ {name} (unhealthy)", "half_open": f"⏳ {name} (recovering)"}.get(health, name)
+
         model_name = st.selectbox(
             "Select LLM Model",
             options=models_with_keys,
+            format_func=model_label,
             help="Choose the language model to interact with."
         )
+        if provider_health(PROVIDERS[model_name].provider) == "open":
+            st.warning(f"{model_name} is failing repeatedly; requests are being rejected until it recovers.")
 
         # Temperature Slider
         temperature = st.slider(
@@ -68,19 +162,189 @@ try:
              help="Maximum length of the model's response."
         )
 
-    # --- Chat History Initialization ---
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        # Streaming Toggle
+        stream_output = st.toggle(
+            "Stream responses", value=True,
+            help="Show the answer token by token as it is generated."
+        )
+        if st.session_state.get("last_ttft") is not None:
+            st.caption(f"Last time to first token: {st.session_state.last_ttft * 1000:.0f} ms")
+
+        # Response Cache Bypass
+        use_cache = st.checkbox(
+            "Use response cache", value=True,
+            help="Reuse earlier answers to identical prompts at temperature 0."
+        )
+
+        # Hedging / Failover (other configured models back up the selected one)
+        hedge_requests = False
+        if len(models_with_keys) > 1:
+            hedge_requests = st.toggle(
+                "Back up slow or failing models", value=False,
+                help="If the selected model is slower than usual (95th percentile) to start answering, "
+                     "the question also goes to the fastest other model and the first answer wins. "
+                     "Errors fail over to the next model."
+            )
+
+        # Compare Mode (one prompt, several models concurrently)
+        compare_mode = st.toggle(
+            "Compare models", value=False,
+            help="Send each prompt to several models at once and show the answers side by side."
+        )
+        compare_models_selected = []
+        compare_timeout = 60
+        if compare_mode:
+            compare_models_selected = st.multiselect(
+                "Models to compare", options=models_with_keys,
+                default=models_with_keys[:3],
+            )
+            compare_timeout = st.slider(
+                "Per-model timeout (s)", 5, 180, 60,
+                help="Models that take longer than this are cancelled."
+            )
+
+        # Document Retrieval (only the most relevant chunks are sent with each question)
+        st.header("Documents")
+        if "doc_index" not in st.session_state:
+            st.session_state.doc_index = ChunkIndex()
+        doc_index = st.session_state.doc_index
+        uploaded_files = st.file_uploader(
+            "Chat with documents", accept_multiple_files=True,
+            type=["pdf", "docx", "txt", "md", "ipynb", "zip", "png", "jpg", "jpeg", "webp"],
+            help="Documents are indexed locally; each question sends only the best-matching excerpts. "
+                 "Images are sent to vision-capable models, downscaled to what the model can use.",
+        )
+        current_doc_ids = set()
+        attached_images = []
+        for uploaded in uploaded_files or []:
+            if uploaded.type.startswith("image/"):
+                attached_images.append(uploaded.getvalue())
+                continue
+            doc_id = getattr(uploaded, "file_id", None) or f"{uploaded.name}:{uploaded.size}"
+            current_doc_ids.add(doc_id)
+            if doc_id in doc_index:
+                continue
+            from utils.file_parser import is_parse_error, process_uploaded_file # Parsers are only loaded once a file is uploaded
+            content, _ = process_uploaded_file(uploaded)
+            if isinstance(content, str) and content.strip() and not is_parse_error(content): # Errors were shown already
+                doc_index.add_document(doc_id, content, uploaded.name)
+        for doc_id in doc_index.documents(): # Removed from the uploader
+            if doc_id not in current_doc_ids:
+                doc_index.delete_document(doc_id)
+        top_k = 4
+        if len(doc_index):
+            top_k = st.slider("Excerpts per question", 1, 12, 4)
+            index_stats = doc_index.stats()
+            st.caption(f"Indexed {index_stats['documents']} document(s) · {index_stats['chunks']} chunks")
+        if attached_images and not PROVIDERS[model_name].capabilities.vision:
+            st.caption(f"{model_name} can't see images; attached images will be ignored.")
+            attached_images = []
+
+        # Connection Pool Stats (shared by all sessions in this process)
+        with st.expander("Connection Stats"):
+            stats = pool_stats()
+            st.caption(
+                f"Requests: {stats['requests_sent']} · "
+                f"New connections: {stats['connections_opened']} · "
+                f"Reused: {stats['connections_reused']}"
+            )
+            for provider, counters in resilience_stats().items():
+                st.caption(
+                    f"{provider}: circuit {counters['circuit']} · {counters['calls']} calls · "
+                    f"{counters['retries']} retries · {counters['throttled']} throttled · "
+                    f"{counters['short_circuited']} rejected"
+                )
+            for provider, queue in scheduler_stats().items():
+                st.caption(
+                    f"{provider} queue: {queue['active']}/{queue['limit']} in flight · "
+                    f"{queue['queued_interactive'] + queue['queued_batch']} waiting · "
+                    f"wait p95 {queue['wait_p95_s'] * 1000:.0f} ms · {queue['coalesced']} coalesced"
+                )
+            cache_stats = response_cache_stats()["memory"]
+            st.caption(
+                f"Response cache: {cache_stats['entries']} entries · "
+                f"{cache_stats['hits']} hits / {cache_stats['misses']} misses"
+            )
+
+        # Rolling per-model latency and throughput (last 15 minutes, all sessions)
+        with st.expander("Latency & Tokens"):
+            summary = metrics_summary()
+            if not summary:
+                st.caption("No requests yet.")
+            hedges = hedging_stats()
+            if hedges["requests"]:
+                st.caption(
+                    f"Backed-up requests: {hedges['requests']} · {hedges['hedges']} hedged · "
+                    f"{hedges['failovers']} failovers · {hedges['backup_wins']} answered by a backup"
+                )
+            for name, row in sorted(summary.items()):
+                first_byte = row["first_token_p50_s"] or row["ttfb_p50_s"]
+                st.caption(
+                    f"**{name}** · {row['requests']} requests ({row['errors']} failed) · "
+                    f"p50 {row['p50_s']:.2f}s · p95 {row['p95_s']:.2f}s · p99 {row['p99_s']:.2f}s · "
+                    f"first byte {first_byte * 1000:.0f} ms · {row['tokens_per_s']:.0f} tokens/s · "
+                    f"{row['prompt_tokens']} in / {row['completion_tokens']} out"
+                )
 
     # --- Display Chat History ---
-    for role, msg in st.session_state.chat_history:
-        with st.chat_message(role):
-            st.markdown(msg) # Use markdown to render formatting
+    # Only the newest page is drawn each rerun; older pages load on demand (from the store if needed)
+    render_history(st.session_state.chat_history, stored_earlier=st.session_state.history_first_seq,
+                   load_stored=load_stored_page if store is not None else None)
 
     # --- User Input Handling ---
     user_input = st.chat_input("Ask your question...")
 
-    if user_input:
+    # Questions about uploaded documents carry only the top-k matching chunks
+    prompt = user_input
+    retrieved = []
+    if user_input and len(doc_index):
+        prompt, retrieved = augment_prompt(user_input, doc_index, k=top_k)
+
+    def show_sources(hits):
+        if hits:
+            with st.expander(f"Sources ({len(hits)} excerpts)"):
+                for score, chunk in hits:
+                    st.caption(f"{chunk.source} · part {chunk.ordinal + 1} · score {score:.2f}")
+
+    if user_input and compare_mode:
+        if not compare_models_selected:
+            st.warning("Select at least one model to compare.")
+            st.stop()
+        add_message("user", user_input)
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        # One column per model, each filled in as soon as that model finishes
+        with st.chat_message("assistant"):
+            columns = st.columns(len(compare_models_selected))
+            placeholders = {}
+            for column, name in zip(columns, compare_models_selected):
+                column.markdown(f"**{name}**")
+                placeholders[name] = column.empty()
+                placeholders[name].caption("Waiting...")
+
+            def show_result(result):
+                slot = placeholders[result.model]
+                if result.ok:
+                    slot.markdown(f"{result.text}\n\n_{result.elapsed:.1f}s_")
+                else:
+                    slot.error(result.error)
+
+            from utils.async_engine import run_compare # httpx/asyncio are only loaded when comparing
+            results = run_compare(
+                prompt,
+                {name: st.secrets[SECRETS_KEY_MAPPING[name]] for name in compare_models_selected},
+                show_result,
+                temperature=temperature, max_tokens=max_tokens, timeout=float(compare_timeout),
+                session=client_session,
+            )
+            combined = "\n\n".join(
+                f"**{r.model}** ({r.elapsed:.1f}s):\n\n{r.text if r.ok else r.error}" for r in results
+            )
+            show_sources(retrieved)
+            add_message("assistant", combined)
+
+    elif user_input:
         # Retrieve API Key safely
         retrieved_api_key = None
         secret_key_name = SECRETS_KEY_MAPPING.get(model_name) # Get secret name like 'GOOGLE_API_KEY'
@@ -97,38 +361,70 @@ try:
             st.error(f"API Key Error: Could not load key '{secret_key_name}' from `.streamlit/secrets.toml`. Reason: {e}")
             st.stop() # Stop execution if key is invalid
 
+        # Fit earlier turns into the model's context budget (token counts are cached per message)
+        history_window = build_context(st.session_state.chat_history, model_name, max_tokens, prompt)
+
         # Add user message to UI and history
-        st.session_state.chat_history.append(("user", user_input))
+        add_message("user", user_input)
         with st.chat_message("user"):
             st.markdown(user_input)
 
         # Get and display assistant response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    # Call the backend function
-                    output = get_response(
-                        prompt=user_input,
-                        model=model_name, # Pass the selected model name
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        api_key=retrieved_api_key # Pass the validated key
+            try:
+                request_args = dict(
+                    prompt=prompt, # The question plus any retrieved excerpts
+                    model=model_name, # Pass the selected model name
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    api_key=retrieved_api_key, # Pass the validated key
+                    use_cache=use_cache,
+                    history=history_window,
+                    images=attached_images or None,
+                    session=client_session, # Fair queuing against other users of this server
+                )
+                answered_by = {}
+                if hedge_requests:
+                    request_args["hedge"] = HedgePolicy(
+                        backups={name: st.secrets[SECRETS_KEY_MAPPING[name]] for name in models_with_keys if name != model_name},
+                        needs_vision=bool(attached_images),
+                        on_winner=lambda name: answered_by.update(model=name),
                     )
-                    # Add assistant response to UI and history
+                if stream_output:
+                    # Render deltas as they arrive and record time-to-first-token
+                    started_at = time.perf_counter()
+                    timing = {}
+                    def timed_deltas(deltas):
+                        for delta in deltas:
+                            timing.setdefault("ttft", time.perf_counter() - started_at)
+                            yield delta
+                    output = st.write_stream(timed_deltas(stream_response(**request_args)))
+                    if isinstance(output, list): # write_stream returns a list for non-string chunks
+                        output = "".join(str(part) for part in output)
+                    if "ttft" in timing:
+                        st.session_state.last_ttft = timing["ttft"]
+                        st.caption(f"First token in {timing['ttft'] * 1000:.0f} ms")
+                else:
+                    with st.spinner("Thinking..."):
+                        output = get_response(**request_args)
                     st.markdown(output)
-                    st.session_state.chat_history.append(("assistant", output))
-
-                # Handle errors from the API call
-                except APIError as e:
-                    st.error(f"API Communication Error: {e}")
-                except ValueError as e:
-                     st.error(f"Configuration Error: {e}")
-                except Exception as e:
-                    # Log detailed error to console, show generic message in UI
-                    print(f"--- Unexpected Error for model {model_name} ---")
-                    traceback.print_exc()
-                    print("--- End Traceback ---")
-                    st.error(f"An unexpected application error occurred: {type(e).__name__}")
+                if answered_by.get("model", model_name) != model_name:
+                    st.caption(f"Answered by {answered_by['model']} ({model_name} was slow or failing)")
+                show_sources(retrieved)
+                # Add assistant response to history
+                add_message("assistant", output)
+
+            # Handle errors from the API call
+            except APIError as e:
+                st.error(f"API Communication Error: {e}")
+            except ValueError as e:
+                 st.error(f"Configuration Error: {e}")
+            except Exception as e:
+                # Log detailed error to console, show generic message in UI
+                print(f"--- Unexpected Error for model {model_name} ---")
+                traceback.print_exc()
+                print("--- End Traceback ---")
+                st.error(f"An unexpected application error occurred: {type(e).__name__}")
 
 # --- Catch Errors During App Startup ---
 except ImportError as e:
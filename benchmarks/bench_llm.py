@@ -0,0 +1,113 @@
+# benchmarks/bench_llm.py
+"""
+Load-tests get_response / stream_response against local mock provider servers
+(benchmarks/mock_servers.py) - no API keys or network needed.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_llm [--models OpenAI Claude Gemini] [--requests 200] [--concurrency 1 8 32]
+                                   [--latency 0.05] [--jitter 0.02] [--stream] [--error-rate 0.05]
+                                   [--scheduler-limit 16]
+
+Reports p50/p95/p99 latency (and time to first token when streaming),
+throughput and error counts per model and concurrency level, plus the shared
+scheduler's queue waits (concurrency above its per-provider limit queues).
+The response cache is bypassed and prompts are distinct, so every request
+reaches the (mock) provider.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_servers import MockConfig, MockProviderServer, mock_providers
+from utils.client_pool import pool_stats
+from utils.errors import APIError
+from utils.llm_api import get_response, stream_response
+from utils.metrics import percentile
+from utils.providers import get_adapter
+from utils.scheduler import configure_scheduler, scheduler_stats
+
+
+def one_request(model: str, stream: bool, prompt: str) -> tuple[float, float | None, str | None]:
+    """Returns (latency, ttft or None, error or None) for a single call."""
+    started = time.perf_counter()
+    ttft = None
+    try:
+        if stream:
+            for _ in stream_response(prompt, model=model, api_key="mock-key", use_cache=False):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+        else:
+            get_response(prompt, model=model, api_key="mock-key", use_cache=False)
+    except APIError as e:
+        return time.perf_counter() - started, ttft, f"{e.status or 'error'}"
+    return time.perf_counter() - started, ttft, None
+
+
+def run_load(model: str, requests: int, concurrency: int, stream: bool) -> dict:
+    prompt = "Summarise the benchmark corpus in one paragraph."
+    one_request(model, stream, prompt) # Warm-up: lazy imports and the first connection aren't measured
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Distinct prompts: identical concurrent requests would be coalesced into one upstream call
+        results = list(pool.map(lambda number: one_request(model, stream, f"{prompt} (#{number})"), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, _, error in results if error is None]
+    ttfts = [ttft for _, ttft, error in results if error is None and ttft is not None]
+    errors: dict[str, int] = {}
+    for _, _, error in results:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        **{f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        "ttft_p50": percentile(ttfts, 50),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["OpenAI", "Claude", "Gemini"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of responses that are 429/503")
+    parser.add_argument("--stream", action="store_true", help="Benchmark stream_response instead of get_response")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Keep the adapters' client-side rpm/tpm limits")
+    parser.add_argument("--scheduler-limit", type=int, default=None,
+                        help="In-flight calls admitted per benchmarked provider (default: the adapters' limits)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, token_delay=args.token_delay,
+                        reply_tokens=args.reply_tokens, error_rate=args.error_rate, seed=args.seed)
+    if args.scheduler_limit:
+        # Per provider, so it also overrides the adapters' max_concurrency hints
+        configure_scheduler({get_adapter(model).provider: args.scheduler_limit for model in args.models},
+                            default_limit=args.scheduler_limit)
+    with MockProviderServer(config) as server, mock_providers(server, args.models, args.keep_rate_limits):
+        mode = "stream_response" if args.stream else "get_response"
+        print(f"{mode} against {server.url} (latency {args.latency * 1000:.0f}ms, error rate {args.error_rate:.0%})")
+        print(f"{'model':<10} {'conc':>5} {'ok':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft p50':>9} {'req/s':>8}  errors")
+        for model in args.models:
+            for concurrency in args.concurrency:
+                row = run_load(model, args.requests, concurrency, args.stream)
+                ttft = f"{row['ttft_p50'] * 1000:>7.1f}ms" if args.stream else f"{'-':>9}"
+                print(f"{model:<10} {concurrency:>5} {row['ok']:>5} {row['p50'] * 1000:>6.1f}ms {row['p95'] * 1000:>6.1f}ms "
+                      f"{row['p99'] * 1000:>6.1f}ms {ttft} {row['throughput']:>8.1f}  {row['errors'] or ''}")
+        stats = pool_stats()
+        print(f"\nServer requests: {server.counters['requests']} (injected errors: {server.counters['errors_injected']}) · "
+              f"pooled connections opened: {stats['connections_opened']} · reused: {stats['connections_reused']}")
+        for provider, queue in scheduler_stats().items():
+            print(f"Scheduler {provider}: limit {queue['limit']} · {queue['queued']} queued · "
+                  f"wait p50 {queue['wait_p50_s'] * 1000:.1f}ms / p95 {queue['wait_p95_s'] * 1000:.1f}ms · "
+                  f"{queue['coalesced']} coalesced")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/bench_parsers.py
+"""
+Micro-benchmarks for the upload parsers over generated PDF/DOCX/ipynb/txt/zip corpora.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_parsers [--scale 1 4] [--repeat 5] [--only pdf docx]
+
+`--scale` multiplies the corpus size (scale 1: 50-page PDF, 2,000-paragraph
+DOCX with 200 ten-row tables, 300-cell notebook with a 60 kB plot per code
+cell, 1 MB text file, and a ZIP holding one of each plus a nested ZIP).
+Reports median and p95 wall time and input throughput per parser; "docx-dom"
+and "ipynb-nbf" are the python-docx and nbformat paths, for comparison with
+the streaming "docx" and "ipynb" readers.
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import time
+import zipfile
+
+from benchmarks.bench_pdf import LOREM, make_pdf
+from utils import file_parser
+
+
+def make_docx(paragraphs: int, tables: int = 1, table_rows: int = 50) -> bytes:
+    """Report-like DOCX: headed sections of paragraphs with `tables` tables spread through them."""
+    from docx import Document
+    doc = Document()
+    table_every = max(1, paragraphs // tables)
+    for number in range(paragraphs):
+        if number % 40 == 0:
+            doc.add_heading(f"Section {number // 40}", level=2)
+        doc.add_paragraph(f"{number}. {LOREM[: 80 + (number * 13) % 150]}")
+        if number % table_every == table_every - 1 and len(doc.tables) < tables:
+            table = doc.add_table(rows=table_rows, cols=4)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"r{r}c{c}"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_ipynb(cells: int, output_lines: int = 20, plot_bytes: int = 0) -> bytes:
+    """
+    nbformat v4 notebook alternating markdown and code cells with stream
+    outputs; with `plot_bytes`, every code cell also carries an embedded PNG
+    (base64) of about that size, like a notebook saved with its plots.
+    """
+    notebook = {"nbformat": 4, "nbformat_minor": 5, "metadata": {"title": "Benchmark"}, "cells": []}
+    for number in range(cells):
+        if number % 2:
+            notebook["cells"].append({
+                "cell_type": "code", "id": f"c{number}", "execution_count": number, "metadata": {},
+                "source": [f"values_{number} = [i * {number} for i in range(100)]\n", f"print(sum(values_{number}))\n"],
+                "outputs": [{"output_type": "stream", "name": "stdout",
+                             "text": [f"{line} {LOREM[:60]}\n" for line in range(output_lines)]}],
+            })
+            if plot_bytes:
+                notebook["cells"][-1]["outputs"].append({
+                    "output_type": "display_data", "metadata": {},
+                    "data": {"image/png": base64.b64encode(os.urandom(plot_bytes)).decode("ascii"),
+                             "text/plain": ["<Figure size 640x480 with 1 Axes>"]},
+                })
+        else:
+            notebook["cells"].append({"cell_type": "markdown", "id": f"m{number}", "metadata": {},
+                                      "source": [f"## Step {number}\n", LOREM]})
+    return json.dumps(notebook).encode("utf-8")
+
+
+def make_txt(size_bytes: int) -> bytes:
+    line = (LOREM + "\n").encode("utf-8")
+    return line * max(1, size_bytes // len(line))
+
+
+def make_zip(members: dict[str, bytes], nested: dict[str, bytes] | None = None) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+        if nested:
+            archive.writestr("nested.zip", make_zip(nested))
+    return buffer.getvalue()
+
+
+def build_corpus(scale: int) -> dict[str, bytes]:
+    pdf = make_pdf(50 * scale)
+    docx = make_docx(2_000 * scale, tables=200 * scale, table_rows=10)
+    ipynb = make_ipynb(300 * scale, plot_bytes=60_000)
+    txt = make_txt(1_000_000 * scale)
+    return {
+        "pdf": pdf, "docx": docx, "docx-dom": docx, "ipynb": ipynb, "ipynb-nbf": ipynb, "txt": txt,
+        "zip": make_zip({"report.pdf": pdf, "notes.docx": docx, "analysis.ipynb": ipynb},
+                        nested={"readme.txt": txt[:100_000], "more/notes.docx": docx}),
+    }
+
+
+PARSERS = {
+    "pdf": file_parser.parse_pdf,
+    "docx": file_parser.parse_docx,
+    "docx-dom": lambda data: file_parser.parse_docx(data, fast=False),
+    "ipynb": file_parser.parse_ipynb,
+    "ipynb-nbf": lambda data: file_parser.parse_ipynb(data, fast=False),
+    "txt": file_parser.parse_txt,
+    "zip": lambda data: file_parser.parse_zip(data, "bench.zip"),
+}
+
+
+def measure(fn, data: bytes, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        samples.append(time.perf_counter() - started)
+    return sorted(samples)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", choices=sorted(PARSERS), default=sorted(PARSERS))
+    args = parser.parse_args(argv)
+
+    print(f"{'parser':<9} {'scale':>5} {'input':>9} {'output':>9} {'median':>9} {'p95':>9} {'MB/s':>7}")
+    for scale in args.scale:
+        corpus = build_corpus(scale)
+        for kind in args.only:
+            data = corpus[kind]
+            output = PARSERS[kind](data) # Warm-up (lazy imports) and output size
+            samples = measure(PARSERS[kind], data, args.repeat)
+            median = samples[len(samples) // 2]
+            p95 = samples[max(0, math.ceil(0.95 * len(samples)) - 1)]
+            print(f"{kind:<9} {scale:>5} {len(data) / 1e6:>7.2f}MB {len(output) / 1e6:>7.2f}MB "
+                  f"{median * 1000:>7.1f}ms {p95 * 1000:>7.1f}ms {len(data) / 1e6 / median:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
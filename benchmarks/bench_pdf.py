@@ -0,0 +1,78 @@
+# benchmarks/bench_pdf.py
+"""
+Compares the original `text += page.get_text()` PDF loop with utils.pdf_engine
+(sequential generator + join, and the process-pool path) on synthetic PDFs.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_pdf [--pages 100 1000] [--workers 4] [--repeat 3]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from utils.pdf_engine import PARALLEL_MIN_PAGES, extract_pdf_text
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+    "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. "
+)
+
+
+def make_pdf(pages: int, lines_per_page: int = 45) -> bytes:
+    """Builds a text-heavy PDF with `pages` pages."""
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        body = "\n".join(f"{number}.{line} {LOREM[: 60 + (line * 7) % 120]}" for line in range(lines_per_page))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), body, fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def legacy_parse_pdf(file_content: bytes) -> str:
+    """The pre-engine implementation of file_parser.parse_pdf, kept here for comparison."""
+    import fitz  # PyMuPDF
+    text = ""
+    with fitz.open(stream=file_content, filetype="pdf") as doc:
+        for page in doc:
+            text += page.get_text()
+    return text
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--workers", type=int, default=max(2, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"(the pool is only used from {PARALLEL_MIN_PAGES} pages; smaller documents run in-process either way)")
+    print(f"{'pages':>6} {'size':>9} {'legacy':>10} {'engine x1':>10} {f'engine x{args.workers}':>11} {'first 50':>10}")
+    for pages in args.pages:
+        pdf = make_pdf(pages)
+        expected = legacy_parse_pdf(pdf)
+        assert extract_pdf_text(pdf) == expected, "engine output differs from legacy parser"
+        legacy = timed(lambda: legacy_parse_pdf(pdf), args.repeat)
+        sequential = timed(lambda: extract_pdf_text(pdf), args.repeat)
+        parallel = timed(lambda: extract_pdf_text(pdf, workers=args.workers), args.repeat)
+        limited = timed(lambda: extract_pdf_text(pdf, max_pages=50), args.repeat)
+        print(f"{pages:>6} {len(pdf) / 1e6:>7.1f}MB {legacy * 1000:>8.0f}ms {sequential * 1000:>8.0f}ms "
+              f"{parallel * 1000:>9.0f}ms {limited * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
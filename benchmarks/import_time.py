@@ -0,0 +1,68 @@
+# benchmarks/import_time.py
+"""
+Measures cold import time of the app's modules in fresh interpreters.
+
+Usage (from the repo root):
+    python -m benchmarks.import_time [--runs 5] [module ...]
+
+Each run starts a new `python -X importtime` process, so results include every
+transitive import (openai, fitz, PIL, ...) exactly as a cold Streamlit worker
+or headless tool would pay for them.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["utils.llm_api", "utils.file_parser", "utils.async_engine"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str) -> tuple[float, list[tuple[int, str]]]:
+    """Returns (seconds spent importing `module`, [(cumulative_us, name)] for its direct imports)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    root = module.split(".")[0]
+    total_us = 0
+    direct = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        name = name.strip()
+        if depth == 0 and (name == root or name.startswith(root + ".")):
+            total_us += int(cumulative) # Interpreter startup (site, encodings) is excluded
+        elif depth == 1:
+            direct.append((int(cumulative), name))
+    direct.sort(reverse=True)
+    return total_us / 1e6, direct
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="Show the N heaviest direct imports per module")
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        samples = []
+        heaviest = []
+        for _ in range(args.runs):
+            seconds, heaviest = measure(module)
+            samples.append(seconds)
+        print(f"{module:<24} median {statistics.median(samples) * 1000:8.1f} ms  "
+              f"(min {min(samples) * 1000:.1f}, max {max(samples) * 1000:.1f}, runs {args.runs})")
+        for us, name in heaviest[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
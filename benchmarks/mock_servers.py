@@ -0,0 +1,231 @@
+# benchmarks/mock_servers.py
+"""
+Local stand-ins for the provider APIs, for benchmarks and offline testing.
+
+One threaded HTTP/1.1 server (keep-alive, so connection pooling behaves as in
+production) answers all three wire protocols the app speaks:
+
+    POST /v1/chat/completions                      OpenAI-compatible (OpenAI, Mistral, Groq, NVIDIA)
+    POST /v1/messages                              Anthropic Messages
+    POST /v1/models/{model}:generateContent        Gemini
+    POST /v1/models/{model}:streamGenerateContent  Gemini (SSE with ?alt=sse)
+
+Latency, streaming pace and error injection are set with MockConfig.
+mock_providers() re-points the registered adapters at a running server:
+
+    with MockProviderServer(MockConfig(latency=0.05)) as server, mock_providers(server):
+        get_response("hi", model="Claude", api_key="test")
+"""
+
+import contextlib
+import dataclasses
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.providers import PROVIDERS, register_provider
+
+WORDS = ("alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta", "iota", "kappa", "lambda", "mu")
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.05          # Seconds before a non-streaming response (or the first streamed token)
+    jitter: float = 0.0            # Extra uniform random latency, 0..jitter seconds
+    token_delay: float = 0.002     # Seconds between streamed tokens
+    reply_tokens: int = 64         # Words in every reply
+    error_rate: float = 0.0        # Probability of answering with an injected error
+    error_statuses: tuple = (429, 503)
+    retry_after: float | None = 0.0  # Retry-After header on injected errors (None = omit)
+    seed: int | None = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so client pools reuse connections
+    disable_nagle_algorithm = True # Headers and body are separate writes; don't let Nagle delay the body
+    server: "MockProviderServer"
+
+    def log_message(self, format, *args): # Quiet: benchmarks print their own summary
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        server.count("requests")
+        config = server.config
+
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/chat/completions"):
+            protocol, stream = "openai", bool(body.get("stream"))
+        elif path.endswith("/messages"):
+            protocol, stream = "anthropic", bool(body.get("stream"))
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            protocol, stream = "gemini", ":streamGenerateContent" in path
+        else:
+            return self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+
+        time.sleep(config.latency + (server.random.uniform(0, config.jitter) if config.jitter else 0))
+        if config.error_rate and server.random.random() < config.error_rate:
+            server.count("errors_injected")
+            status = server.random.choice(config.error_statuses)
+            headers = {"Retry-After": f"{config.retry_after:g}"} if config.retry_after is not None else {}
+            return self._send_json(status, {"error": {"message": f"Injected {status}", "type": "mock_error"}}, headers)
+
+        words = [f"{server.random.choice(WORDS)} " for _ in range(config.reply_tokens)]
+        prompt_tokens = len(json.dumps(body)) // 4
+        if stream:
+            server.count("streams")
+            self._stream(protocol, words, prompt_tokens)
+        else:
+            self._send_json(200, _full_response(protocol, "".join(words), prompt_tokens, len(words)))
+
+    # --- Writers ---
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, protocol: str, words: list[str], prompt_tokens: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = self.server.config.token_delay
+        for event in _stream_events(protocol, words, prompt_tokens):
+            self._chunk(event)
+            if delay:
+                time.sleep(delay)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _full_response(protocol: str, text: str, prompt_tokens: int, completion_tokens: int) -> dict:
+    if protocol == "openai":
+        return {
+            "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": "mock",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+    if protocol == "anthropic":
+        return {
+            "id": "mock", "type": "message", "role": "assistant", "model": "mock",
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens},
+        }
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens,
+                          "totalTokenCount": prompt_tokens + completion_tokens},
+    }
+
+
+def _stream_events(protocol: str, words: list[str], prompt_tokens: int):
+    """SSE frames for one streamed reply in the given protocol."""
+    if protocol == "openai":
+        for word in words:
+            yield "data: " + json.dumps({"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word}}]}) + "\n\n"
+        yield "data: " + json.dumps({"object": "chat.completion.chunk", "choices": [],
+                                     "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words)}}) + "\n\n"
+        yield "data: [DONE]\n\n"
+    elif protocol == "anthropic":
+        def event(name, payload):
+            return f"event: {name}\ndata: {json.dumps({'type': name, **payload})}\n\n"
+        yield event("message_start", {"message": {"id": "mock", "usage": {"input_tokens": prompt_tokens, "output_tokens": 0}}})
+        yield event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+        for word in words:
+            yield event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": word}})
+        yield event("content_block_stop", {"index": 0})
+        yield event("message_delta", {"delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(words)}})
+        yield event("message_stop", {})
+    else:
+        for index, word in enumerate(words):
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": word}]}}]}
+            if index == len(words) - 1:
+                chunk["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": len(words)}
+            yield "data: " + json.dumps(chunk) + "\n\n"
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """Threaded mock server on 127.0.0.1 (an ephemeral port by default); use as a context manager."""
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig | None = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.config = config or MockConfig()
+        self.random = random.Random(self.config.seed)
+        self.counters = {"requests": 0, "streams": 0, "errors_injected": 0}
+        self._counter_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return # Clients dropping idle keep-alive connections is normal
+        super().handle_error(request, client_address)
+
+    def count(self, name: str) -> None:
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def start(self) -> "MockProviderServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-provider-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _local_endpoint(adapter, base_url: str) -> str:
+    if adapter.endpoint.endswith("/chat/completions"):
+        return f"{base_url}/v1/chat/completions"
+    if adapter.endpoint.endswith("/messages"):
+        return f"{base_url}/v1/messages"
+    return f"{base_url}/v1/models" # Gemini builds {endpoint}/{model}:{method}
+
+
+@contextlib.contextmanager
+def mock_providers(server: MockProviderServer, models=None, keep_rate_limits: bool = False):
+    """
+    Temporarily re-registers adapters so their endpoints point at `server`.
+
+    Client-side rate limits (rpm/tpm) are lifted unless keep_rate_limits is set,
+    so benchmarks measure the client path rather than the token buckets.
+    """
+    originals = {name: PROVIDERS[name] for name in (models or list(PROVIDERS))}
+    try:
+        for name, adapter in originals.items():
+            capabilities = adapter.capabilities if keep_rate_limits else dataclasses.replace(adapter.capabilities, rpm=None, tpm=None)
+            register_provider(dataclasses.replace(adapter, endpoint=_local_endpoint(adapter, server.url), capabilities=capabilities))
+        yield server
+    finally:
+        for adapter in originals.values():
+            register_provider(adapter)
@@ -0,0 +1,7 @@
+# tests/conftest.py
+"""Makes the app's `utils` package importable when pytest is run from any directory."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
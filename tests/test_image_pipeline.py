@@ -0,0 +1,57 @@
+# tests/test_image_pipeline.py
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from utils.image_pipeline import ImageLimits, prepare_image
+
+
+def _encode(img, fmt="PNG", **params) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def _noise(width, height) -> Image.Image:
+    return Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+
+
+def test_small_image_passes_through():
+    data = _encode(Image.new("RGB", (32, 32), (200, 10, 10)))
+    prepared = prepare_image(data)
+    assert prepared.mime_type == "image/png"
+    assert prepared.size == len(data)
+
+
+def test_large_image_is_downscaled_under_budget():
+    data = _encode(_noise(800, 600), "JPEG", quality=95)
+    limits = ImageLimits(max_edge=400, max_bytes=40_000)
+    prepared = prepare_image(data, limits)
+    assert max(prepared.width, prepared.height) <= 400
+    assert prepared.size <= limits.max_bytes
+
+
+def test_budget_that_cannot_be_met_raises():
+    data = _encode(_noise(256, 256))
+    with pytest.raises(ValueError, match="could not be compressed under 50 bytes"):
+        prepare_image(data, ImageLimits(max_bytes=50))
+
+
+def test_unreadable_bytes_raise():
+    with pytest.raises(ValueError, match="Not a supported image"):
+        prepare_image(b"definitely not an image")
+
+
+def test_truncated_image_raises():
+    data = _encode(_noise(300, 300), "JPEG", quality=90)
+    with pytest.raises(ValueError, match="could not be decoded"):
+        prepare_image(data[: len(data) // 2], ImageLimits(max_edge=100))
+
+
+def test_decompression_bomb_raises(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1_000)
+    data = _encode(Image.new("RGB", (100, 100)))
+    with pytest.raises(ValueError, match="too large to process"):
+        prepare_image(data)
@@ -0,0 +1,42 @@
+# tests/test_notebook_reader.py
+import json
+
+import pytest
+
+from utils.file_parser import parse_ipynb
+from utils.notebook_reader import extract_notebook_text
+
+MARKER = "[... output truncated]"
+
+
+def _notebook(*outputs: str) -> bytes:
+    cell = {
+        "cell_type": "code", "id": "c1", "source": "print('x')", "metadata": {}, "execution_count": 1,
+        "outputs": [{"output_type": "stream", "name": "stdout", "text": text} for text in outputs],
+    }
+    return json.dumps({"cells": [cell], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}).encode()
+
+
+def test_output_that_fits_exactly_has_no_marker():
+    text = extract_notebook_text(_notebook("a" * 10), include_outputs=True, max_output_chars=10)
+    assert "a" * 10 in text
+    assert MARKER not in text
+
+
+def test_output_over_budget_is_marked():
+    text = extract_notebook_text(_notebook("a" * 11), include_outputs=True, max_output_chars=10)
+    assert "a" * 10 + "\n" + MARKER in text
+
+
+def test_output_after_full_budget_is_marked():
+    text = extract_notebook_text(_notebook("a" * 10, "zzz"), include_outputs=True, max_output_chars=10)
+    assert "zzz" not in text
+    assert MARKER in text
+
+
+def test_exact_fit_matches_nbformat_path():
+    pytest.importorskip("nbformat")
+    data = _notebook("a" * 10)
+    fast = parse_ipynb(data, include_outputs=True, max_output_chars=10)
+    slow = parse_ipynb(data, include_outputs=True, max_output_chars=10, fast=False)
+    assert fast.split("## Code Cell:", 1)[1] == slow.split("## Code Cell:", 1)[1]
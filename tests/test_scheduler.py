@@ -0,0 +1,82 @@
+# tests/test_scheduler.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.cancellation import CancelScope, cancel_scope
+from utils.errors import RequestCancelled
+from utils.scheduler import Scheduler
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_slot_is_released_on_exit():
+    scheduler = Scheduler(default_limit=1)
+    with scheduler.slot("p"):
+        assert scheduler.stats()["p"]["active"] == 1
+    assert scheduler.stats()["p"]["active"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue_at_once():
+    scheduler = Scheduler(default_limit=1)
+    scope = CancelScope()
+    outcome = {}
+
+    def waiter():
+        with cancel_scope(scope):
+            try:
+                with scheduler.slot("p", session="loser"):
+                    outcome["entered"] = True
+            except RequestCancelled:
+                outcome["cancelled"] = time.monotonic()
+
+    with scheduler.slot("p", session="winner"): # Holds the only slot for the whole test
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        _wait_for(lambda: scheduler.stats()["p"]["queued_interactive"] == 1)
+        cancelled_at = time.monotonic()
+        scope.cancel()
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+        assert "entered" not in outcome
+        assert outcome["cancelled"] - cancelled_at < 0.5
+        stats = scheduler.stats()["p"]
+        assert stats["queued_interactive"] == 0
+        assert stats["cancelled"] == 1
+        assert stats["active"] == 1
+    assert scheduler.stats()["p"]["active"] == 0
+
+
+def test_already_cancelled_scope_never_takes_a_free_slot():
+    scheduler = Scheduler(default_limit=1)
+    scope = CancelScope()
+    scope.cancel()
+    with cancel_scope(scope), pytest.raises(RequestCancelled):
+        with scheduler.slot("p"):
+            pass
+    assert scheduler.stats()["p"]["active"] == 0
+
+
+def test_async_slot_is_withdrawn_by_cancel_scope():
+    scheduler = Scheduler(default_limit=1)
+    scope = CancelScope()
+
+    async def main():
+        with scheduler.slot("p"):
+            with cancel_scope(scope):
+                waiter = asyncio.ensure_future(scheduler.aslot("p").__aenter__())
+            await asyncio.sleep(0.01)
+            scope.cancel()
+            with pytest.raises(RequestCancelled):
+                await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+    assert scheduler.stats()["p"]["active"] == 0
+    assert scheduler.stats()["p"]["cancelled"] == 1
@@ -1,3 +1 @@
 # utils/__init__.py
-
-from .llm_api import get_llm_response, SUPPORTED_MODELS, get_model_capabilities #<- This line is incorrect and causing the crash
@@ -0,0 +1,163 @@
+# utils/async_engine.py
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+import httpx
+
+from utils.client_pool import registry
+from utils.errors import APIError
+from utils.providers import get_adapter, error_from_response
+from utils.resilience import manager as resilience
+from utils.context import estimate_tokens
+from utils.metrics import track
+from utils.scheduler import INTERACTIVE, scheduler
+
+# --- Result Type ---
+
+@dataclass
+class ModelResult:
+    """Outcome of one model's call inside a compare run."""
+    model: str
+    text: str | None = None
+    error: str | None = None
+    elapsed: float = 0.0 # Seconds from fan-out start to this model finishing
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def make_async_client() -> httpx.AsyncClient:
+    """Builds a non-blocking HTTP client sized from the shared PoolConfig."""
+    cfg = registry.config
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=cfg.pool_maxsize,
+            max_keepalive_connections=cfg.pool_maxsize if cfg.keep_alive else 0,
+        ),
+        timeout=httpx.Timeout(cfg.read_timeout, connect=cfg.connect_timeout),
+    )
+
+# --- Single Request ---
+
+async def get_response_async(prompt: str, model: str = "OpenAI", temperature: float = 0.5, max_tokens: int = 512,
+                             api_key: str = None, client: httpx.AsyncClient | None = None,
+                             session: str | None = None, priority: str = INTERACTIVE) -> str:
+    """
+    Async counterpart of llm_api.get_response.
+
+    Every provider (OpenAI included) is called through its REST endpoint on an
+    httpx.AsyncClient, so many calls can be in flight on one event loop.
+    Cancelling the awaiting task aborts the underlying HTTP request.
+
+    Args:
+        prompt, model, temperature, max_tokens, api_key: As for get_response.
+        client (httpx.AsyncClient): Optional shared client; a temporary one is
+            created (and closed) when omitted.
+        session, priority: Queueing identity for the shared scheduler (see get_response).
+
+    Returns:
+        str: The LLM's response text.
+
+    Raises:
+        APIError, ValueError
+    """
+    adapter = get_adapter(model)
+    if not api_key:
+        raise APIError(f"❌ API Key was not provided to get_response_async function for model {model}.")
+    messages = [{"role": "user", "content": prompt}]
+    url, headers, payload = adapter.build_request(adapter, messages, temperature, max_tokens, api_key, stream=False)
+
+    owns_client = client is None
+    client = client or make_async_client()
+
+    async def attempt() -> str:
+        with track(model, adapter.provider) as record: # Each task has its own current record (ContextVar)
+            try:
+                response = await client.post(url, headers=headers, json=payload)
+            except httpx.HTTPError as e:
+                raise APIError(f"❌ Network error for {model}: {e}", provider=adapter.provider, transient=True) from e
+            record.status = response.status_code
+            record.request_bytes = len(response.request.content)
+            record.response_bytes = len(response.content)
+            if response.status_code != 200:
+                raise error_from_response(adapter, response, url)
+            try: response_data = response.json()
+            except ValueError as e: raise APIError(f"❌ {adapter.label} Error: Response is not JSON: {e}", provider=adapter.provider)
+            return adapter.parse_response(adapter, response_data)
+
+    try:
+        est_tokens = estimate_tokens(prompt) + max_tokens
+        return await resilience.acall(
+            adapter, api_key, attempt, est_tokens=est_tokens,
+            slot=lambda: scheduler.aslot(adapter.provider, session, priority, adapter.capabilities.max_concurrency),
+        )
+    finally:
+        if owns_client:
+            await client.aclose()
+
+# --- Multi-Model Fan-Out ---
+
+async def compare_models(prompt: str, api_keys: dict[str, str], temperature: float = 0.5, max_tokens: int = 512,
+                         timeout: float | dict[str, float] = 60.0, session: str | None = None):
+    """
+    Sends one prompt to several models at once and yields results as each finishes.
+
+    Total wall time is bounded by the slowest model (or its timeout) rather than
+    the sum of all calls. If the consumer stops iterating early, the remaining
+    requests are cancelled.
+
+    Args:
+        prompt (str): The user's prompt, sent unchanged to every model.
+        api_keys (dict): Display model name -> API key for each model to query.
+        temperature (float), max_tokens (int): As for get_response.
+        timeout (float | dict): Per-model timeout in seconds; a dict maps model
+            names to individual timeouts (missing models fall back to 60s).
+        session (str): Caller id for the shared scheduler's fair queuing.
+
+    Yields:
+        ModelResult: One per model, in completion order.
+    """
+    started = time.perf_counter()
+
+    async with make_async_client() as client:
+        async def run_one(model: str, api_key: str) -> ModelResult:
+            limit = timeout.get(model, 60.0) if isinstance(timeout, dict) else timeout
+            try:
+                text = await asyncio.wait_for(
+                    get_response_async(prompt, model, temperature, max_tokens, api_key, client=client, session=session),
+                    timeout=limit,
+                )
+                return ModelResult(model, text=text, elapsed=time.perf_counter() - started)
+            except asyncio.TimeoutError:
+                return ModelResult(model, error=f"⏱️ Timed out after {limit:.0f}s", elapsed=time.perf_counter() - started)
+            except (APIError, ValueError) as e:
+                return ModelResult(model, error=str(e), elapsed=time.perf_counter() - started)
+            except Exception as e:
+                return ModelResult(model, error=f"❌ Unexpected error: {type(e).__name__}", elapsed=time.perf_counter() - started)
+
+        tasks = [asyncio.create_task(run_one(model, key)) for model, key in api_keys.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def run_compare(prompt: str, api_keys: dict[str, str], on_result, **kwargs) -> list[ModelResult]:
+    """
+    Synchronous driver for compare_models, for use from the Streamlit script thread.
+
+    Calls `on_result(result)` as each model finishes and returns all results.
+    """
+    async def drain():
+        results = []
+        async for result in compare_models(prompt, api_keys, **kwargs):
+            on_result(result)
+            results.append(result)
+        return results
+    return asyncio.run(drain())
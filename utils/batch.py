@@ -0,0 +1,268 @@
+# utils/batch.py
+"""
+Headless batch runner: sends a JSONL prompt set through one or more models.
+
+Usage (from the repo root):
+    python -m utils.batch prompts.jsonl results.jsonl --models OpenAI Claude [--concurrency 4]
+                          [--provider-concurrency Claude=2] [--temperature 0] [--max-tokens 512]
+
+Input lines are JSON objects with a "prompt" and optionally "id", "model",
+"temperature", "max_tokens" and "history" (a list of {"role", "content"}).
+Lines without a "model" run against every --models entry.
+
+Results are appended to the output JSONL as each request completes, one line
+per (id, model). Re-running with the same output file resumes: pairs that
+already succeeded are skipped (failed ones too, unless --retry-failed).
+
+API keys come from environment variables named like the secrets.toml keys
+(OPENAI_API_KEY, ANTHROPIC_API_KEY, ...), falling back to
+.streamlit/secrets.toml. Streamlit is never imported.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from utils.errors import APIError
+from utils.llm_api import cached_response, get_response
+from utils.metrics import collect, percentile
+from utils.providers import estimate_cost, get_adapter, secrets_key_mapping
+from utils.scheduler import BATCH, configure_scheduler
+
+try:
+    import tomllib # Python 3.11+
+except ImportError:
+    tomllib = None
+
+DEFAULT_SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+# --- Jobs ---
+
+_HISTORY_ROLES = ("system", "user", "assistant")
+
+@dataclass(slots=True)
+class Job:
+    prompt_id: str
+    model: str
+    prompt: str
+    temperature: float
+    max_tokens: int
+    history: list | None = None
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.prompt_id, self.model)
+
+
+def read_jobs(path: str, models: list[str], temperature: float, max_tokens: int):
+    """Yields a Job per (input line, model); line numbers are the default ids."""
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON ({e})") from e
+            if not isinstance(item, dict) or not isinstance(item.get("prompt"), str):
+                raise ValueError(f"{path}:{number}: expected an object with a string 'prompt'")
+            history = item.get("history")
+            if history is not None and not (
+                isinstance(history, list)
+                and all(isinstance(turn, dict) and turn.get("role") in _HISTORY_ROLES and isinstance(turn.get("content"), str)
+                        for turn in history)
+            ):
+                raise ValueError(f"{path}:{number}: 'history' must be a list of {{\"role\", \"content\"}} objects "
+                                 f"with role one of {', '.join(_HISTORY_ROLES)}")
+            for model in [item["model"]] if item.get("model") else models:
+                yield Job(
+                    prompt_id=str(item.get("id", number)), model=model, prompt=item["prompt"],
+                    temperature=float(item.get("temperature", temperature)),
+                    max_tokens=int(item.get("max_tokens", max_tokens)),
+                    history=history,
+                )
+
+
+def completed_keys(path: str, retry_failed: bool) -> set[tuple[str, str]]:
+    """(id, model) pairs already present in an existing output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut off by an interrupted run; that job simply runs again
+            if row.get("ok") or not retry_failed:
+                done.add((str(row.get("id")), row.get("model")))
+    return done
+
+# --- API Keys (no Streamlit) ---
+
+def load_api_keys(models: set[str], secrets_path: str = DEFAULT_SECRETS_PATH) -> dict[str, str]:
+    secrets = {}
+    if tomllib is not None and os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as handle:
+            secrets = tomllib.load(handle)
+    mapping = secrets_key_mapping()
+    keys = {}
+    for model in models:
+        get_adapter(model) # ValueError for unknown models
+        name = mapping[model]
+        value = os.environ.get(name) or secrets.get(name)
+        if not value:
+            raise ValueError(f"No API key for {model}: set ${name} or add it to {secrets_path}.")
+        keys[model] = value
+    return keys
+
+# --- Running ---
+
+@dataclass
+class ModelTotals:
+    ok: int = 0
+    failed: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float | None = 0.0
+    latencies: list = field(default_factory=list)
+
+
+def run_job(job: Job, api_key: str, use_cache: bool) -> dict:
+    """Runs one prompt; never raises. Returns the output row."""
+    started = time.perf_counter()
+    row = {"id": job.prompt_id, "model": job.model}
+    cached = False
+    with collect() as attempts: # Metrics records of every attempt (retries included)
+        try:
+            text = cached_response(job.prompt, job.model, job.temperature, job.max_tokens, job.history) if use_cache else None
+            cached = text is not None
+            if not cached:
+                text = get_response(job.prompt, model=job.model, temperature=job.temperature, max_tokens=job.max_tokens,
+                                    api_key=api_key, use_cache=use_cache, history=job.history,
+                                    session="batch", priority=BATCH) # Yields to interactive traffic in a shared process
+            row.update(text=text, ok=True)
+        except (APIError, ValueError) as e:
+            row.update(ok=False, error=str(e), status=getattr(e, "status", None))
+        except Exception as e: # One bad job must not abort the run
+            row.update(ok=False, error=f"{type(e).__name__}: {e}", status=None)
+    prompt_tokens = sum(r.prompt_tokens or 0 for r in attempts if r.ok)
+    completion_tokens = sum(r.completion_tokens or 0 for r in attempts if r.ok)
+    row.update(
+        latency_s=round(time.perf_counter() - started, 4),
+        attempts=len(attempts),
+        cached=cached, # Single-flight followers make no attempts either, but they aren't cache hits
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        tokens_estimated=any(r.tokens_estimated for r in attempts),
+        cost_usd=estimate_cost(job.model, prompt_tokens, completion_tokens),
+    )
+    return row
+
+
+def run_batch(jobs: list[Job], output_path: str, api_keys: dict[str, str], concurrency: int = 4,
+              provider_concurrency: dict[str, int] | None = None, use_cache: bool = True,
+              progress_every: int = 50) -> dict[str, ModelTotals]:
+    """
+    Runs jobs with at most `concurrency` in flight per provider (overridable per
+    provider), appending each result to output_path as soon as it completes.
+    """
+    provider_concurrency = provider_concurrency or {}
+    providers = {job.model: get_adapter(job.model).provider for job in jobs}
+    executors = {
+        provider: ThreadPoolExecutor(max_workers=provider_concurrency.get(provider, concurrency), thread_name_prefix=f"batch-{provider}")
+        for provider in set(providers.values())
+    }
+    totals: dict[str, ModelTotals] = {}
+    started = time.perf_counter()
+    done_count = 0
+    try:
+        with open(output_path, "a", encoding="utf-8") as out:
+            pending = {executors[providers[job.model]].submit(run_job, job, api_keys[job.model], use_cache) for job in jobs}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    row = future.result()
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush() # Every completed row survives an interruption
+                    model_totals = totals.setdefault(row["model"], ModelTotals())
+                    if row["ok"]:
+                        model_totals.ok += 1
+                        model_totals.latencies.append(row["latency_s"])
+                    else:
+                        model_totals.failed += 1
+                    model_totals.prompt_tokens += row["prompt_tokens"]
+                    model_totals.completion_tokens += row["completion_tokens"]
+                    model_totals.cost = None if model_totals.cost is None or row["cost_usd"] is None else model_totals.cost + row["cost_usd"]
+                    done_count += 1
+                    if progress_every and done_count % progress_every == 0:
+                        rate = done_count / (time.perf_counter() - started)
+                        print(f"  {done_count}/{len(jobs)} done ({rate:.1f} req/s)", file=sys.stderr)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+    return totals
+
+
+def print_summary(totals: dict[str, ModelTotals], elapsed: float, skipped: int) -> None:
+    print(f"\n{'model':<22} {'ok':>6} {'failed':>6} {'p50':>7} {'p95':>7} {'in tok':>9} {'out tok':>9} {'cost':>9}")
+    all_ok = all_tokens = 0
+    all_cost = 0.0
+    for model, row in sorted(totals.items()):
+        cost = f"${row.cost:.4f}" if row.cost is not None else "n/a"
+        print(f"{model:<22} {row.ok:>6} {row.failed:>6} {percentile(row.latencies, 50):>6.2f}s {percentile(row.latencies, 95):>6.2f}s "
+              f"{row.prompt_tokens:>9} {row.completion_tokens:>9} {cost:>9}")
+        all_ok += row.ok
+        all_tokens += row.completion_tokens
+        all_cost += row.cost or 0.0
+    print(f"\n{all_ok} succeeded in {elapsed:.1f}s ({all_ok / elapsed if elapsed else 0:.2f} req/s, "
+          f"{all_tokens / elapsed if elapsed else 0:.0f} output tokens/s) · skipped {skipped} already done · "
+          f"estimated cost ${all_cost:.4f}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Prompts JSONL")
+    parser.add_argument("output", help="Results JSONL (appended; used to resume)")
+    parser.add_argument("--models", nargs="+", default=["OpenAI"], help="Models for lines without a 'model'")
+    parser.add_argument("--concurrency", type=int, default=4, help="In-flight requests per provider")
+    parser.add_argument("--provider-concurrency", nargs="*", default=[], metavar="PROVIDER=N",
+                        help="Per-provider overrides, e.g. Claude=2 NVIDIA=1")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run pairs that failed in the output file")
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="secrets.toml used when env vars are missing")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for item in args.provider_concurrency:
+        provider, _, limit = item.partition("=")
+        overrides[provider] = int(limit)
+
+    try:
+        done = completed_keys(args.output, args.retry_failed)
+        all_jobs = list(read_jobs(args.input, args.models, args.temperature, args.max_tokens))
+        jobs = [job for job in all_jobs if job.key not in done]
+        api_keys = load_api_keys({job.model for job in jobs}, args.secrets)
+    except (OSError, ValueError) as e:
+        parser.exit(2, f"error: {e}\n")
+
+    # This process only runs the batch: let the scheduler admit as many calls as the executors send
+    configure_scheduler({provider: overrides.get(provider, args.concurrency)
+                         for provider in {get_adapter(job.model).provider for job in jobs}})
+    print(f"{len(jobs)} requests to run ({len(all_jobs) - len(jobs)} already in {args.output})", file=sys.stderr)
+    started = time.perf_counter()
+    try:
+        totals = run_batch(jobs, args.output, api_keys, args.concurrency, overrides, use_cache=not args.no_cache)
+    except KeyboardInterrupt:
+        parser.exit(130, "\nInterrupted; re-run the same command to resume.\n")
+    print_summary(totals, time.perf_counter() - started, len(all_jobs) - len(jobs))
+
+
+if __name__ == "__main__":
+    main()
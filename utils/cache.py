@@ -0,0 +1,217 @@
+# utils/cache.py
+
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# --- In-Memory LRU Tier ---
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and (approximate) byte size, with optional TTL.
+
+    Sizes are estimated with `sizeof` (defaults to sys.getsizeof of the value),
+    which is exact for the str/bytes values we store and cheap to compute.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int | None = None,
+                 ttl: float | None = None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or sys.getsizeof
+        self._data: OrderedDict[str, tuple[object, float | None, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            self.delete(key) # Already expired: nothing to keep
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return # Never cache a single value larger than the whole budget
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+# --- On-Disk SQLite Tier ---
+
+class SQLiteStore:
+    """
+    Small persistent key/value store backed by one SQLite table.
+
+    Values are pickled. Expired rows are skipped on read and purged (through
+    an index on expires_at) every `purge_every` writes. One connection is shared under a lock (check_same_thread=False), which is
+    plenty for cache-sized traffic from Streamlit script threads.
+    """
+
+    def __init__(self, path: str, table: str = "cache", purge_every: int = 256):
+        self.path = path
+        self.table = table
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_expires ON {table}(expires_at)")
+        self._writes = 0
+        self.hits = self.misses = 0
+
+    def get(self, key: str, default=None):
+        value, _ = self.get_with_expiry(key, default)
+        return value
+
+    def get_with_expiry(self, key: str, default=None) -> tuple[object, float | None]:
+        """Returns (value, expires_at as a time.time() timestamp or None); (default, None) on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            self.misses += 1
+            return default, None
+        self.hits += 1
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        if ttl is not None and ttl <= 0:
+            self.delete(key) # Already expired: nothing to keep
+            return
+        expires_at = time.time() + ttl if ttl is not None else None
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, blob, expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge_expired()
+
+    def _purge_expired(self) -> None:
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._purge_expired()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses, "path": self.path}
+
+# --- Two-Tier Cache ---
+
+class TieredCache:
+    """Memory LRU in front of an optional SQLiteStore; disk hits are promoted into memory."""
+
+    def __init__(self, memory: LRUCache, disk: SQLiteStore | None = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk is not None:
+            value, expires_at = self.disk.get_with_expiry(key, _MISSING)
+            if value is not _MISSING:
+                ttl = None # Memory tier default
+                if expires_at is not None: # Keep the entry's remaining lifetime, not a fresh one
+                    remaining = expires_at - time.time()
+                    ttl = remaining if self.memory.ttl is None else min(remaining, self.memory.ttl)
+                self.memory.set(key, value, ttl)
+                return value
+        return default
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl if ttl is not None else self.memory.ttl)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        return {"memory": self.memory.stats(), "disk": self.disk.stats() if self.disk is not None else None}
+
+_MISSING = object()
@@ -0,0 +1,85 @@
+# utils/cancellation.py
+"""
+Cancellation scopes for in-flight upstream requests.
+
+A blocked socket read can't be interrupted by closing a generator from
+another thread. Instead, the code that owns a request runs it inside a
+CancelScope (a ContextVar, so it follows the request into worker threads
+started with a copied context), and the layers that open connections register
+how to abort them with on_cancel(). Cancelling the scope runs those callbacks:
+pooled connections are shut down, which wakes the blocked read with an error
+that the caller then reports as RequestCancelled.
+"""
+
+import contextlib
+import threading
+from contextvars import ContextVar
+from typing import Callable
+
+
+class CancelScope:
+    """Abort callbacks for one request; cancel() runs them (once) and later registrations immediately."""
+
+    def __init__(self):
+        self._callbacks: list[Callable[[], None]] = []
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def add(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registers `callback`; returns a function that unregisters it."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        _run(callback) # Already cancelled
+        return lambda: None
+
+    def _discard(self, callback) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            _run(callback)
+
+
+def _run(callback) -> None:
+    try:
+        callback()
+    except Exception as e: # Aborting is best effort; the request fails on its own if this didn't work
+        print(f"Cancel callback failed: {e}")
+
+
+_scope: ContextVar[CancelScope | None] = ContextVar("cancel_scope", default=None)
+
+@contextlib.contextmanager
+def cancel_scope(scope: CancelScope):
+    """Runs the block (and anything started from it with a copied context) under `scope`."""
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+def current_scope() -> CancelScope | None:
+    return _scope.get()
+
+def on_cancel(callback: Callable[[], None]) -> Callable[[], None]:
+    """Registers an abort callback with the current scope, if any; returns the unregister function."""
+    scope = _scope.get()
+    return scope.add(callback) if scope is not None else (lambda: None)
+
+def cancelled() -> bool:
+    """True when the current request's scope was cancelled."""
+    scope = _scope.get()
+    return scope is not None and scope.cancelled
@@ -0,0 +1,320 @@
+# utils/client_pool.py
+
+import socket
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from utils import metrics
+from utils.cancellation import on_cancel
+
+# --- Pool Configuration ---
+
+@dataclass(frozen=True)
+class PoolConfig:
+    """Connection pool settings shared by every pooled provider client."""
+    pool_connections: int = 10    # Number of host pools kept per session
+    pool_maxsize: int = 32        # Max open connections kept per host
+    pool_block: bool = False      # Block (instead of opening extra sockets) when the pool is exhausted
+    connect_timeout: float = 10.0 # Seconds to establish TCP+TLS
+    read_timeout: float = 120.0   # Seconds to wait between bytes from the server
+    keep_alive: bool = True       # Send "Connection: keep-alive" and reuse sockets
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """(connect, read) tuple in the format expected by requests."""
+        return (self.connect_timeout, self.read_timeout)
+
+
+# --- Connection Timing ---
+# New connections report DNS, TCP connect and TLS time into the current
+# request's metrics record (utils/metrics.py); reused connections report nothing.
+
+class _TimedConnectionMixin:
+    def _new_conn(self):
+        record = metrics.current()
+        if record is None:
+            return super()._new_conn()
+        started = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            return super()._new_conn() # Let urllib3 raise its usual NameResolutionError
+        resolved = time.perf_counter()
+        host, self._dns_host = self._dns_host, address # TCP to the resolved address; Host/SNI still use self.host
+        try:
+            sock = super()._new_conn()
+        except NewConnectionError:
+            self._dns_host = host
+            return super()._new_conn() # First address refused/unreachable: let urllib3 try them all
+        finally:
+            self._dns_host = host
+        record.dns_s = resolved - started
+        record.connect_s = time.perf_counter() - resolved
+        return sock
+
+
+# --- Cancellation ---
+# Each request registers an abort with the current CancelScope (utils/cancellation.py).
+# Shutting the socket down wakes a thread blocked waiting for headers or the next
+# chunk; urllib3 then sees the connection as dropped and never reuses it.
+
+class _CancellableConnectionMixin:
+    def request(self, *args, **kwargs):
+        owner = object() # Pooled connections outlive requests: only abort while this request owns it
+        self._cancel_owner = owner
+        on_cancel(lambda: self._abort(owner))
+        return super().request(*args, **kwargs)
+
+    def _abort(self, owner) -> None:
+        sock = self.sock
+        if getattr(self, "_cancel_owner", None) is owner and sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _TimedHTTPConnection(_CancellableConnectionMixin, _TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_CancellableConnectionMixin, _TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        record = metrics.current()
+        if record is not None and record.connect_s is not None:
+            record.tls_s = max(time.perf_counter() - started - record.dns_s - record.connect_s, 0.0)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools time connection set-up for utils/metrics.py."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+def _httpx_trace_request(request) -> None:
+    """httpx request hook: records payload size and traces connect/TLS/TTFB via httpcore."""
+    record = metrics.current()
+    if record is None:
+        return
+    try:
+        record.request_bytes = len(request.content)
+    except Exception: # Streaming request bodies can't be measured up front
+        pass
+    began: dict[str, float] = {}
+
+    def trace(event: str, info: dict) -> None:
+        now = time.perf_counter()
+        step, _, phase = event.rpartition(".")
+        if phase == "started":
+            began[step] = now
+        elif phase == "complete" and step in began:
+            if step == "connection.connect_tcp":
+                record.connect_s = now - began[step] # httpcore resolves DNS inside connect_tcp
+            elif step == "connection.start_tls":
+                record.tls_s = now - began[step]
+            elif step.endswith("receive_response_headers"):
+                record.ttfb_s = record.since_start()
+    request.extensions["trace"] = trace
+
+def _httpx_trace_response(response) -> None:
+    record = metrics.current()
+    if record is not None:
+        record.status = response.status_code
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of pooled HTTP sessions and OpenAI SDK clients.
+
+    Streamlit runs each browser session on its own script thread inside one
+    Python process, so a registry stored at module level is shared by every
+    user. Sessions are keyed by (provider, base_url) and OpenAI clients by
+    (api_key, base_url); both are created once under a lock and reused, so
+    later chat turns ride on already-open keep-alive connections instead of
+    paying a fresh TCP+TLS handshake.
+
+    requests.Session and the urllib3 pools underneath it are safe to share
+    between threads for plain request/response usage like ours (no per-user
+    cookies or mutable session headers are set after creation).
+    """
+
+    def __init__(self, config: PoolConfig | None = None):
+        self._config = config or PoolConfig()
+        self._lock = threading.Lock()
+        self._sessions: dict[tuple[str, str], requests.Session] = {}
+        self._openai_clients: dict[tuple[str, str | None], object] = {}
+        self._counters = {
+            "sessions_created": 0,
+            "session_reuses": 0,
+            "openai_clients_created": 0,
+            "openai_client_reuses": 0,
+        }
+
+    @property
+    def config(self) -> PoolConfig:
+        return self._config
+
+    def configure(self, config: PoolConfig) -> None:
+        """Replaces the pool settings. Existing clients are closed and rebuilt lazily."""
+        with self._lock:
+            self._config = config
+            self._close_all_locked()
+
+    # --- HTTP Sessions ---
+
+    def get_session(self, provider: str, base_url: str) -> requests.Session:
+        """Returns the shared pooled session for a provider/base URL pair, creating it on first use."""
+        key = (provider, base_url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._counters["session_reuses"] += 1
+                return session
+            session = self._build_session()
+            self._sessions[key] = session
+            self._counters["sessions_created"] += 1
+            return session
+
+    def _build_session(self) -> requests.Session:
+        cfg = self._config
+        adapter = TimedHTTPAdapter(
+            pool_connections=cfg.pool_connections,
+            pool_maxsize=cfg.pool_maxsize,
+            pool_block=cfg.pool_block,
+            max_retries=0, # Retries are decided by the caller, not hidden inside the pool
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Connection"] = "keep-alive" if cfg.keep_alive else "close"
+        return session
+
+    # --- OpenAI SDK Clients ---
+
+    def get_openai_client(self, api_key: str, base_url: str | None = None):
+        """Returns a cached openai.OpenAI client for this key (and optional base URL)."""
+        key = (api_key, base_url)
+        with self._lock:
+            client = self._openai_clients.get(key)
+            if client is not None:
+                self._counters["openai_client_reuses"] += 1
+                return client
+            import openai # Imported here so callers that never use OpenAI don't pay for it
+            import httpx
+            cfg = self._config
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=cfg.pool_maxsize,
+                    max_keepalive_connections=cfg.pool_maxsize if cfg.keep_alive else 0,
+                ),
+                timeout=httpx.Timeout(cfg.read_timeout, connect=cfg.connect_timeout),
+                event_hooks={"request": [_httpx_trace_request], "response": [_httpx_trace_response]},
+            )
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            self._openai_clients[key] = client
+            self._counters["openai_clients_created"] += 1
+            return client
+
+    # --- Stats / Lifecycle ---
+
+    def stats(self) -> dict:
+        """
+        Snapshot of registry and connection-pool counters.
+
+        `connections_opened` is the number of sockets urllib3 actually created and
+        `requests_sent` the number of requests pushed through those pools; the
+        difference is `connections_reused`.
+        """
+        with self._lock:
+            snapshot = dict(self._counters)
+            sessions = list(self._sessions.items())
+        per_session = {}
+        total_opened = total_sent = 0
+        for (provider, base_url), session in sessions:
+            opened, sent = _pool_counts(session)
+            per_session[f"{provider} {base_url}"] = {
+                "connections_opened": opened,
+                "requests_sent": sent,
+                "connections_reused": max(sent - opened, 0),
+            }
+            total_opened += opened
+            total_sent += sent
+        snapshot["connections_opened"] = total_opened
+        snapshot["requests_sent"] = total_sent
+        snapshot["connections_reused"] = max(total_sent - total_opened, 0)
+        snapshot["sessions"] = per_session
+        return snapshot
+
+    def close(self) -> None:
+        """Closes every pooled session and client."""
+        with self._lock:
+            self._close_all_locked()
+
+    def _close_all_locked(self) -> None:
+        for session in self._sessions.values():
+            session.close()
+        for client in self._openai_clients.values():
+            try: client.close()
+            except Exception: pass
+        self._sessions.clear()
+        self._openai_clients.clear()
+
+
+def _pool_counts(session: requests.Session) -> tuple[int, int]:
+    """Sums urllib3's per-host connection/request counters over a session's adapters."""
+    opened = sent = 0
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            opened += getattr(pool, "num_connections", 0)
+            sent += getattr(pool, "num_requests", 0)
+    return opened, sent
+
+
+# --- Module-Level Registry ---
+# One registry per process, shared across Streamlit sessions and threads.
+registry = ClientRegistry()
+
+def get_session(provider: str, base_url: str) -> requests.Session:
+    return registry.get_session(provider, base_url)
+
+def get_openai_client(api_key: str, base_url: str | None = None):
+    return registry.get_openai_client(api_key, base_url)
+
+def configure_pools(**kwargs) -> None:
+    """Rebuilds the shared registry with new PoolConfig values, e.g. configure_pools(pool_maxsize=64)."""
+    registry.configure(PoolConfig(**kwargs))
+
+def request_timeout() -> tuple[float, float]:
+    return registry.config.timeout
+
+def pool_stats() -> dict:
+    return registry.stats()
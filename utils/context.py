@@ -0,0 +1,137 @@
+# utils/context.py
+
+import itertools
+from dataclasses import dataclass, field
+
+from utils.providers import PROVIDERS
+
+# --- Per-Model Context Windows (tokens) ---
+# Declared per adapter in utils/providers.py.
+DEFAULT_CONTEXT_WINDOW = 8_192
+
+def context_window(model: str) -> int:
+    adapter = PROVIDERS.get(model)
+    return adapter.capabilities.context_window if adapter else DEFAULT_CONTEXT_WINDOW
+
+# Per-conversation ceiling applied on top of the model window, so very large
+# windows (Claude) don't let request size and latency grow without limit.
+DEFAULT_HISTORY_BUDGET = 8_000
+MESSAGE_OVERHEAD_TOKENS = 4 # Role markers/separators each provider adds per message
+SUMMARY_BUDGET_TOKENS = 400
+
+# --- Token Estimation ---
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap, tokenizer-free token estimate (~4 characters per token for English/code).
+
+    Providers use different tokenizers, so an exact count for one would be wrong
+    for the others anyway; the safety margin in build_context absorbs the error.
+    """
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+_message_ids = itertools.count(1)
+
+@dataclass(slots=True)
+class ChatMessage:
+    """One chat turn. The token estimate is computed once at creation and reused every turn."""
+    role: str
+    content: str
+    id: int = field(default_factory=lambda: next(_message_ids))
+    tokens: int = -1
+
+    def __post_init__(self):
+        if self.tokens < 0:
+            self.tokens = estimate_tokens(self.content)
+
+    def as_dict(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+# --- Budgeting ---
+
+def history_budget(model: str, max_tokens: int, prompt_tokens: int,
+                   cap: int | None = DEFAULT_HISTORY_BUDGET, safety: float = 0.9) -> int:
+    """
+    Tokens available for earlier turns: the model window (times a safety margin)
+    minus the reply reservation (max_tokens) and the new prompt, capped at `cap`.
+    """
+    window = int(context_window(model) * safety)
+    available = window - max_tokens - prompt_tokens
+    if cap is not None:
+        available = min(available, cap)
+    return max(available, 0)
+
+def summarize_turns(history: list[ChatMessage], end: int, budget: int = SUMMARY_BUDGET_TOKENS) -> str:
+    """
+    Extractive roll-up of the turns in history[:end] that no longer fit: the first
+    line of each dropped message, newest first, until the summary budget is spent.
+    Only as many messages as fit the budget are read, so cost doesn't grow with history.
+    """
+    lines = []
+    used = 0
+    for index in range(end - 1, -1, -1):
+        message = history[index]
+        first_line = message.content.strip().split("\n", 1)[0][:200]
+        if not first_line:
+            continue
+        line = f"- {message.role}: {first_line}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return ""
+    lines.reverse()
+    return "Summary of earlier conversation (older turns omitted):\n" + "\n".join(lines)
+
+def build_context(history: list[ChatMessage], model: str, max_tokens: int, prompt: str,
+                  cap: int | None = DEFAULT_HISTORY_BUDGET, summarize: bool = True) -> list[dict]:
+    """
+    Picks the most recent turns that fit the model's budget, oldest first.
+
+    Walks history from the newest message backwards summing cached token counts
+    and stops at the first message that doesn't fit, so per-turn cost is bounded
+    by the window size, not the conversation length. Older turns are dropped or,
+    if `summarize` is set, rolled into a short summary prepended to the window.
+
+    Args:
+        history (list[ChatMessage]): Earlier turns, oldest first (without the new prompt).
+        model (str): Display model name, used to look up the context window.
+        max_tokens (int): Tokens reserved for the reply.
+        prompt (str): The new user prompt (counted against the budget).
+        cap (int | None): Extra per-conversation ceiling on history tokens.
+        summarize (bool): Roll dropped turns into a summary instead of discarding them.
+
+    Returns:
+        list[dict]: {"role", "content"} messages to pass as `history` to get_response.
+    """
+    budget = history_budget(model, max_tokens, estimate_tokens(prompt), cap)
+    if summarize:
+        budget -= SUMMARY_BUDGET_TOKENS
+    used = 0
+    start = len(history)
+    while start > 0 and used + history[start - 1].tokens <= budget:
+        start -= 1
+        used += history[start].tokens
+
+    # Providers expect the conversation to open with a user turn.
+    while start < len(history) and history[start].role != "user":
+        start += 1
+    window = []
+    for message in history[start:]:
+        if window and window[-1]["role"] == message.role:
+            # Merge same-role neighbours (e.g. a prompt whose reply failed) so roles alternate
+            window[-1] = {"role": message.role, "content": f"{window[-1]['content']}\n\n{message.content}"}
+        else:
+            window.append(message.as_dict())
+
+    if summarize and start > 0:
+        summary = summarize_turns(history, start)
+        if summary:
+            if window:
+                window[0] = {"role": "user", "content": f"{summary}\n\n{window[0]['content']}"}
+            else:
+                # Nothing recent fits: carry the summary as a user/assistant pair so roles still alternate
+                window = [{"role": "user", "content": summary}, {"role": "assistant", "content": "Understood."}]
+    return window
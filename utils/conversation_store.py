@@ -0,0 +1,327 @@
+# utils/conversation_store.py
+"""
+Persistent conversation store (SQLite, WAL mode).
+
+Writes never block the UI: append_message()/create_session() enqueue the
+change and a background writer thread commits queued changes in batches, one
+transaction per batch. Each change runs in its own savepoint, so a bad one
+(e.g. a message for a deleted session) is dropped alone; a batch that can't
+get the write lock is retried until it can. Other database errors (read-only
+file, disk I/O) are retried a few times, then the batch is dropped and counted
+as failed, so the writer never wedges.
+
+Reads use a separate connection (WAL lets them run while the writer commits)
+and see committed changes only; they never wait for the writer. They are
+paged by message sequence number, so reopening a long conversation loads only
+its newest messages; older pages are fetched on demand.
+
+Every session belongs to an owner id (a login identity or a browser session)
+and reads are scoped to it: callers only ever list or load their own chats.
+
+One store per database file is shared by every Streamlit session in the
+process (see get_store()).
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from utils.context import ChatMessage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL DEFAULT '', -- Who may list and read it; rows from before owners existed match nobody
+    title TEXT NOT NULL DEFAULT '',
+    model TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL, -- 0, 1, 2, ... within the session
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq) -- Clustered: a session's messages are stored together, in order
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at);
+"""
+_OWNER_INDEX = "CREATE INDEX IF NOT EXISTS idx_sessions_owner_updated ON sessions(owner, updated_at DESC)"
+
+TITLE_CHARS = 80
+BUSY_TIMEOUT_S = 5.0 # How long a statement waits for another connection's lock
+RETRY_MAX_DELAY_S = 2.0 # Cap on the writer's backoff while the database stays locked
+MAX_COMMIT_ATTEMPTS = 3 # For errors other than locked/busy, which retrying rarely fixes
+
+
+@dataclass(frozen=True, slots=True)
+class SessionInfo:
+    id: str
+    title: str
+    model: str | None
+    created_at: float
+    updated_at: float
+    message_count: int
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, check_same_thread=False, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_S * 1000)}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; only the last commits can be lost on power failure
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Brings databases created by earlier versions up to the current schema."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if "owner" not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+    conn.execute("DROP INDEX IF EXISTS idx_sessions_updated") # Superseded by the per-owner index
+    conn.execute(_OWNER_INDEX)
+
+
+def _is_locked(error: sqlite3.Error) -> bool:
+    """True when another connection holds the lock (worth waiting out)."""
+    name = getattr(error, "sqlite_errorname", "") or ""
+    return name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED")) or "locked" in str(error) or "busy" in str(error)
+
+
+class ConversationStore:
+    """
+    Sessions and messages in one SQLite file.
+
+    Args:
+        path (str): Database file (created if missing).
+        batch_size (int): Max queued writes committed in one transaction.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue()
+        self._write_conn = _connect(path)
+        self._write_conn.executescript(_SCHEMA)
+        _migrate(self._write_conn)
+        self._read_conn = _connect(path)
+        self._read_lock = threading.Lock()
+        self._closed = False
+        self._next_seq: dict[str, int] = {} # Sequence numbers are assigned at enqueue time
+        self._seq_lock = threading.Lock()
+        self.batches = self.writes = self.failed = self.retries = 0
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-store-writer", daemon=True)
+        self._writer.start()
+
+    # --- Writes (queued) ---
+
+    def create_session(self, owner: str, title: str = "", model: str | None = None) -> str:
+        """Returns the new session id immediately; the row (owned by `owner`) is written in the background."""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._seq_lock:
+            self._next_seq[session_id] = 0
+        self._queue.put(("session", (session_id, owner, title[:TITLE_CHARS], model, now, now)))
+        return session_id
+
+    def append_message(self, session_id: str, message: ChatMessage) -> int:
+        """Queues the message and returns its sequence number within the session."""
+        with self._seq_lock:
+            seq = self._next_seq.get(session_id)
+        if seq is None: # First append since this process opened the store (and never loaded the session)
+            (start,), = self._read("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?", (session_id,))
+            self._seed_seq(session_id, start)
+        with self._seq_lock:
+            seq = self._next_seq[session_id]
+            self._next_seq[session_id] = seq + 1
+        self._queue.put(("message", (session_id, seq, message.role, message.content, message.tokens, time.time())))
+        return seq
+
+    def _seed_seq(self, session_id: str, next_seq: int) -> None:
+        with self._seq_lock:
+            self._next_seq.setdefault(session_id, next_seq) # Appends queued in the meantime win
+
+    def rename_session(self, session_id: str, title: str) -> None:
+        self._queue.put(("rename", (title[:TITLE_CHARS], session_id)))
+
+    def delete_session(self, session_id: str) -> None:
+        with self._seq_lock:
+            self._next_seq.pop(session_id, None)
+        self._queue.put(("delete", (session_id,)))
+
+    def flush(self) -> None:
+        """Blocks until every queued write is committed."""
+        self._queue.join()
+
+    def _write_loop(self) -> None:
+        while True:
+            op = self._queue.get()
+            if op is None:
+                self._queue.task_done()
+                return
+            batch = [op]
+            while len(batch) < self.batch_size: # Everything already queued goes into the same transaction
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._queue.put(None) # Handle shutdown after this batch
+                    self._queue.task_done()
+                    break
+                batch.append(op)
+            try:
+                self._commit_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit_with_retry(self, batch: list) -> None:
+        """
+        Commits the batch. Locks held by other connections are waited out
+        (backing off) however long they last; any other error gets
+        MAX_COMMIT_ATTEMPTS tries, then the batch is dropped and counted in
+        `failed`, so one broken database can't stall the queue forever.
+        """
+        delay = 0.05
+        attempts = 0
+        while True:
+            try:
+                self._commit(batch)
+                return
+            except sqlite3.Error as e:
+                if not _is_locked(e):
+                    attempts += 1
+                if attempts >= MAX_COMMIT_ATTEMPTS:
+                    self.failed += len(batch)
+                    print(f"ConversationStore: dropped {len(batch)} change(s) after {attempts} attempts: {e}")
+                    return
+                self.retries += 1
+                if self.retries == 1 or self.retries % 20 == 0:
+                    print(f"ConversationStore: retrying {len(batch)} change(s) after: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY_S)
+
+    def _commit(self, batch: list) -> None:
+        conn = self._write_conn
+        touched: dict[str, tuple[int, float]] = {} # session -> (new messages, last timestamp)
+        failed = 0
+        conn.execute("BEGIN IMMEDIATE") # Take the write lock up front, so the busy timeout applies here
+        try:
+            for kind, args in batch:
+                conn.execute("SAVEPOINT change")
+                try:
+                    if kind == "session":
+                        conn.execute("INSERT OR IGNORE INTO sessions (id, owner, title, model, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)", args)
+                    elif kind == "message":
+                        conn.execute("INSERT OR REPLACE INTO messages (session_id, seq, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)", args)
+                    elif kind == "rename":
+                        conn.execute("UPDATE sessions SET title = ? WHERE id = ?", args)
+                    elif kind == "delete":
+                        conn.execute("DELETE FROM sessions WHERE id = ?", args)
+                except sqlite3.OperationalError:
+                    raise # Not this change's fault: retry the whole batch
+                except sqlite3.Error as e: # This change is invalid (e.g. its session is gone): drop it alone
+                    conn.execute("ROLLBACK TO change")
+                    conn.execute("RELEASE change")
+                    failed += 1
+                    print(f"ConversationStore: dropped {kind} change for session {args[0] if kind != 'rename' else args[1]}: {e}")
+                    continue
+                conn.execute("RELEASE change")
+                if kind == "message":
+                    count, _ = touched.get(args[0], (0, 0.0))
+                    touched[args[0]] = (count + 1, args[5])
+                elif kind == "delete":
+                    touched.pop(args[0], None)
+            for session_id, (count, updated_at) in touched.items():
+                conn.execute(
+                    "UPDATE sessions SET message_count = message_count + ?, updated_at = ? WHERE id = ?",
+                    (count, updated_at, session_id),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self.batches += 1
+        self.writes += len(batch) - failed
+        self.failed += failed
+
+    # --- Reads (paged) ---
+
+    def _read(self, sql: str, args: tuple = ()) -> list:
+        """Sees committed changes only; call flush() first when queued writes must be visible."""
+        with self._read_lock:
+            return self._read_conn.execute(sql, args).fetchall()
+
+    def list_sessions(self, owner: str, limit: int = 20, offset: int = 0) -> list[SessionInfo]:
+        """`owner`'s sessions, most recently updated first."""
+        rows = self._read(
+            "SELECT id, title, model, created_at, updated_at, message_count FROM sessions "
+            "WHERE owner = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?", (owner, limit, offset),
+        )
+        return [SessionInfo(*row) for row in rows]
+
+    def get_session(self, session_id: str, owner: str) -> SessionInfo | None:
+        """The session, or None if it doesn't exist or belongs to someone else."""
+        rows = self._read(
+            "SELECT id, title, model, created_at, updated_at, message_count FROM sessions WHERE id = ? AND owner = ?",
+            (session_id, owner),
+        )
+        return SessionInfo(*rows[0]) if rows else None
+
+    def load_messages(self, session_id: str, owner: str, limit: int = 100,
+                      before_seq: int | None = None) -> tuple[list[ChatMessage], int]:
+        """
+        Returns up to `limit` messages (oldest first) preceding `before_seq`
+        (None = the newest messages) and the sequence number of the first one.
+        Sequence numbers are dense, so that number is also the count of earlier
+        messages still in the store (0 = start of the conversation reached).
+        A session that belongs to someone else reads as empty.
+        """
+        rows = self._read(
+            "SELECT m.seq, m.role, m.content, m.tokens FROM messages m JOIN sessions s ON s.id = m.session_id "
+            "WHERE m.session_id = ? AND s.owner = ? AND m.seq < ? ORDER BY m.seq DESC LIMIT ?",
+            (session_id, owner, before_seq if before_seq is not None else 2 ** 63 - 1, limit),
+        )
+        messages = [ChatMessage(role, content, tokens=tokens) for _, role, content, tokens in reversed(rows)]
+        if rows and before_seq is None:
+            self._seed_seq(session_id, rows[0][0] + 1) # Newest page: appends continue after its last message
+        first_seq = rows[-1][0] if rows else (before_seq or 0)
+        return messages, first_seq
+
+    def stats(self) -> dict:
+        (sessions,), = self._read("SELECT COUNT(*) FROM sessions")
+        (messages,), = self._read("SELECT COUNT(*) FROM messages")
+        return {"sessions": sessions, "messages": messages, "batches": self.batches, "writes": self.writes,
+                "failed": self.failed, "retries": self.retries, "queued": self._queue.qsize(), "path": self.path}
+
+    def close(self) -> None:
+        """Commits pending writes and closes both connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._write_conn.close()
+        with self._read_lock:
+            self._read_conn.close()
+
+
+# --- Process-Wide Stores ---
+_stores: dict[str, ConversationStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(path: str) -> ConversationStore:
+    """The shared store for `path`, opened on first use."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ConversationStore(path)
+        return store
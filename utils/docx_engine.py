@@ -0,0 +1,148 @@
+# utils/docx_engine.py
+"""
+Streaming DOCX text extraction.
+
+Reads the main document part (word/document.xml) straight from the archive
+with lxml's incremental parser instead of building python-docx's object model.
+Paragraphs and table rows are produced as a generator in document order, and
+each top-level block is freed once handled, so memory stays bounded by the
+largest single paragraph or table rather than by the document size.
+"""
+
+import io
+import posixpath
+import zipfile
+from typing import Iterator
+from xml.etree import ElementTree
+
+_NAMESPACES = (
+    "http://schemas.openxmlformats.org/wordprocessingml/2006/main", # Transitional (what Word writes)
+    "http://purl.oclc.org/ooxml/wordprocessingml/main", # Strict
+)
+_RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+DEFAULT_MAIN_PART = "word/document.xml"
+
+
+class _Tags:
+    """Clark-notation tag names for one WordprocessingML namespace."""
+
+    def __init__(self, namespace: str):
+        w = f"{{{namespace}}}"
+        self.body, self.p, self.tbl, self.tr, self.tc, self.t = (w + name for name in ("body", "p", "tbl", "tr", "tc", "t"))
+        self.inline = {w + "tab": "\t", w + "br": "\n", w + "cr": "\n", w + "noBreakHyphen": "-"}
+        self.runs = (self.t, *self.inline) # What a paragraph's text is made of
+        self.cell_content = (self.p, *self.runs)
+
+_TAGS = {namespace: _Tags(namespace) for namespace in _NAMESPACES}
+_BLOCKS = tuple(tag for tags in _TAGS.values() for tag in (tags.p, tags.tbl))
+
+
+def _main_part_name(archive: zipfile.ZipFile) -> str:
+    """Resolves the officeDocument part from the package relationships (almost always word/document.xml)."""
+    try:
+        with archive.open("_rels/.rels") as handle:
+            for rel in ElementTree.parse(handle).getroot().iter(f"{_RELS_NS}Relationship"):
+                if rel.get("Type", "").endswith("/officeDocument"):
+                    return posixpath.normpath(rel.get("Target", DEFAULT_MAIN_PART)).lstrip("/")
+    except (KeyError, ElementTree.ParseError):
+        pass
+    return DEFAULT_MAIN_PART
+
+
+def _paragraph_text(paragraph, tags: _Tags) -> str:
+    t, inline = tags.t, tags.inline
+    return "".join((node.text or "") if node.tag == t else inline[node.tag] for node in paragraph.iter(*tags.runs))
+
+
+def _squash(parts: list[str]) -> str:
+    return " ".join("".join(parts).split())
+
+
+def _table_rows(table, tags: _Tags) -> Iterator[str]:
+    """
+    The table's rows as "| cell | cell |", in one pass over the table. A cell's
+    paragraphs (and the rows of any table nested in it) are joined by spaces.
+    """
+    cells: list[str] | None = None # Finished cells of the current row
+    parts: list[str] | None = None # Text of the current cell
+    for node in table.iter(tags.tr, tags.tc, *tags.cell_content):
+        tag = node.tag
+        if tag == tags.t:
+            if parts is not None:
+                parts.append(node.text or "")
+        elif tag in tags.inline:
+            if parts is not None:
+                parts.append(tags.inline[tag])
+        elif tag == tags.tr and node.getparent() == table:
+            if cells is not None:
+                yield "| " + " | ".join(cells + ([_squash(parts)] if parts is not None else [])) + " |"
+            cells, parts = [], None
+        elif tag == tags.tc and cells is not None and node.getparent().getparent() == table:
+            if parts is not None:
+                cells.append(_squash(parts))
+            parts = []
+        elif parts is not None:
+            parts.append(" ") # Paragraph, or a row/cell of a nested table
+    if cells is not None:
+        yield "| " + " | ".join(cells + ([_squash(parts)] if parts is not None else [])) + " |"
+
+
+def iter_docx_blocks(file_content) -> Iterator[tuple[str, str]]:
+    """
+    Yields ("paragraph", text) and ("row", text) blocks in document order.
+
+    Table rows are rendered as "| cell | cell |" with a cell's paragraphs (and
+    any nested table) joined by spaces. Text in text boxes is kept, deleted
+    revisions and field codes are not.
+
+    Args:
+        file_content (bytes | file object): The DOCX archive.
+    """
+    from lxml import etree # Installed with python-docx
+    source = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray, memoryview)) else file_content
+    with zipfile.ZipFile(source) as archive, archive.open(_main_part_name(archive)) as xml:
+        # Only paragraph/table end events reach Python; the tag matching happens in libxml2
+        for _, elem in etree.iterparse(xml, events=("end",), tag=_BLOCKS, resolve_entities=False, huge_tree=True):
+            tags = _TAGS[elem.tag[1:elem.tag.index("}")]]
+            parent = elem.getparent()
+            if parent.tag == tags.tc or (parent.tag != tags.body and next(elem.iterancestors(tags.p, tags.tbl), None) is not None):
+                continue # Inside a table or text box: handled with its top-level block
+            if elem.tag == tags.tbl:
+                for row in _table_rows(elem, tags):
+                    yield "row", row
+            else:
+                yield "paragraph", _paragraph_text(elem, tags)
+            # Handled: free the block and the already-emptied siblings before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def extract_docx_text(file_content, max_bytes: int | None = None) -> str:
+    """
+    Extracts the text of a DOCX (paragraphs and table rows, one per line).
+
+    Args:
+        file_content (bytes | file object): The DOCX archive.
+        max_bytes (int | None): Stop once this many UTF-8 bytes of text were
+            collected; the last block is truncated to fit.
+
+    Returns:
+        str: The text, each block followed by a newline.
+    """
+    parts = []
+    used = 0
+    blocks = iter_docx_blocks(file_content)
+    try:
+        for _, text in blocks:
+            line = text + "\n"
+            if max_bytes is not None:
+                size = len(line.encode("utf-8"))
+                if used + size > max_bytes:
+                    parts.append(line.encode("utf-8")[: max_bytes - used].decode("utf-8", errors="ignore"))
+                    break
+                used += size
+            parts.append(line)
+    finally:
+        blocks.close()
+    return "".join(parts)
@@ -0,0 +1,29 @@
+# utils/errors.py
+
+# Define custom exception for API errors for clarity
+class APIError(Exception):
+    """
+    Custom exception class for API related errors.
+
+    Optional attributes let callers react to the failure without parsing the message:
+        status (int | None): HTTP status from the provider, if there was a response.
+        provider (str | None): Provider group that failed (e.g. "Claude", "NVIDIA").
+        retry_after (float | None): Seconds the provider asked us to wait (Retry-After header).
+        transient (bool): True for failures worth retrying (network errors, 429, 5xx).
+    """
+    def __init__(self, message: str = "", status: int | None = None, provider: str | None = None,
+                 retry_after: float | None = None, transient: bool | None = None):
+        super().__init__(message)
+        self.status = status
+        self.provider = provider
+        self.retry_after = retry_after
+        self.transient = is_transient_status(status) if transient is None else transient
+
+class RequestCancelled(Exception):
+    """The request was aborted by its owner (e.g. a hedged request that lost the race); not a provider failure."""
+
+# HTTP statuses that indicate overload or a temporary upstream problem
+TRANSIENT_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 529})
+
+def is_transient_status(status: int | None) -> bool:
+    return status in TRANSIENT_STATUSES
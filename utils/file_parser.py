@@ -1,26 +1,57 @@
-import streamlit as st
-import fitz  # PyMuPDF
-from docx import Document
 import json
-import nbformat
-from zipfile import ZipFile
-from PIL import Image
 import io
 import base64
 import os
+from typing import TYPE_CHECKING
+
+# Heavy parser libraries (PyMuPDF, python-docx, nbformat, Pillow) and Streamlit
+# itself are imported inside the functions that need them, so importing this
+# module is cheap and headless tools only pay for the formats they touch.
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Consider adding OCR libraries if needed (e.g., pytesseract, easyocr)
 # import pytesseract
 # from pdf2image import convert_from_bytes # If processing PDF images
 
+def _report_error(message: str) -> None:
+    """
+    Shows a parse error in the Streamlit UI (imports Streamlit on first use).
+    Outside a script run (worker threads, headless tools) the error is printed instead.
+    """
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx(suppress_warning=True) is None:
+        print(message)
+        return
+    st.error(message)
+
+# What the parse_* functions return instead of raising; never content to keep or index
+PARSE_ERROR_RESULTS = frozenset({
+    "Error parsing PDF.", "Error parsing DOCX.", "Error parsing TXT.",
+    "Error parsing IPYNB.", "Error parsing Image.", "Error parsing ZIP.",
+})
+
+UNSUPPORTED_PREFIX = "Unsupported file type:"
+
+def is_parse_error(content) -> bool:
+    """True for a parser's error placeholder or the unsupported-type message."""
+    return isinstance(content, str) and (content in PARSE_ERROR_RESULTS or content.startswith(UNSUPPORTED_PREFIX))
 
-def parse_pdf(file_content: bytes) -> str:
-    """Extracts text content from a PDF file."""
-    text = ""
+
+def parse_pdf(file_content: bytes, max_pages: int | None = None, max_bytes: int | None = None,
+              workers: int = 1, progress=None) -> str:
+    """
+    Extracts text content from a PDF file.
+
+    Page-level extraction lives in utils/pdf_engine.py; pass `workers` > 1 to
+    split large documents across processes, `max_pages`/`max_bytes` to bound
+    the work, and `progress(pages_done, pages_total)` to report progress.
+    """
     try:
-        with fitz.open(stream=file_content, filetype="pdf") as doc:
-            for page in doc:
-                text += page.get_text()
+        from utils.pdf_engine import extract_pdf_text
+        text = extract_pdf_text(file_content, max_pages=max_pages, max_bytes=max_bytes,
+                                workers=workers, progress=progress)
         # Optional: Add image extraction/OCR here if needed
         # images = []
         # for page_num in range(len(doc)):
@@ -32,20 +63,30 @@ def parse_pdf(file_content: bytes) -> str:
         #         image_bytes = base_image["image"]
         #         # Process image_bytes (e.g., OCR)
     except Exception as e:
-        st.error(f"Error parsing PDF: {e}")
+        _report_error(f"Error parsing PDF: {e}")
         return "Error parsing PDF."
     return text
 
-def parse_docx(file_content: bytes) -> str:
-    """Extracts text content from a DOCX file."""
-    text = ""
+def parse_docx(file_content: bytes, max_bytes: int | None = None, fast: bool = True) -> str:
+    """
+    Extracts text content (paragraphs and table rows) from a DOCX file.
+
+    The streaming extractor in utils/docx_engine.py reads word/document.xml
+    incrementally; `fast=False`, or a document it can't read, falls back to
+    python-docx (paragraphs only).
+    """
+    if fast:
+        try:
+            from utils.docx_engine import extract_docx_text
+            return extract_docx_text(file_content, max_bytes=max_bytes)
+        except Exception as e:
+            print(f"Streaming DOCX extraction failed ({e}); falling back to python-docx.")
     try:
+        from docx import Document
         doc = Document(io.BytesIO(file_content))
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        # Optional: Add table extraction logic
+        text = "".join(para.text + "\n" for para in doc.paragraphs)
     except Exception as e:
-        st.error(f"Error parsing DOCX: {e}")
+        _report_error(f"Error parsing DOCX: {e}")
         return "Error parsing DOCX."
     return text
 
@@ -54,36 +95,51 @@ def parse_txt(file_content: bytes) -> str:
     try:
         return file_content.decode('utf-8', errors='ignore')
     except Exception as e:
-        st.error(f"Error parsing TXT: {e}")
+        _report_error(f"Error parsing TXT: {e}")
         return "Error parsing TXT."
 
-def parse_ipynb(file_content: bytes) -> str:
-    """Extracts code and markdown content from a Jupyter Notebook."""
-    content = ""
+def parse_ipynb(file_content: bytes, include_outputs: bool = False, max_output_chars: int = 2_000,
+                fast: bool = True) -> str:
+    """
+    Extracts code and markdown content from a Jupyter Notebook.
+
+    The fast reader (utils/notebook_reader.py) never decodes outputs or
+    attachments unless `include_outputs` asks for their text (capped at
+    `max_output_chars` per cell). Older notebooks, or `fast=False`, go through
+    nbformat.
+    """
+    if fast:
+        try:
+            from utils.notebook_reader import extract_notebook_text
+            return extract_notebook_text(file_content, include_outputs=include_outputs, max_output_chars=max_output_chars)
+        except Exception as e: # Malformed or unusual notebook: nbformat decides (and reports) instead
+            print(f"Fast notebook reader failed ({e}); falling back to nbformat.")
     try:
+        import nbformat
         notebook_str = file_content.decode('utf-8', errors='ignore')
         nb = nbformat.reads(notebook_str, as_version=4)
-        content += f"# Notebook: {nb.metadata.get('title', 'Untitled')}\n\n"
+        parts = [f"# Notebook: {nb.metadata.get('title', 'Untitled')}\n\n"]
         for cell in nb.cells:
             if cell.cell_type == 'markdown':
-                content += f"## Markdown Cell:\n{cell.source}\n\n"
+                parts.append(f"## Markdown Cell:\n{cell.source}\n\n")
             elif cell.cell_type == 'code':
-                content += f"## Code Cell:\n```python\n{cell.source}\n```\n"
-                # Optional: Include outputs if needed
-                # if 'outputs' in cell:
-                #     for output in cell.outputs:
-                #         if 'text' in output:
-                #             content += f"### Output:\n{output['text']}\n"
-                #         elif 'data' in output and 'text/plain' in output['data']:
-                #              content += f"### Output:\n{output['data']['text/plain']}\n"
-        return content
+                parts.append(f"## Code Cell:\n```python\n{cell.source}\n```\n")
+                if include_outputs:
+                    output = "\n".join(
+                        (o.get('text') or o.get('data', {}).get('text/plain') or '').strip("\n")
+                        for o in cell.get('outputs', [])
+                    ).strip("\n")[:max_output_chars]
+                    if output:
+                        parts.append(f"### Output:\n{output}\n")
+        return "".join(parts)
     except Exception as e:
-        st.error(f"Error parsing IPYNB: {e}")
+        _report_error(f"Error parsing IPYNB: {e}")
         return "Error parsing IPYNB."
 
-def parse_image(file_content: bytes) -> tuple[str, Image.Image | None]:
+def parse_image(file_content: bytes) -> tuple[str, "Image.Image | None"]:
     """Loads an image file and returns description and Pillow Image object."""
     try:
+        from PIL import Image
         img = Image.open(io.BytesIO(file_content))
         description = f"Image loaded: {img.format} format, {img.size} pixels."
         # Placeholder for potential OCR or other image analysis
@@ -91,56 +147,60 @@ def parse_image(file_content: bytes) -> tuple[str, Image.Image | None]:
         # description += f"\nOCR Text (if applicable): {ocr_text}"
         return description, img # Return description and the image object
     except Exception as e:
-        st.error(f"Error parsing Image: {e}")
+        _report_error(f"Error parsing Image: {e}")
         return "Error parsing Image.", None
 
-def parse_zip(file_content: bytes, filename: str) -> str:
-    """Lists contents of a ZIP file (does not extract recursively by default)."""
-    content_summary = f"Contents of ZIP file '{filename}':\n"
+def parse_zip(file_content, filename: str, limits=None, workers: int = 4) -> str:
+    """
+    Extracts and parses the members of a ZIP file, recursing into nested ZIPs.
+
+    `file_content` may be bytes or a seekable binary file object. Members are
+    parsed concurrently with size/count/depth caps (see utils/zip_ingest.py);
+    each member's text is kept under a heading with its path inside the archive.
+    """
     try:
-        with ZipFile(io.BytesIO(file_content)) as zf:
-            for file_info in zf.infolist():
-                content_summary += f"- {file_info.filename} ({file_info.file_size} bytes)\n"
-                # TODO: Optionally add logic here to extract specific file types
-                # from within the zip and parse them if needed.
-                # This can get complex quickly.
+        from utils.zip_ingest import format_members, ingest_zip
+        members = ingest_zip(file_content, limits=limits, workers=workers)
     except Exception as e:
-        st.error(f"Error parsing ZIP: {e}")
+        _report_error(f"Error parsing ZIP: {e}")
         return "Error parsing ZIP."
-    return content_summary
+    return format_members(members, filename)
 
 # --- Main Processing Function ---
 
+# Upper bounds for uploads processed in the UI (keeps one huge PDF from blocking a rerun)
+PDF_MAX_PAGES = 2_000
+PDF_MAX_TEXT_BYTES = 20 * 1024 * 1024
+DOCX_MAX_TEXT_BYTES = 20 * 1024 * 1024
+
 def process_uploaded_file(uploaded_file):
     """
     Processes an uploaded file based on its type and returns its content or representation.
     Returns a tuple: (content_representation, file_metadata)
     content_representation can be text, description string, or potentially image data
     file_metadata contains info like name, type, and potentially the raw image object
+
+    Results are cached by content hash (see utils/parse_cache.py), so Streamlit
+    reruns and repeat uploads of the same bytes skip parsing entirely.
     """
+    import streamlit as st
+    from utils.parse_cache import cache_key, content_digest, get_parsed, put_parsed
     file_content = uploaded_file.getvalue()
     file_type = uploaded_file.type
     file_name = uploaded_file.name
-    content = None
-    image_obj = None # To store PIL Image if it's an image file
 
-    st.info(f"Processing {file_name} ({file_type})...")
+    key = cache_key(_digest_for(uploaded_file, file_content, content_digest), _detect_kind(file_type, file_name), PARSER_VERSION)
+    cached = get_parsed(key)
+    if cached is not None:
+        content, stored_metadata = cached
+        image_obj = None
+        if stored_metadata.get("is_image"):
+            from PIL import Image
+            image_obj = Image.open(io.BytesIO(file_content)) # Lazy: reads the header only
+        return content, {**stored_metadata, "name": file_name, "size": uploaded_file.size, "image_obj": image_obj}
 
-    if file_type == "application/pdf":
-        content = parse_pdf(file_content)
-    elif file_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-        content = parse_docx(file_content)
-    elif file_type == "text/plain":
-        content = parse_txt(file_content)
-    elif file_type in ["image/jpeg", "image/png"]:
-        content, image_obj = parse_image(file_content) # Gets description and Image obj
-    elif file_name.endswith(".ipynb"): # Streamlit might not always detect type correctly
-         content = parse_ipynb(file_content)
-    elif file_type == "application/zip" or file_name.endswith(".zip"):
-        content = parse_zip(file_content, file_name)
-    else:
-        content = f"Unsupported file type: {file_type}. Cannot process."
-        st.warning(content)
+    st.info(f"Processing {file_name} ({file_type})...")
+    content, image_obj = _parse_by_type(file_content, file_type, file_name)
 
     file_metadata = {
         "name": file_name,
@@ -148,15 +208,86 @@ def process_uploaded_file(uploaded_file):
         "size": uploaded_file.size,
         "image_obj": image_obj, # Store the image object if available
     }
+    # Parse failures are reported as placeholder strings; don't pin those in the cache
+    if not is_parse_error(content):
+        put_parsed(key, content, {"type": file_type, "is_image": image_obj is not None})
 
     st.success(f"Finished processing {file_name}.")
     return content, file_metadata
 
 
+# Bump whenever a parser's output format changes, so stale cache entries are ignored.
+PARSER_VERSION = "3"
+
+# Digest memo per Streamlit upload id: reruns of the same upload don't even re-hash.
+_upload_digests: dict[str, str] = {}
+_UPLOAD_DIGESTS_MAX = 1_024
+
+def _digest_for(uploaded_file, file_content: bytes, content_digest) -> str:
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id and file_id in _upload_digests:
+        return _upload_digests[file_id]
+    digest = content_digest(file_content)
+    if file_id:
+        if len(_upload_digests) >= _UPLOAD_DIGESTS_MAX:
+            _upload_digests.pop(next(iter(_upload_digests)))
+        _upload_digests[file_id] = digest
+    return digest
+
+_TEXT_EXTENSIONS = (".txt", ".md", ".markdown")
+
+def _detect_kind(file_type: str, file_name: str) -> str:
+    """Normalised parser selector; part of the cache key."""
+    if file_type == "application/pdf":
+        return "pdf"
+    if file_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
+        return "docx"
+    if file_name.endswith(".ipynb"): # Streamlit might not always detect type correctly
+        return "ipynb"
+    if file_type.startswith("text/") or file_name.lower().endswith(_TEXT_EXTENSIONS): # text/plain, text/markdown, ...
+        return "txt"
+    if file_type in ["image/jpeg", "image/png"]:
+        return "image"
+    if file_type == "application/zip" or file_name.endswith(".zip"):
+        return "zip"
+    return f"unsupported:{file_type}"
+
+def _parse_by_type(file_content: bytes, file_type: str, file_name: str):
+    """Dispatches to the matching parser. Returns (content, image_obj)."""
+    import streamlit as st
+    kind = _detect_kind(file_type, file_name)
+    image_obj = None # To store PIL Image if it's an image file
+
+    if kind == "pdf":
+        # Opt-in process pool (PDF_WORKERS in secrets.toml): it only pays off for very large PDFs on multi-core hosts
+        workers = int(st.secrets.get("PDF_WORKERS", 1))
+        progress_bar = st.progress(0.0, text=f"Extracting {file_name}...")
+        content = parse_pdf(
+            file_content, max_pages=PDF_MAX_PAGES, max_bytes=PDF_MAX_TEXT_BYTES, workers=workers,
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"Extracting page {done}/{total}..."),
+        )
+        progress_bar.empty()
+    elif kind == "docx":
+        content = parse_docx(file_content, max_bytes=DOCX_MAX_TEXT_BYTES)
+    elif kind == "txt":
+        content = parse_txt(file_content)
+    elif kind == "image":
+        content, image_obj = parse_image(file_content) # Gets description and Image obj
+    elif kind == "ipynb":
+         content = parse_ipynb(file_content)
+    elif kind == "zip":
+        content = parse_zip(file_content, file_name)
+    else:
+        content = f"{UNSUPPORTED_PREFIX} {file_type}. Cannot process."
+        st.warning(content)
+    return content, image_obj
+
+
 # --- File Generation / Download ---
 
 def generate_download_link(content: str | bytes, filename: str, link_text: str) -> None:
     """Generates a Streamlit download button for text or bytes content."""
+    import streamlit as st
     if isinstance(content, str):
         data = content.encode('utf-8')
         mime = "text/plain"
@@ -0,0 +1,232 @@
+# utils/hedging.py
+"""
+Hedged requests and failover across equivalent models.
+
+A hedged request starts on the primary model. If no text has arrived within
+the hedge delay (a recent latency percentile of the primary), the same request
+is also sent to the best backup, and whichever model starts answering first
+wins; the other is cancelled. If a model fails with an APIError before any
+text arrives (after its own retries), the next backup in the failover order
+takes over.
+
+Backups are ranked from the in-memory metrics ring buffer (utils/metrics.py):
+healthy providers first, other providers before the primary's own, then by
+recent time to first token. Attempts that ended before any text (hedge losers,
+timeouts) count with their elapsed time, a lower bound on their real latency,
+so a model doesn't look fast just because its slow requests were cut short.
+
+Losers are cancelled through their CancelScope (utils/cancellation.py): the
+upstream connection is shut down right away, even before the first byte, so
+their thread and scheduler slot are released.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+from utils.cancellation import CancelScope, cancel_scope
+from utils.errors import APIError
+from utils.metrics import percentile, ring_buffer
+from utils.providers import get_adapter
+from utils.resilience import provider_health
+
+StreamOpener = Callable[[str, str], Iterator[str]] # (model, api_key) -> text deltas
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """
+    Args:
+        backups (dict): Candidate model name -> API key; the primary is ignored if listed.
+        percentile (float): Hedge once the primary is slower than this share of its recent requests.
+        min_delay, max_delay (float): Bounds for the computed hedge delay (seconds).
+        default_delay (float): Hedge delay while a model has fewer than `min_samples` recent requests.
+        min_samples (int): Recent successful requests needed before the percentile is trusted.
+        window_s (float): How far back latency stats look.
+        max_hedges (int): Backups started because of slowness (failovers are not counted).
+        failover (bool): Move on to the next backup when a model fails before answering.
+        needs_vision (bool): Only consider backups that accept images.
+        on_winner (callable | None): Called with the model whose answer is returned.
+    """
+    backups: dict[str, str] = field(default_factory=dict)
+    percentile: float = 95.0
+    min_delay: float = 0.5
+    max_delay: float = 10.0
+    default_delay: float = 3.0
+    min_samples: int = 20
+    window_s: float = 15 * 60
+    max_hedges: int = 1
+    failover: bool = True
+    needs_vision: bool = False
+    on_winner: Callable[[str], None] | None = None
+
+
+# --- Latency Stats ---
+
+_CANCELLED_ERRORS = ("cancelled", "RequestCancelled") # metrics.track() names for attempts we gave up on
+
+def _first_text_latencies(window_s: float) -> dict[str, list[float]]:
+    """
+    Per model: seconds until text was available (first token when streamed,
+    else the whole call). Attempts cancelled or cut off (no HTTP status) before
+    any text are censored samples: they count with their elapsed time.
+    """
+    samples: dict[str, list[float]] = {}
+    for record in ring_buffer.records(since=time.time() - window_s):
+        if record.total_s is None:
+            continue
+        if record.ok:
+            latency = record.first_token_s if record.first_token_s is not None else record.total_s
+        elif record.first_token_s is None and (record.error in _CANCELLED_ERRORS or record.status is None):
+            latency = record.total_s
+        else:
+            continue # An error reply (4xx/5xx) measures nothing about answer latency
+        samples.setdefault(record.model, []).append(latency)
+    return samples
+
+def hedge_delay(model: str, policy: HedgePolicy, samples: dict[str, list[float]] | None = None) -> float:
+    """Seconds to wait for the primary's first text before hedging."""
+    samples = _first_text_latencies(policy.window_s) if samples is None else samples
+    latencies = samples.get(model, [])
+    if len(latencies) < policy.min_samples:
+        return policy.default_delay
+    return min(max(percentile(latencies, policy.percentile), policy.min_delay), policy.max_delay)
+
+def failover_order(primary: str, policy: HedgePolicy, samples: dict[str, list[float]] | None = None) -> list[str]:
+    """Usable backups, best first; models whose circuit is open are left out."""
+    samples = _first_text_latencies(policy.window_s) if samples is None else samples
+    primary_provider = get_adapter(primary).provider
+    ranked = []
+    for model in policy.backups:
+        if model == primary:
+            continue
+        adapter = get_adapter(model)
+        health = provider_health(adapter.provider)
+        if health == "open" or (policy.needs_vision and not adapter.capabilities.vision):
+            continue
+        latencies = samples.get(model, [])
+        typical = percentile(latencies, 50) if latencies else policy.default_delay # Unknown: assume the default
+        ranked.append((health != "closed", adapter.provider == primary_provider, typical, model))
+    return [model for *_, model in sorted(ranked)]
+
+# --- Counters ---
+
+_counters = {"requests": 0, "hedges": 0, "failovers": 0, "backup_wins": 0, "cancelled": 0}
+_counters_lock = threading.Lock()
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+def hedging_stats() -> dict:
+    with _counters_lock:
+        return dict(_counters)
+
+# --- Racing ---
+
+class _Contender(threading.Thread):
+    """Runs one model's stream on its own thread, forwarding deltas to the coordinator's queue."""
+
+    def __init__(self, model: str, api_key: str, open_stream: StreamOpener, events: queue.Queue):
+        super().__init__(name=f"hedge-{model}", daemon=True)
+        self.model = model
+        self.api_key = api_key
+        self.open_stream = open_stream
+        self.events = events
+        self.cancelled = threading.Event()
+        self.scope = CancelScope()
+
+    def cancel(self) -> None:
+        """Stops this contender now: its upstream connection is aborted, even mid-wait."""
+        self.cancelled.set()
+        self.scope.cancel()
+
+    def run(self) -> None:
+        with cancel_scope(self.scope):
+            try:
+                deltas = self.open_stream(self.model, self.api_key)
+                try:
+                    for delta in deltas:
+                        if self.cancelled.is_set():
+                            return
+                        self.events.put((self, "delta", delta))
+                finally:
+                    deltas.close()
+                self.events.put((self, "done", None))
+            except Exception as e:
+                if not self.cancelled.is_set():
+                    self.events.put((self, "error", e))
+
+
+def hedged_stream(primary: str, api_key: str, open_stream: StreamOpener, policy: HedgePolicy) -> Iterator[str]:
+    """
+    Yields the text deltas of whichever model answers first (see module docstring).
+
+    Losing contenders are cancelled as soon as a winner is known.
+
+    Raises:
+        APIError: The last error, once every model in the failover order failed.
+        ValueError: From the primary (bad arguments are not failed over).
+    """
+    _count("requests")
+    samples = _first_text_latencies(policy.window_s)
+    delay = hedge_delay(primary, policy, samples)
+    backups = failover_order(primary, policy, samples)
+    keys = {**policy.backups, primary: api_key} # The caller's key for the primary always wins
+    events: queue.Queue = queue.Queue()
+    running: list[_Contender] = []
+    hedges_left = policy.max_hedges
+
+    def start(model: str) -> None:
+        contender = _Contender(model, keys[model], open_stream, events)
+        running.append(contender)
+        contender.start()
+
+    start(primary)
+    winner = None
+    hedge_at = time.monotonic() + delay
+    try:
+        while True:
+            can_hedge = winner is None and hedges_left > 0 and backups
+            try:
+                contender, kind, value = events.get(timeout=max(hedge_at - time.monotonic(), 0.0) if can_hedge else None)
+            except queue.Empty: # Nobody has answered within the hedge delay
+                hedges_left -= 1
+                _count("hedges")
+                start(backups.pop(0))
+                hedge_at = time.monotonic() + delay
+                continue
+            if contender.cancelled.is_set():
+                continue # Leftovers from a loser
+            if winner is None and kind in ("delta", "done"):
+                winner = contender
+                for other in running:
+                    if other is not winner:
+                        other.cancel()
+                        _count("cancelled")
+                if winner.model != primary:
+                    _count("backup_wins")
+                if policy.on_winner is not None:
+                    policy.on_winner(winner.model)
+            if kind == "delta":
+                yield value
+            elif kind == "done":
+                running.remove(winner) # Finished: its connection is back in the pool and must stay usable
+                return
+            elif contender is winner: # Failed mid-answer: text was already shown, so no failover
+                raise value
+            else:
+                running.remove(contender)
+                contender.cancel()
+                if running:
+                    continue # Another contender is still racing
+                if not (policy.failover and isinstance(value, APIError) and backups):
+                    raise value
+                _count("failovers")
+                start(backups.pop(0))
+                hedge_at = time.monotonic() + delay
+    finally:
+        for contender in running:
+            contender.cancel() # Consumer left early, or an error is propagating
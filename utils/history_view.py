@@ -0,0 +1,96 @@
+# utils/history_view.py
+"""
+Windowed rendering of the chat history.
+
+Streamlit re-runs app.py on every interaction, so drawing every past message
+makes each rerun (and the browser's element tree) grow with the conversation.
+Only the most recent page of messages is drawn; older pages are added on
+demand with a "Load earlier messages" button, which also pages in messages
+that live only in the conversation store. The per-message preparation
+(splitting very long answers into a preview plus an expander) is memoized by
+message id, so a rerun only touches the messages it actually shows.
+"""
+
+from dataclasses import dataclass
+
+from utils.cache import LRUCache
+
+DEFAULT_PAGE_SIZE = 30
+PREVIEW_CHARS = 6_000 # Longer messages show a preview; the remainder sits in a collapsed expander
+_PAGES_KEY = "history_pages"
+
+# --- Render Blocks ---
+
+@dataclass(frozen=True, slots=True)
+class RenderedBlock:
+    role: str
+    preview: str
+    rest: str | None = None # Remainder of a long message, shown on demand
+
+
+_blocks = LRUCache(max_entries=4_096, max_bytes=64 * 1024 * 1024,
+                   sizeof=lambda block: len(block.preview) + len(block.rest or "") + 64)
+
+def _split_long(content: str, limit: int) -> tuple[str, str | None]:
+    """Splits at a paragraph (or line) break before `limit`, keeping code fences balanced."""
+    if len(content) <= limit:
+        return content, None
+    cut = content.rfind("\n\n", 0, limit)
+    if cut < limit // 2:
+        cut = content.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = limit
+    preview, rest = content[:cut], content[cut:].lstrip("\n")
+    if preview.count("```") % 2: # Cut inside a code block: close it here, reopen in the remainder
+        preview += "\n```"
+        rest = "```\n" + rest
+    return preview, rest
+
+def render_block(message, preview_chars: int = PREVIEW_CHARS) -> RenderedBlock:
+    """Display form of one ChatMessage, memoized by message id (messages are never edited)."""
+    key = f"{message.id}:{preview_chars}"
+    block = _blocks.get(key)
+    if block is None:
+        preview, rest = _split_long(message.content, preview_chars)
+        block = RenderedBlock(message.role, preview, rest)
+        _blocks.set(key, block)
+    return block
+
+def render_cache_stats() -> dict:
+    return _blocks.stats()
+
+# --- Windowing ---
+
+def window_start(total: int, pages: int, page_size: int = DEFAULT_PAGE_SIZE) -> int:
+    """Index of the first message shown when `pages` pages (newest first) are loaded."""
+    return max(total - pages * page_size, 0)
+
+def render_history(history: list, page_size: int = DEFAULT_PAGE_SIZE,
+                   stored_earlier: int = 0, load_stored=None) -> None:
+    """
+    Draws the newest `page_size` messages (plus any earlier pages the user
+    loaded) into the current Streamlit container.
+
+    Args:
+        stored_earlier (int): Older messages that are persisted but not in `history`.
+        load_stored (callable | None): Prepends the next stored page to `history`;
+            offered once every in-memory message is shown.
+    """
+    import streamlit as st
+    pages = st.session_state.setdefault(_PAGES_KEY, 1)
+    start = window_start(len(history), pages, page_size)
+    hidden = start + (stored_earlier if load_stored is not None else 0)
+    if hidden:
+        def load_earlier():
+            if start == 0:
+                load_stored()
+            st.session_state[_PAGES_KEY] += 1
+        st.button(f"Load earlier messages ({hidden} hidden)", on_click=load_earlier, key="load_earlier_messages")
+
+    for message in history[start:]:
+        block = render_block(message)
+        with st.chat_message(block.role):
+            st.markdown(block.preview) # Use markdown to render formatting
+            if block.rest is not None:
+                with st.expander("Show the rest of this message"):
+                    st.markdown(block.rest)
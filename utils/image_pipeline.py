@@ -0,0 +1,172 @@
+# utils/image_pipeline.py
+"""
+Turns uploaded images into small, model-ready payloads for vision requests.
+
+Metadata comes from PIL's lazy header read (no pixel decode). Images larger
+than a provider can use are downscaled to its limits (JPEGs are decoded
+directly at reduced scale via draft mode) and re-encoded as JPEG/WebP under a
+byte budget. The base64 result is cached per content hash and limits, so a
+multi-megabyte photo is processed once and every later turn reuses the small
+payload. Pillow is only imported when an image is actually processed.
+"""
+
+import base64
+import hashlib
+import io
+from dataclasses import dataclass
+
+from utils.cache import LRUCache
+
+# Formats every vision provider accepts as-is (no re-encode needed when small enough)
+_PASSTHROUGH_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+_ENCODE_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+_QUALITY_STEPS = (85, 75, 65, 55, 45)
+_SHRINK_FACTOR = 0.75 # Applied when even the lowest quality step is over budget
+_MAX_SHRINK_ROUNDS = 6
+
+# --- Types ---
+
+@dataclass(frozen=True)
+class ImageInfo:
+    format: str | None
+    width: int
+    height: int
+    mode: str
+    bytes: int
+
+
+@dataclass(frozen=True)
+class ImageLimits:
+    """What one provider can make use of; larger images are downscaled to fit."""
+    max_edge: int = 1_568               # Longest side in pixels
+    max_short_edge: int | None = None   # Shortest side (OpenAI tiles to 768 px on the short side)
+    max_bytes: int = 1_000_000          # Encoded size budget per image
+    format: str = "JPEG"                # Re-encode format: "JPEG" or "WEBP"
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """A base64 payload ready to embed in a provider request."""
+    mime_type: str
+    data: str     # base64
+    width: int
+    height: int
+    size: int     # Encoded bytes (before base64)
+    digest: str   # sha256 of the original upload; identifies the image in cache keys
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.data}"
+
+    @property
+    def tokens(self) -> int:
+        """Rough prompt cost (providers bill ~1 token per 750 pixels)."""
+        return max(85, self.width * self.height // 750)
+
+# --- Header-Only Metadata ---
+
+def image_info(file_content: bytes) -> ImageInfo:
+    """Reads format, size and mode from the image header without decoding pixels."""
+    from PIL import Image
+    with Image.open(io.BytesIO(file_content)) as img:
+        return ImageInfo(img.format, img.width, img.height, img.mode, len(file_content))
+
+# --- Preparation ---
+
+_prepared = LRUCache(max_entries=256, max_bytes=64 * 1024 * 1024, sizeof=lambda image: len(image.data) + 256)
+
+def prepared_cache_stats() -> dict:
+    return _prepared.stats()
+
+
+def _target_size(width: int, height: int, limits: ImageLimits) -> tuple[int, int]:
+    scale = min(1.0, limits.max_edge / max(width, height))
+    if limits.max_short_edge:
+        scale = min(scale, limits.max_short_edge / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _flatten(img):
+    """RGB copy of `img`; transparent areas become white (JPEG has no alpha)."""
+    from PIL import Image
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB") if img.mode != "RGB" else img
+
+
+def prepare_image(file_content: bytes, limits: ImageLimits | None = None) -> PreparedImage:
+    """
+    Returns the image as a base64 payload that fits `limits`.
+
+    Images already within the pixel and byte limits, in a format every provider
+    accepts, are passed through untouched. Others are downscaled and re-encoded
+    with decreasing quality (then size) until they fit max_bytes.
+
+    Raises:
+        ValueError: If the bytes are not a readable image (unknown format,
+            truncated file, decompression bomb), or it can't be brought under
+            max_bytes.
+    """
+    limits = limits or ImageLimits()
+    digest = hashlib.sha256(file_content).hexdigest()
+    key = f"{digest}:{limits.max_edge}:{limits.max_short_edge}:{limits.max_bytes}:{limits.format}"
+    cached = _prepared.get(key)
+    if cached is not None:
+        return cached
+
+    from PIL import Image, UnidentifiedImageError
+    try:
+        prepared = _prepare(file_content, limits, digest)
+    except UnidentifiedImageError as e:
+        raise ValueError(f"Not a supported image: {e}") from e
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Image is too large to process: {e}") from e
+    except OSError as e: # Truncated or corrupt pixel data
+        raise ValueError(f"Image could not be decoded: {e}") from e
+    _prepared.set(key, prepared)
+    return prepared
+
+
+def _prepare(file_content: bytes, limits: ImageLimits, digest: str) -> PreparedImage:
+    from PIL import Image, ImageOps
+    img = Image.open(io.BytesIO(file_content)) # Header only until pixels are needed
+    target = _target_size(img.width, img.height, limits)
+    orientation = img.getexif().get(0x0112, 1) # EXIF rotation forces a re-encode so pixels are upright
+    if (img.format in _PASSTHROUGH_MIME and target == img.size and orientation == 1
+            and len(file_content) <= limits.max_bytes and not getattr(img, "is_animated", False)):
+        return PreparedImage(_PASSTHROUGH_MIME[img.format], base64.b64encode(file_content).decode("ascii"),
+                             img.width, img.height, len(file_content), digest)
+
+    if img.format == "JPEG":
+        img.draft("RGB", target) # DCT-domain downscale during decode: far less work for big photos
+    img = _flatten(ImageOps.exif_transpose(img))
+    target = _target_size(img.width, img.height, limits)
+    if img.size != target:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=3.0)
+
+    encode_format = limits.format if limits.format in _ENCODE_MIME else "JPEG"
+    for _ in range(_MAX_SHRINK_ROUNDS):
+        for quality in _QUALITY_STEPS:
+            buffer = io.BytesIO()
+            img.save(buffer, format=encode_format, quality=quality, optimize=encode_format == "JPEG")
+            if buffer.tell() <= limits.max_bytes:
+                break
+        else:
+            img = img.resize((max(1, int(img.width * _SHRINK_FACTOR)), max(1, int(img.height * _SHRINK_FACTOR))), Image.LANCZOS)
+            continue
+        break
+    else:
+        raise ValueError(f"Image could not be compressed under {limits.max_bytes:,} bytes "
+                         f"(smallest attempt: {buffer.tell():,} bytes)")
+    encoded = buffer.getvalue()
+    return PreparedImage(_ENCODE_MIME[encode_format], base64.b64encode(encoded).decode("ascii"),
+                         img.width, img.height, len(encoded), digest)
+
+
+def prepare_for_model(file_content: bytes, model: str) -> PreparedImage:
+    """prepare_image() with the image limits declared for `model` in utils/providers.py."""
+    from utils.providers import get_adapter
+    return prepare_image(file_content, get_adapter(model).capabilities.image_limits)
@@ -1,24 +1,173 @@
 # utils/llm_api.py
 
 import requests
-import openai # For OpenAI API
 import json # For parsing JSON responses and errors
-from openai import OpenAIError # Import the base error class for openai v1.x+
+import hashlib
+import contextlib
+import time
+from urllib.parse import urlsplit
 import traceback # For printing stack trace on unexpected errors
+from utils.client_pool import get_session, request_timeout
+from utils.cache import LRUCache, SQLiteStore, TieredCache
+from utils.errors import APIError, RequestCancelled # APIError is re-exported: app.py imports it from here
+from utils.cancellation import cancelled
+from utils.providers import PROVIDERS, get_adapter, error_from_response, supported_models
+from utils.resilience import manager as resilience
+from utils.context import estimate_tokens
+from utils.image_pipeline import prepare_for_model
+from utils.metrics import track
+from utils.scheduler import INTERACTIVE, scheduler
+from utils.hedging import HedgePolicy, hedged_stream
 
-# Define custom exception for API errors for clarity
-class APIError(Exception):
-    """Custom exception class for API related errors."""
-    pass
+# --- Pooled HTTP Helpers ---
 
-def get_response(prompt: str, model: str = "OpenAI", temperature: float = 0.5, max_tokens: int = 512, api_key: str = None):
+def _post(provider: str, url: str, headers: dict, payload: dict, stream: bool = False) -> requests.Response:
+    """POSTs JSON through the shared keep-alive session for this provider's host."""
+    parts = urlsplit(url)
+    session = get_session(provider, f"{parts.scheme}://{parts.netloc}")
+    return session.post(url, headers=headers, json=payload, timeout=request_timeout(), stream=stream)
+
+# --- Response Cache ---
+# Deterministic (temperature 0) completions are cached by default so repeated
+# prompts and Streamlit reruns don't pay for the same answer twice.
+
+_cache_settings = {"temperature_zero_only": True, "ttl": 24 * 3600}
+_response_cache = TieredCache(LRUCache(max_entries=512, max_bytes=32 * 1024 * 1024, ttl=_cache_settings["ttl"]))
+
+def configure_response_cache(max_entries: int = 512, max_bytes: int | None = 32 * 1024 * 1024,
+                             ttl: float | None = 24 * 3600, disk_path: str | None = None,
+                             temperature_zero_only: bool = True) -> None:
+    """
+    Replaces the process-wide response cache.
+
+    Args:
+        max_entries (int): Max completions kept in the in-memory LRU.
+        max_bytes (int | None): Approximate memory budget for cached texts.
+        ttl (float | None): Seconds a cached completion stays valid (None = forever).
+        disk_path (str | None): SQLite file for a persistent tier that survives restarts.
+        temperature_zero_only (bool): Only cache requests made at temperature 0.
+    """
+    global _response_cache
+    disk = SQLiteStore(disk_path, table="responses") if disk_path else None
+    _response_cache = TieredCache(LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl), disk)
+    _cache_settings.update(temperature_zero_only=temperature_zero_only, ttl=ttl)
+
+def response_cache_stats() -> dict:
+    return _response_cache.stats()
+
+def clear_response_cache() -> None:
+    _response_cache.clear()
+
+def _response_cache_key(model: str, messages: list[dict], temperature: float, max_tokens: int) -> str:
+    """sha256 over (provider, upstream model id, full message list, temperature, max_tokens)."""
+    raw = json.dumps(
+        [model, get_adapter(model).upstream_model, messages, float(temperature), int(max_tokens)],
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+        default=lambda image: f"image:{image.digest}:{image.size}", # PreparedImage: hash identity, not payload
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _is_cacheable(temperature: float, use_cache: bool) -> bool:
+    return use_cache and (temperature == 0 or not _cache_settings["temperature_zero_only"])
+
+def _build_messages(prompt: str, history: list[dict] | None, model: str | None = None,
+                    images: list[bytes] | None = None) -> list[dict]:
+    """
+    Earlier turns (already fitted to the context budget) followed by the new user prompt.
+    Images are attached to the new prompt only, prepared for `model`'s limits
+    (utils/image_pipeline.py), so earlier turns never resend them.
+    """
+    messages = list(history or [])
+    if messages and messages[-1]["role"] == "user":
+        # Previous prompt got no reply; fold it in so user/assistant roles keep alternating
+        messages[-1] = {"role": "user", "content": f"{messages[-1]['content']}\n\n{prompt}"}
+    else:
+        messages.append({"role": "user", "content": prompt})
+    if images:
+        if not get_adapter(model).capabilities.vision:
+            raise ValueError(f"{model} does not accept images. Choose a vision-capable model.")
+        messages[-1]["images"] = [prepare_for_model(image, model) for image in images]
+    return messages
+
+def get_response(prompt: str, model: str = "OpenAI", temperature: float = 0.5, max_tokens: int = 512, api_key: str = None,
+                 use_cache: bool = True, history: list[dict] | None = None, images: list[bytes] | None = None,
+                 session: str | None = None, priority: str = INTERACTIVE, hedge: HedgePolicy | None = None):
+    """
+    Returns the LLM's response, served from the response cache when possible.
+
+    Takes the same arguments as _call_provider, plus:
+        use_cache (bool): Set False to bypass the cache for this request (no read, no write).
+        history (list[dict]): Earlier turns as {"role", "content"} dicts, oldest first.
+                              Use utils.context.build_context to fit them to the model's budget.
+        images (list[bytes]): Raw image uploads to send with the prompt (vision models only).
+                              Downscaled/re-encoded once per content hash, then reused.
+        session (str): Caller id the scheduler queues fairly against other callers.
+        priority (str): "interactive" (default) or "batch"; batch waits while interactive requests queue.
+        hedge (HedgePolicy): Also send the request to a backup model if `model` is slow to
+                             answer, and fail over on errors (utils/hedging.py).
+    """
+    if hedge is not None:
+        return "".join(stream_response(prompt, model, temperature, max_tokens, api_key, use_cache, history, images,
+                                       session=session, priority=priority, hedge=hedge))
+    messages = _build_messages(prompt, history, model, images)
+    key = _response_cache_key(model, messages, temperature, max_tokens)
+    cacheable = _is_cacheable(temperature, use_cache)
+    if cacheable:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            return cached
+    # Single-flight: identical concurrent requests share one upstream call (admitted per attempt)
+    adapter = get_adapter(model)
+    output = scheduler.run(
+        _flight_key(key, api_key), adapter.provider,
+        lambda: _resilient_call(messages, model, temperature, max_tokens, api_key, _attempt_slot(adapter, session, priority)),
+        limit_hint=adapter.capabilities.max_concurrency,
+    )
+    if cacheable:
+        _response_cache.set(key, output)
+    return output
+
+def cached_response(prompt: str, model: str, temperature: float, max_tokens: int,
+                    history: list[dict] | None = None) -> str | None:
+    """The cached reply get_response would return for this text-only request, or None."""
+    if not _is_cacheable(temperature, True):
+        return None
+    return _response_cache.get(_response_cache_key(model, _build_messages(prompt, history, model), temperature, max_tokens))
+
+def _flight_key(request_key: str, api_key: str | None, stream: bool = False) -> str:
+    """Requests are only coalesced when they would be sent with the same API key."""
+    key_id = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return f"{'stream' if stream else 'call'}:{key_id}:{request_key}"
+
+# --- Resilience (rate limits, retries, circuit breaker) ---
+
+def _attempt_slot(adapter, session: str | None, priority: str):
+    """Scheduler admission for one upstream attempt; retry and Retry-After waits happen outside it."""
+    return lambda: scheduler.slot(adapter.provider, session, priority, adapter.capabilities.max_concurrency)
+
+def _estimate_request_tokens(messages: list[dict], max_tokens: int) -> int:
+    """Prompt estimate plus the reply reservation, charged against the provider's TPM bucket."""
+    images = sum(image.tokens for m in messages for image in m.get("images") or ())
+    return sum(estimate_tokens(m["content"]) for m in messages) + images + max_tokens
+
+def _resilient_call(messages: list[dict], model: str, temperature: float, max_tokens: int, api_key: str,
+                    slot=None) -> str:
+    """_call_provider behind the shared rate limiter, retry policy and circuit breaker."""
+    adapter = get_adapter(model)
+    return resilience.call(
+        adapter, api_key,
+        lambda: _call_provider(messages, model, temperature, max_tokens, api_key),
+        est_tokens=_estimate_request_tokens(messages, max_tokens), slot=slot,
+    )
+
+def _call_provider(messages: list[dict], model: str = "OpenAI", temperature: float = 0.5, max_tokens: int = 512, api_key: str = None):
     """
-    Communicates with various LLM APIs to get a response.
+    Communicates with the model's provider (via its adapter in utils/providers.py) to get a response.
 
     Args:
-        prompt (str): The user's input prompt.
+        messages (list[dict]): The conversation to send, ending with the user's prompt.
         model (str): The display name of the LLM model selected in the UI.
-                     Should match keys in app.py's SECRETS_KEY_MAPPING.
+                     Must be a key of utils.providers.PROVIDERS.
         temperature (float): The sampling temperature (0.0 to 1.0).
         max_tokens (int): The maximum number of tokens to generate.
         api_key (str): The API key retrieved from st.secrets.
@@ -27,167 +176,201 @@ def get_response(prompt: str, model: str = "OpenAI", temperature: float = 0.5, m
         str: The LLM's response text.
 
     Raises:
-        APIError, ValueError, requests.exceptions.RequestException, OpenAIError
+        APIError, ValueError
     """
     # --- Input Validation ---
-    # Map display names to internal logic/API model names if needed, or handle directly
-    supported_models = [
-        "OpenAI", "Gemini", "Claude", "Mistral", "Groq",
-        "NVIDIA Mistral Small", "NVIDIA DeepSeek Qwen"
-        ]
-    if model not in supported_models:
-        raise ValueError(f"❌ Unsupported model selected in get_response: '{model}'. Check app.py and llm_api.py consistency.")
-
+    adapter = get_adapter(model) # Raises ValueError for unknown models
     if not api_key:
          raise APIError(f"❌ API Key was not provided to get_response function for model {model}.")
 
     # --- API Call Logic ---
+    with track(model, adapter.provider) as record: # Timings, sizes and usage -> utils/metrics.py
+        try:
+            if adapter.call is not None: # SDK-backed provider (OpenAI)
+                output = adapter.call(adapter, messages, temperature, max_tokens, api_key)
+            else:
+                url, headers, payload = adapter.build_request(adapter, messages, temperature, max_tokens, api_key, stream=False)
+                response = _post(adapter.provider, url, headers, payload)
+                _note_response(record, response, body=True)
+                if response.status_code != 200:
+                    raise error_from_response(adapter, response, url)
+                try: response_data = response.json()
+                except ValueError as e: raise APIError(f"❌ {adapter.label} Error: Response is not JSON: {e}", provider=adapter.provider)
+                output = adapter.parse_response(adapter, response_data)
+            _fill_token_estimates(record, messages, output)
+            return output
+
+        # --- Global Error Handling ---
+        except requests.exceptions.RequestException as e:
+            raise APIError(f"❌ Network error for {model}: {e}", provider=adapter.provider, transient=True) from e
+        except (APIError, ValueError):
+            raise # Re-raise the specific APIError/ValueError
+        except Exception as e:
+            # Catch other unexpected errors within the API call logic
+            print(f"--- UNEXPECTED Error in get_response for {model} ---")
+            traceback.print_exc() # Log details
+            raise APIError(f"❌ Unexpected internal error processing {model} request: {type(e).__name__}") from e
+
+# --- Streaming ---
+
+def stream_response(prompt: str, model: str = "OpenAI", temperature: float = 0.5, max_tokens: int = 512, api_key: str = None,
+                    use_cache: bool = True, history: list[dict] | None = None, images: list[bytes] | None = None,
+                    session: str | None = None, priority: str = INTERACTIVE, hedge: HedgePolicy | None = None):
+    """
+    Streaming variant of get_response that yields text deltas as the provider produces them.
+
+    Takes the same arguments as get_response. Errors are raised from the
+    generator as APIError/ValueError, either before the first delta (bad status,
+    network failure) or mid-stream (provider error events). Cache hits are
+    yielded as a single chunk; a stream that completes is written to the cache.
+    Identical concurrent streams read one upstream stream (utils/scheduler.py).
+    With `hedge`, the deltas come from whichever model starts answering first.
+
+    Yields:
+        str: The next chunk of response text.
+    """
+    if hedge is not None:
+        open_stream = lambda candidate, candidate_key: stream_response(
+            prompt, candidate, temperature, max_tokens, candidate_key, use_cache, history, images,
+            session=session, priority=priority,
+        )
+        yield from hedged_stream(model, api_key, open_stream, hedge)
+        return
+    messages = _build_messages(prompt, history, model, images)
+    key = _response_cache_key(model, messages, temperature, max_tokens)
+    cacheable = _is_cacheable(temperature, use_cache)
+    if cacheable:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    adapter = get_adapter(model)
+    deltas = scheduler.stream(
+        _flight_key(key, api_key, stream=True), adapter.provider,
+        lambda: _resilient_stream(messages, model, temperature, max_tokens, api_key, _attempt_slot(adapter, session, priority)),
+        limit_hint=adapter.capabilities.max_concurrency,
+    )
+    parts = []
     try:
-        # === OpenAI ===
-        if model == "OpenAI":
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature, max_tokens=max_tokens
-            )
-            if not response.choices or not response.choices[0].message or not response.choices[0].message.content:
-                 raise APIError(f"❌ OpenAI API Error: Unexpected response structure. Response: {response}")
-            return response.choices[0].message.content.strip()
-
-        # === Google Gemini ===
-        elif model == "Gemini":
-            url = f"https://generativelanguage.googleapis.com/v1/models/gemini-pro:generateContent?key={api_key}" # Use v1
-            headers = {"Content-Type": "application/json"}
-            data = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens}}
-            response = requests.post(url, headers=headers, json=data)
-
-            if response.status_code != 200:
-                try: error_details = response.json()
-                except json.JSONDecodeError: error_details = response.text
-                raise APIError(f"❌ Gemini API Error: Status {response.status_code} from {url}. Details: {error_details}")
-
-            response_data = response.json()
-            # Parse Gemini response carefully
-            if 'candidates' not in response_data:
-                if 'promptFeedback' in response_data: feedback = response_data['promptFeedback']; block_reason = feedback.get('blockReason', 'Unknown'); details = f"Reason: {block_reason}"; raise APIError(f"❌ Gemini Response Blocked. {details}")
-                else: raise APIError(f"❌ Gemini API Error: Unexpected structure (no 'candidates'). Response: {response_data}")
-            if not response_data['candidates']: reason = response_data.get('promptFeedback', {}).get('blockReason', 'empty list'); raise APIError(f"❌ Gemini API Error: Empty 'candidates' list. Reason: {reason}")
-            try:
-                 candidate = response_data['candidates'][0]
-                 if 'content' not in candidate: reason = candidate.get('finishReason', 'Unknown'); raise APIError(f"❌ Gemini Error: No 'content' in candidate. Finish Reason: {reason}")
-                 if not candidate['content'].get('parts'): raise APIError(f"❌ Gemini Error: No 'parts' in content.")
-                 if 'text' not in candidate['content']['parts'][0]: raise APIError(f"❌ Gemini Error: No 'text' in first part.")
-                 return candidate['content']['parts'][0]['text']
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing Gemini response: {e}. Data: {response_data}")
-
-        # === Anthropic Claude ===
-        elif model == "Claude":
-            url = "https://api.anthropic.com/v1/messages"
-            headers = {"x-api-key": api_key, "anthropic-version": "2023-06-01", "content-type": "application/json"}
-            data = {"model": "claude-3-opus-20240229", "max_tokens": max_tokens, "temperature": temperature, "messages": [{"role": "user", "content": prompt}]}
-            response = requests.post(url, headers=headers, json=data)
-            if response.status_code != 200: try: error_details = response.json() except json.JSONDecodeError: error_details = response.text; raise APIError(f"❌ Claude API Error: Status {response.status_code} from {url}. Details: {error_details}")
-            response_data = response.json()
-            try:
-                 if not response_data.get("content") or not response_data["content"][0].get("text"): raise APIError(f"❌ Claude Error: Unexpected structure. Resp: {response_data}")
-                 return response_data["content"][0]["text"]
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing Claude response: {e}. Resp: {response_data}")
-
-        # === Mistral AI ===
-        elif model == "Mistral":
-            url = "https://api.mistral.ai/v1/chat/completions"
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json", "Accept": "application/json"}
-            data = {"model": "mistral-medium", "messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
-            response = requests.post(url, headers=headers, json=data)
-            if response.status_code != 200: try: error_details = response.json() except json.JSONDecodeError: error_details = response.text; raise APIError(f"❌ Mistral API Error: Status {response.status_code} from {url}. Details: {error_details}")
-            response_data = response.json()
-            try:
-                 if not response_data.get("choices") or not response_data["choices"][0].get("message") or not response_data["choices"][0]["message"].get("content"): raise APIError(f"❌ Mistral Error: Unexpected structure. Resp: {response_data}")
-                 return response_data["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing Mistral response: {e}. Resp: {response_data}")
-
-        # === Groq ===
-        elif model == "Groq":
-            url = "https://api.groq.com/openai/v1/chat/completions"
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            data = {"model": "mixtral-8x7b-32768", "messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
-            response = requests.post(url, headers=headers, json=data)
-            if response.status_code != 200: try: error_details = response.json() except json.JSONDecodeError: error_details = response.text; raise APIError(f"❌ Groq API Error: Status {response.status_code} from {url}. Details: {error_details}")
-            response_data = response.json()
-            try:
-                 if not response_data.get("choices") or not response_data["choices"][0].get("message") or not response_data["choices"][0]["message"].get("content"): raise APIError(f"❌ Groq Error: Unexpected structure. Resp: {response_data}")
-                 return response_data["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing Groq response: {e}. Resp: {response_data}")
-
-        # === NVIDIA Mistral Small ===
-        elif model == "NVIDIA Mistral Small":
-            # --- Placeholder - Needs actual NVIDIA API details ---
-            # Consult NVIDIA AI Playground / API Documentation for correct values
-            print(f"--- Attempting NVIDIA call for {model} ---") # Debug print
-            # Example (Likely Needs Correction):
-            url = "https://ai.api.nvidia.com/v1/chat/completions" # Check endpoint
-            headers = {"Authorization": f"Bearer {api_key}", "Accept": "application/json", "Content-Type": "application/json"}
-            # Payload needs to specify the *exact* NVIDIA model identifier
-            payload = {
-                "model": "mistralai/mistral-7b-instruct-v0.2", # Check NVIDIA model list
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                 "stream": False
-            }
-            response = requests.post(url, headers=headers, json=payload)
-            if response.status_code != 200: try: error_details = response.json() except json.JSONDecodeError: error_details = response.text; raise APIError(f"❌ NVIDIA API Error ({model}): Status {response.status_code} from {url}. Details: {error_details}")
-            response_data = response.json()
-            # Parsing needs to match NVIDIA response structure (often OpenAI compatible)
-            try:
-                if not response_data.get("choices") or not response_data["choices"][0].get("message") or not response_data["choices"][0]["message"].get("content"): raise APIError(f"❌ NVIDIA Error ({model}): Unexpected structure. Resp: {response_data}")
-                return response_data["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing NVIDIA ({model}) response: {e}. Resp: {response_data}")
-            # --- End Placeholder ---
-
-        # === NVIDIA DeepSeek Qwen ===
-        elif model == "NVIDIA DeepSeek Qwen":
-            # --- Placeholder - Needs actual NVIDIA API details ---
-            # Consult NVIDIA AI Playground / API Documentation for correct values
-            print(f"--- Attempting NVIDIA call for {model} ---") # Debug print
-            url = "https://ai.api.nvidia.com/v1/chat/completions" # Check endpoint
-            headers = {"Authorization": f"Bearer {api_key}", "Accept": "application/json", "Content-Type": "application/json"}
-            payload = {
-                "model": "deepseek-ai/deepseek-coder-33b-instruct", # Check NVIDIA model list for correct ID
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "stream": False
-            }
-            response = requests.post(url, headers=headers, json=payload)
-            if response.status_code != 200: try: error_details = response.json() except json.JSONDecodeError: error_details = response.text; raise APIError(f"❌ NVIDIA API Error ({model}): Status {response.status_code} from {url}. Details: {error_details}")
-            response_data = response.json()
-            try:
-                if not response_data.get("choices") or not response_data["choices"][0].get("message") or not response_data["choices"][0]["message"].get("content"): raise APIError(f"❌ NVIDIA Error ({model}): Unexpected structure. Resp: {response_data}")
-                return response_data["choices"][0]["message"]["content"]
-            except (KeyError, IndexError, TypeError) as e: raise APIError(f"❌ Error parsing NVIDIA ({model}) response: {e}. Resp: {response_data}")
-            # --- End Placeholder ---
-
-        else:
-            # This case should not be reached if app.py filtering is correct
-            raise ValueError(f"Model '{model}' selected but not handled in get_response.")
-
-    # --- Global Error Handling ---
-    except requests.exceptions.RequestException as e:
-        raise APIError(f"❌ Network error for {model}: {e}") from e
-    except OpenAIError as e: # Specific to OpenAI library usage
-        raise APIError(f"❌ OpenAI Library Error: {e}") from e
-    except Exception as e:
-        # Catch other unexpected errors within the API call logic
-        if not isinstance(e, (APIError, ValueError)): # Don't re-wrap known errors
-             print(f"--- UNEXPECTED Error in get_response for {model} ---")
-             traceback.print_exc() # Log details
-             raise APIError(f"❌ Unexpected internal error processing {model} request: {type(e).__name__}") from e
-        else:
-             raise e # Re-raise the specific APIError/ValueError
+        for delta in deltas:
+            parts.append(delta)
+            yield delta
+    finally:
+        deltas.close() # Leaving early: this reader detaches from the shared stream
+    if cacheable:
+        _response_cache.set(key, "".join(parts))
+
+def _resilient_stream(messages: list[dict], model: str, temperature: float, max_tokens: int, api_key: str,
+                      slot=None):
+    """
+    _stream_provider behind the shared resilience layer.
+
+    Failures before the first delta are retried like blocking calls; once text
+    has been shown to the user a failure is recorded and raised, never replayed.
+    `slot` (see resilience.call) is held while each attempt streams.
+    """
+    adapter = get_adapter(model)
+    est_tokens = _estimate_request_tokens(messages, max_tokens)
+    attempt = 1
+    while True:
+        wait = resilience.before_call(adapter, api_key, est_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        started = False
+        try:
+            with slot() if slot is not None else contextlib.nullcontext():
+                for delta in _stream_provider(messages, model, temperature, max_tokens, api_key):
+                    started = True
+                    yield delta
+        except APIError as e:
+            if cancelled(): # Our own abort broke the connection; says nothing about the provider
+                resilience.guard(adapter.provider).breaker.release_probe()
+                raise RequestCancelled(f"{model} request was cancelled.") from e
+            resilience.record_failure(adapter, e)
+            delay = None if started else resilience.retry_delay(adapter, attempt, e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException: # GeneratorExit when the consumer stops early, ValueError, ...
+            resilience.guard(adapter.provider).breaker.release_probe()
+            raise
+        resilience.record_success(adapter)
+        return
+
+def _stream_provider(messages: list[dict], model: str, temperature: float, max_tokens: int, api_key: str):
+    """Uncached, single-attempt streaming call; see stream_response."""
+    adapter = get_adapter(model)
+    if not adapter.capabilities.streaming:
+        yield _call_provider(messages, model, temperature, max_tokens, api_key)
+        return
+    if not api_key:
+         raise APIError(f"❌ API Key was not provided to stream_response function for model {model}.")
+
+    with track(model, adapter.provider, stream=True) as record:
+        try:
+            if adapter.stream is not None: # SDK-backed provider (OpenAI)
+                yield from _observe_deltas(record, messages, adapter.stream(adapter, messages, temperature, max_tokens, api_key))
+                return
+            url, headers, payload = adapter.build_request(adapter, messages, temperature, max_tokens, api_key, stream=True)
+            response = _post(adapter.provider, url, headers, payload, stream=True)
+            with response:
+                _note_response(record, response, body=False)
+                if response.status_code != 200:
+                    raise error_from_response(adapter, response, url)
+                lines = _count_bytes(record, response.iter_lines(chunk_size=None))
+                yield from _observe_deltas(record, messages, adapter.parse_stream(adapter, lines))
+
+        # --- Global Error Handling (mirrors get_response) ---
+        except (APIError, ValueError, GeneratorExit, RequestCancelled):
+            raise
+        except Exception as e:
+            if cancelled(): # The connection was shut down by a CancelScope (utils/cancellation.py)
+                raise RequestCancelled(f"{model} request was cancelled.") from e
+            if isinstance(e, requests.exceptions.RequestException):
+                raise APIError(f"❌ Network error for {model}: {e}", provider=adapter.provider, transient=True) from e
+            print(f"--- UNEXPECTED Error in stream_response for {model} ---")
+            traceback.print_exc()
+            raise APIError(f"❌ Unexpected internal error processing {model} stream: {type(e).__name__}") from e
+
+# --- Instrumentation Helpers (see utils/metrics.py) ---
+
+def _note_response(record, response: requests.Response, body: bool) -> None:
+    """Status, time to response headers and payload sizes of a REST attempt."""
+    record.status = response.status_code
+    record.ttfb_s = response.elapsed.total_seconds() # requests: send -> headers parsed
+    request_body = response.request.body
+    record.request_bytes = len(request_body) if request_body is not None else 0
+    if body:
+        record.response_bytes = len(response.content)
+
+def _count_bytes(record, lines):
+    record.response_bytes = 0
+    for line in lines:
+        record.response_bytes += len(line) + 1
+        yield line
+
+def _observe_deltas(record, messages: list[dict], deltas):
+    """Passes stream deltas through, marking time to first token and estimating usage if none was reported."""
+    parts = []
+    for delta in deltas:
+        if not parts:
+            record.first_token_s = record.since_start()
+        parts.append(delta)
+        yield delta
+    _fill_token_estimates(record, messages, "".join(parts))
+
+def _fill_token_estimates(record, messages: list[dict], output: str) -> None:
+    if record.prompt_tokens is None:
+        record.prompt_tokens = _estimate_request_tokens(messages, 0)
+        record.tokens_estimated = True
+    if record.completion_tokens is None:
+        record.completion_tokens = estimate_tokens(output)
+        record.tokens_estimated = True
 
 # Optional test block
 if __name__ == '__main__':
     print("llm_api.py executed directly (for testing).")
+    print(f"Supported models: {', '.join(supported_models())}")
     # Add test calls here if needed, handling API keys securely
@@ -0,0 +1,349 @@
+# utils/metrics.py
+"""
+Per-request instrumentation for provider calls.
+
+Each attempt in llm_api/async_engine runs inside track(), which makes a
+RequestMetrics record "current" for the calling thread or asyncio task (via a
+ContextVar). Lower layers fill in what they observe without extra plumbing:
+
+    client_pool   DNS, TCP connect and TLS time for new connections, TTFB (SDK path)
+    providers     prompt/completion tokens from each response's `usage` block
+    llm_api       status, payload sizes, TTFB / first-token time
+
+When the attempt ends the record is emitted to every registered sink: an
+in-memory ring buffer (always on; feeds the sidebar panel), optionally a JSONL
+file and a Prometheus text endpoint. Sinks never raise into the request path.
+"""
+
+import contextlib
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+
+# --- Record ---
+
+@dataclass(slots=True)
+class RequestMetrics:
+    """Everything measured for one provider attempt. Timings are seconds; None = not observed."""
+    model: str
+    provider: str
+    stream: bool = False
+    started_at: float = 0.0          # Unix time the attempt started
+    ok: bool = False
+    status: int | None = None
+    error: str | None = None
+    dns_s: float | None = None       # Only set when the attempt opened a new connection
+    connect_s: float | None = None
+    tls_s: float | None = None
+    ttfb_s: float | None = None      # Start of attempt -> response headers
+    first_token_s: float | None = None
+    total_s: float | None = None
+    request_bytes: int | None = None
+    response_bytes: int | None = None
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    tokens_estimated: bool = False   # True when the provider sent no usage and counts were estimated
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+    def since_start(self) -> float:
+        """Seconds since the attempt started (for TTFB/first-token marks)."""
+        return time.time() - self.started_at
+
+
+_current: ContextVar[RequestMetrics | None] = ContextVar("current_request_metrics", default=None)
+_collector: ContextVar[list | None] = ContextVar("request_metrics_collector", default=None)
+
+def current() -> RequestMetrics | None:
+    """The record of the attempt running in this thread/task, if any."""
+    return _current.get()
+
+def note_usage(prompt_tokens: int | None = None, completion_tokens: int | None = None) -> None:
+    """Called by response parsers with the provider-reported token counts."""
+    record = current()
+    if record is None:
+        return
+    if prompt_tokens is not None:
+        record.prompt_tokens = prompt_tokens
+    if completion_tokens is not None:
+        record.completion_tokens = completion_tokens
+
+@contextlib.contextmanager
+def collect():
+    """
+    Collects the records of every attempt made inside the block (in this
+    thread/task), e.g. to attribute retries and token usage to one get_response call.
+    """
+    records: list[RequestMetrics] = []
+    token = _collector.set(records)
+    try:
+        yield records
+    finally:
+        _collector.reset(token)
+
+@contextlib.contextmanager
+def track(model: str, provider: str, stream: bool = False):
+    """Times one provider attempt and emits its record to the sinks when it ends."""
+    record = RequestMetrics(model=model, provider=provider, stream=stream, started_at=time.time())
+    started = time.perf_counter()
+    token = _current.set(record)
+    try:
+        yield record
+        record.ok = True
+    except GeneratorExit: # Consumer stopped reading a stream early
+        record.error = "cancelled"
+        raise
+    except BaseException as e:
+        record.error = type(e).__name__
+        if getattr(e, "status", None) is not None:
+            record.status = e.status
+        raise
+    finally:
+        record.total_s = time.perf_counter() - started
+        try:
+            _current.reset(token)
+        except ValueError: # A stream generator closed from another thread/context
+            pass
+        collected = _collector.get()
+        if collected is not None:
+            collected.append(record)
+        hub.emit(record)
+
+# --- Percentiles / Summaries ---
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(records: list[RequestMetrics]) -> dict:
+    """Latency percentiles, error count and throughput for a group of records."""
+    ok = [r for r in records if r.ok]
+    totals = [r.total_s for r in ok]
+    ttfbs = [r.ttfb_s for r in ok if r.ttfb_s is not None]
+    first_tokens = [r.first_token_s for r in ok if r.first_token_s is not None]
+    completion = sum(r.completion_tokens or 0 for r in ok)
+    # Generation speed: output tokens over time after the response started arriving
+    generating = sum(max(r.total_s - (r.first_token_s or r.ttfb_s or 0.0), 1e-3) for r in ok if r.completion_tokens)
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "p50_s": percentile(totals, 50),
+        "p95_s": percentile(totals, 95),
+        "p99_s": percentile(totals, 99),
+        "ttfb_p50_s": percentile(ttfbs, 50),
+        "first_token_p50_s": percentile(first_tokens, 50),
+        "prompt_tokens": sum(r.prompt_tokens or 0 for r in ok),
+        "completion_tokens": completion,
+        "tokens_per_s": completion / generating if generating else 0.0,
+        "new_connections": sum(1 for r in records if r.connect_s is not None),
+    }
+
+# --- Sinks ---
+
+class RingBufferSink:
+    """Keeps the most recent `capacity` records in memory."""
+
+    def __init__(self, capacity: int = 2_000):
+        self._records: deque[RequestMetrics] = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def emit(self, record: RequestMetrics) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def records(self, since: float | None = None) -> list[RequestMetrics]:
+        with self._lock:
+            records = list(self._records)
+        return records if since is None else [r for r in records if r.started_at >= since]
+
+    def summary(self, window_s: float | None = None) -> dict[str, dict]:
+        """summarize() per model over the buffer (or the last `window_s` seconds)."""
+        since = time.time() - window_s if window_s else None
+        by_model: dict[str, list[RequestMetrics]] = {}
+        for record in self.records(since):
+            by_model.setdefault(record.model, []).append(record)
+        return {model: summarize(records) for model, records in by_model.items()}
+
+
+class JSONLSink:
+    """Appends one JSON object per attempt to a file (line-buffered, safe across threads)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, record: RequestMetrics) -> None:
+        line = json.dumps(record.as_dict(), separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusSink:
+    """
+    Aggregates records into Prometheus counters and histograms; render() returns
+    the text exposition format (served by serve_prometheus()).
+    """
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: dict[tuple[str, str, str], int] = {}          # (model, provider, outcome)
+        self._histograms: dict[tuple[str, str], list] = {}            # (metric, model) -> [bucket counts..., sum, count]
+        self._tokens: dict[tuple[str, str], int] = {}                 # (model, kind)
+        self._bytes: dict[tuple[str, str], int] = {}                  # (model, direction)
+
+    def _observe(self, metric: str, model: str, value: float | None) -> None:
+        if value is None:
+            return
+        histogram = self._histograms.setdefault((metric, model), [0] * len(self.BUCKETS) + [0.0, 0])
+        for index, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def emit(self, record: RequestMetrics) -> None:
+        outcome = "ok" if record.ok else "error"
+        with self._lock:
+            key = (record.model, record.provider, outcome)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe("request_duration_seconds", record.model, record.total_s)
+            self._observe("time_to_first_byte_seconds", record.model, record.ttfb_s)
+            self._observe("connect_seconds", record.model, record.connect_s)
+            for kind, value in (("prompt", record.prompt_tokens), ("completion", record.completion_tokens)):
+                if value:
+                    self._tokens[(record.model, kind)] = self._tokens.get((record.model, kind), 0) + value
+            for direction, value in (("request", record.request_bytes), ("response", record.response_bytes)):
+                if value:
+                    self._bytes[(record.model, direction)] = self._bytes.get((record.model, direction), 0) + value
+
+    def render(self) -> str:
+        def esc(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"')
+        lines = ["# TYPE llm_requests_total counter"]
+        with self._lock:
+            for (model, provider, outcome), count in sorted(self._requests.items()):
+                lines.append(f'llm_requests_total{{model="{esc(model)}",provider="{esc(provider)}",outcome="{outcome}"}} {count}')
+            for metric in ("request_duration_seconds", "time_to_first_byte_seconds", "connect_seconds"):
+                lines.append(f"# TYPE llm_{metric} histogram")
+                for (name, model), histogram in sorted(self._histograms.items()):
+                    if name != metric:
+                        continue
+                    label = f'model="{esc(model)}"'
+                    for bound, count in zip(self.BUCKETS, histogram):
+                        lines.append(f'llm_{metric}_bucket{{{label},le="{bound:g}"}} {count}')
+                    lines.append(f'llm_{metric}_bucket{{{label},le="+Inf"}} {histogram[-1]}')
+                    lines.append(f"llm_{metric}_sum{{{label}}} {histogram[-2]:.6f}")
+                    lines.append(f"llm_{metric}_count{{{label}}} {histogram[-1]}")
+            lines.append("# TYPE llm_tokens_total counter")
+            for (model, kind), count in sorted(self._tokens.items()):
+                lines.append(f'llm_tokens_total{{model="{esc(model)}",kind="{kind}"}} {count}')
+            lines.append("# TYPE llm_payload_bytes_total counter")
+            for (model, direction), count in sorted(self._bytes.items()):
+                lines.append(f'llm_payload_bytes_total{{model="{esc(model)}",direction="{direction}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+# --- Hub ---
+
+class MetricsHub:
+    """Fans records out to the registered sinks."""
+
+    def __init__(self, sinks=()):
+        self._sinks = list(sinks)
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink) -> None:
+        with self._lock:
+            self._sinks = [*self._sinks, sink] # Copy-on-write: emit() iterates without the lock
+
+    def remove_sink(self, sink) -> None:
+        with self._lock:
+            self._sinks = [s for s in self._sinks if s is not sink]
+
+    def emit(self, record: RequestMetrics) -> None:
+        for sink in self._sinks:
+            try:
+                sink.emit(record)
+            except Exception as e: # Instrumentation must never break a request
+                print(f"Metrics sink {type(sink).__name__} failed: {e}")
+
+
+# --- Module-Level Hub ---
+ring_buffer = RingBufferSink()
+hub = MetricsHub([ring_buffer])
+_exporters: dict[str, object] = {} # Process-wide: Streamlit reruns must not add duplicate sinks
+_failed_exporters: dict[str, OSError] = {} # Binds that failed; reruns re-raise instead of retrying
+_exporters_lock = threading.Lock()
+
+def metrics_summary(window_s: float | None = 15 * 60) -> dict[str, dict]:
+    """Per-model rolling summary from the in-memory ring buffer (default: last 15 minutes)."""
+    return ring_buffer.summary(window_s)
+
+def enable_jsonl(path: str) -> JSONLSink:
+    """Starts appending every record to `path` (once per process and path)."""
+    key = f"jsonl:{path}"
+    with _exporters_lock:
+        sink = _exporters.get(key)
+        if sink is None:
+            sink = _exporters[key] = JSONLSink(path)
+            hub.add_sink(sink)
+    return sink
+
+def serve_prometheus(port: int = 9464, host: str = "127.0.0.1") -> PrometheusSink:
+    """
+    Serves GET /metrics in Prometheus text format on a daemon thread (once per process).
+
+    Raises:
+        OSError: If the port can't be bound. The failure is remembered: later
+            calls raise it again without retrying the bind.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    key = f"prometheus:{host}:{port}"
+    sink = PrometheusSink()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = sink.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _exporters_lock:
+        existing = _exporters.get(key)
+        if existing is not None:
+            return existing
+        if key in _failed_exporters:
+            raise _failed_exporters[key].with_traceback(None)
+        try:
+            server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e: # Port taken (another worker, a leftover process); no sink is registered
+            _failed_exporters[key] = e
+            raise
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        _exporters[key] = sink
+    hub.add_sink(sink)
+    return sink
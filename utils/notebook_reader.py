@@ -0,0 +1,214 @@
+# utils/notebook_reader.py
+"""
+Fast Jupyter notebook text extraction.
+
+nbformat decodes and validates the whole document, including embedded plots
+(base64 PNGs) and huge outputs, only for us to keep the cell sources. This
+reader walks the raw JSON bytes instead: the values it needs (cell types and
+sources, the notebook title, optionally text outputs) are decoded with
+json.loads on their byte span, everything else - outputs, attachments, cell
+and widget metadata - is stepped over with regex scans and never decoded.
+"""
+
+import json
+import re
+
+# Stepping over JSON values without decoding them
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb'[^,\]}\s]*')
+_WHITESPACE = re.compile(rb"\s*")
+
+DEFAULT_MAX_OUTPUT_CHARS = 2_000 # Per code cell, when outputs are included
+_TEXT_MIME = "text/plain"
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """End of the JSON string opening at `start`: a memchr-speed find for the closing quote, even in MB-sized base64."""
+    pos = start + 1
+    while True:
+        pos = data.find(b'"', pos)
+        if pos < 0:
+            raise ValueError("Unterminated string")
+        backslashes = 0
+        while data[pos - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0: # An odd count means the quote itself is escaped
+            return pos + 1
+        pos += 1
+
+
+class _Scanner:
+    """Cursor over the raw notebook bytes."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 3 if data.startswith(b"\xef\xbb\xbf") else 0 # UTF-8 BOM
+
+    def _ws(self) -> int:
+        self.pos = _WHITESPACE.match(self.data, self.pos).end()
+        return self.pos
+
+    def expect(self, char: bytes) -> None:
+        if self.data[self._ws():self.pos + 1] != char:
+            raise ValueError(f"Expected {char.decode()!r} at byte {self.pos}")
+        self.pos += 1
+
+    def peek(self) -> bytes:
+        return self.data[self._ws():self.pos + 1]
+
+    def skip(self) -> None:
+        """Moves past one value without decoding it."""
+        start = self._ws()
+        first = self.data[start:start + 1]
+        if first == b'"':
+            self.pos = _string_end(self.data, start)
+            return
+        if first not in (b"[", b"{"):
+            self.pos = _SCALAR.match(self.data, start).end()
+            return
+        depth = 0
+        pos = start
+        while True:
+            match = _STRUCTURAL.search(self.data, pos)
+            if match is None:
+                raise ValueError("Unterminated array or object")
+            char = match.group()
+            if char == b'"':
+                pos = _string_end(self.data, match.start())
+                continue
+            pos = match.end()
+            depth += 1 if char in (b"[", b"{") else -1
+            if depth == 0:
+                self.pos = pos
+                return
+
+    def load(self):
+        """Decodes one value."""
+        start = self._ws()
+        self.skip()
+        return json.loads(self.data[start:self.pos])
+
+    def members(self):
+        """Iterates an object's keys; the caller must consume (load or skip) each value."""
+        self.expect(b"{")
+        if self.peek() == b"}":
+            self.pos += 1
+            return
+        while True:
+            key = self.load()
+            self.expect(b":")
+            yield key
+            if self.peek() == b",":
+                self.pos += 1
+                continue
+            self.expect(b"}")
+            return
+
+    def items(self):
+        """Iterates an array; the caller must consume each element."""
+        self.expect(b"[")
+        if self.peek() == b"]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == b",":
+                self.pos += 1
+                continue
+            self.expect(b"]")
+            return
+
+
+def _text(value) -> str:
+    """Notebook strings are stored either whole or as a list of lines."""
+    if value is None or isinstance(value, str):
+        return value or ""
+    if isinstance(value, list) and all(isinstance(line, str) for line in value):
+        return "".join(value)
+    raise ValueError("Expected notebook text as a string or a list of strings")
+
+
+def _read_outputs(scanner: _Scanner, budget: int) -> str:
+    """Text of stream/result/error outputs, capped at `budget` characters; rich data is skipped."""
+    parts = []
+    used = 0
+    dropped = False # The marker is added only when text was actually cut, not when it fit exactly
+    for _ in scanner.items():
+        texts = []
+        for key in scanner.members():
+            if used >= budget:
+                dropped = dropped or key in ("text", "data", "ename", "evalue")
+                scanner.skip()
+            elif key == "text": # stream output
+                texts.append(_text(scanner.load()))
+            elif key == "data": # execute_result / display_data: only the plain-text rendering
+                for mime in scanner.members():
+                    if mime == _TEXT_MIME:
+                        texts.append(_text(scanner.load()))
+                    else:
+                        scanner.skip()
+            elif key in ("ename", "evalue"): # error (the ANSI-coloured traceback is skipped)
+                texts.append(str(scanner.load()) + (": " if key == "ename" else ""))
+            else:
+                scanner.skip()
+        text = "".join(texts).strip("\n")
+        if text and used < budget:
+            dropped = dropped or len(text) > budget - used
+            text = text[: budget - used]
+            used += len(text)
+            parts.append(text)
+        elif text:
+            dropped = True
+    output = "\n".join(parts)
+    return output + ("\n[... output truncated]" if dropped else "")
+
+
+def extract_notebook_text(file_content: bytes, include_outputs: bool = False,
+                          max_output_chars: int = DEFAULT_MAX_OUTPUT_CHARS) -> str:
+    """
+    Extracts markdown and code cells (and optionally their text outputs) from
+    an nbformat v4 notebook, in the same layout as the nbformat path.
+
+    Args:
+        file_content (bytes): The .ipynb file.
+        include_outputs (bool): Add each code cell's text outputs.
+        max_output_chars (int): Output characters kept per code cell.
+
+    Raises:
+        ValueError: Malformed JSON, or a notebook older than nbformat 4.
+    """
+    scanner = _Scanner(file_content)
+    title = "Untitled"
+    parts = []
+    for key in scanner.members():
+        if key == "cells":
+            for _ in scanner.items():
+                cell_type = source = output = None
+                for cell_key in scanner.members():
+                    if cell_key == "cell_type":
+                        cell_type = scanner.load()
+                    elif cell_key == "source":
+                        source = _text(scanner.load())
+                    elif cell_key == "outputs" and include_outputs:
+                        output = _read_outputs(scanner, max_output_chars)
+                    else:
+                        scanner.skip() # outputs, attachments, metadata, ids
+                if cell_type == "markdown":
+                    parts.append(f"## Markdown Cell:\n{source or ''}\n\n")
+                elif cell_type == "code":
+                    parts.append(f"## Code Cell:\n```python\n{source or ''}\n```\n")
+                    if output:
+                        parts.append(f"### Output:\n{output}\n")
+        elif key == "metadata":
+            for meta_key in scanner.members():
+                if meta_key == "title":
+                    title = scanner.load()
+                else:
+                    scanner.skip() # kernelspec, widget state, ...
+        elif key == "nbformat":
+            version = scanner.load()
+            if not isinstance(version, int) or version < 4:
+                raise ValueError(f"nbformat {version} notebooks are read with nbformat")
+        else:
+            scanner.skip() # "worksheets" (v3) never yields cells: the version check above catches it
+    return f"# Notebook: {title}\n\n" + "".join(parts)
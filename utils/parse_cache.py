@@ -0,0 +1,58 @@
+# utils/parse_cache.py
+"""
+Content-addressed cache for parsed uploads.
+
+Streamlit re-runs the whole script on every interaction, so without this an
+uploaded PDF/DOCX/notebook would be re-parsed on each rerun. Entries are keyed
+by sha256(content) plus the parser version and file type, so the same bytes
+uploaded again (in any session of this process, or after a restart when the
+disk tier is enabled) cost one hash instead of a full parse.
+"""
+
+import hashlib
+import sys
+
+from utils.cache import LRUCache, SQLiteStore, TieredCache
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # Memory budget for cached texts
+
+
+def _entry_size(entry) -> int:
+    text, metadata = entry
+    return (sys.getsizeof(text) if isinstance(text, str) else 0) + sys.getsizeof(metadata) + 256
+
+
+_cache = TieredCache(LRUCache(max_entries=10_000, max_bytes=DEFAULT_MAX_BYTES, sizeof=_entry_size))
+
+
+def configure_parse_cache(max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = 10_000,
+                          disk_path: str | None = None, ttl: float | None = None) -> None:
+    """Replaces the process-wide parse cache (memory budget, optional SQLite tier, TTL)."""
+    global _cache
+    disk = SQLiteStore(disk_path, table="parsed_files") if disk_path else None
+    _cache = TieredCache(LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, sizeof=_entry_size), disk)
+
+
+def content_digest(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def cache_key(digest: str, file_type: str, parser_version: str) -> str:
+    return f"v{parser_version}:{file_type}:{digest}"
+
+
+def get_parsed(key: str):
+    """Returns the cached (text, metadata) tuple or None."""
+    return _cache.get(key)
+
+
+def put_parsed(key: str, text, metadata: dict) -> None:
+    _cache.set(key, (text, metadata))
+
+
+def parse_cache_stats() -> dict:
+    return _cache.stats()
+
+
+def clear_parse_cache() -> None:
+    _cache.clear()
@@ -0,0 +1,112 @@
+# utils/pdf_engine.py
+"""
+Page-level PDF text extraction.
+
+Pages are produced as a generator and joined once at the end, instead of
+growing one string page by page. Extraction is in-process unless the caller
+asks for more than one worker (the app reads PDF_WORKERS from secrets.toml)
+and the document has at least PARALLEL_MIN_PAGES pages; then page ranges are
+spread across a process pool. Each worker opens its own `fitz` document from
+a temporary file, since PyMuPDF documents can't be shared between processes.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator
+
+# Spawning the pool costs about 1.2 s against roughly 2 ms per page in-process
+# (benchmarks/bench_pdf.py), so it only wins on documents of about this size.
+PARALLEL_MIN_PAGES = 1_000
+DEFAULT_CHUNK_PAGES = 32
+
+ProgressCallback = Callable[[int, int], None] # (pages_done, pages_total)
+
+
+def _extract_range(path: str, start: int, stop: int) -> list[str]:
+    """Worker: opens the PDF independently and returns the text of pages [start, stop)."""
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return [doc.load_page(number).get_text() for number in range(start, stop)]
+
+
+def iter_pdf_pages(file_content: bytes, max_pages: int | None = None, workers: int = 1,
+                   chunk_pages: int = DEFAULT_CHUNK_PAGES, progress: ProgressCallback | None = None) -> Iterator[tuple[int, str]]:
+    """
+    Yields (page_number, text) in page order.
+
+    Args:
+        file_content (bytes): The PDF bytes.
+        max_pages (int | None): Stop after this many pages.
+        workers (int): Processes to use. 1 (default) extracts in-process; larger
+            values are only used for documents with at least PARALLEL_MIN_PAGES pages.
+        chunk_pages (int): Pages per work item when running in parallel.
+        progress (callable | None): Called as progress(pages_done, pages_total).
+
+    Closing the generator early (e.g. when a byte limit is hit) stops extraction
+    and cancels any page ranges not yet started.
+    """
+    import fitz  # PyMuPDF
+    with fitz.open(stream=file_content, filetype="pdf") as doc:
+        total = doc.page_count if max_pages is None else min(doc.page_count, max_pages)
+        if workers <= 1 or total < PARALLEL_MIN_PAGES:
+            for number in range(total):
+                yield number, doc.load_page(number).get_text()
+                if progress: progress(number + 1, total)
+            return
+
+    # --- Parallel path: page ranges across a process pool ---
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(file_content)
+        ranges = [(start, min(start + chunk_pages, total)) for start in range(0, total, chunk_pages)]
+        # "spawn" avoids forking a multi-threaded Streamlit server; workers only import this small module
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [pool.submit(_extract_range, path, start, stop) for start, stop in ranges]
+            try:
+                for (start, stop), future in zip(ranges, futures):
+                    for offset, text in enumerate(future.result()):
+                        yield start + offset, text
+                    if progress: progress(stop, total)
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        os.unlink(path)
+
+
+def extract_pdf_text(file_content: bytes, max_pages: int | None = None, max_bytes: int | None = None,
+                     workers: int = 1, progress: ProgressCallback | None = None) -> str:
+    """
+    Extracts the text of a PDF, optionally bounded by page count and output size.
+
+    Args:
+        file_content (bytes): The PDF bytes.
+        max_pages (int | None): Only extract the first N pages.
+        max_bytes (int | None): Stop once this many UTF-8 bytes of text were
+            collected; the last page is truncated to fit.
+        workers (int): Process count for large documents (see iter_pdf_pages).
+        progress (callable | None): progress(pages_done, pages_total) callback.
+
+    Returns:
+        str: The concatenated page texts.
+    """
+    parts = []
+    used = 0
+    pages = iter_pdf_pages(file_content, max_pages=max_pages, workers=workers, progress=progress)
+    try:
+        for _, text in pages:
+            if max_bytes is not None:
+                size = len(text.encode("utf-8"))
+                if used + size > max_bytes:
+                    remaining = max_bytes - used
+                    parts.append(text.encode("utf-8")[:remaining].decode("utf-8", errors="ignore"))
+                    break
+                used += size
+            parts.append(text)
+    finally:
+        pages.close()
+    return "".join(parts)
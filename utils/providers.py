@@ -0,0 +1,445 @@
+# utils/providers.py
+"""
+Single source of truth for every chat model the app can talk to.
+
+Each ProviderAdapter declares the endpoint, payload builder, response/stream
+parsers, error mapper and capabilities for one display model. llm_api,
+async_engine, context budgeting and app.py's secrets mapping all read from
+PROVIDERS, so adding a model means adding one entry here.
+
+Nothing in this module imports a provider SDK; the OpenAI SDK is only loaded
+the first time the OpenAI adapter's `call`/`stream` hooks run.
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterable, Iterator
+
+from utils.cancellation import on_cancel
+from utils.errors import APIError
+from utils.image_pipeline import ImageLimits
+from utils.metrics import note_usage
+
+# --- Adapter Types ---
+
+@dataclass(frozen=True)
+class Capabilities:
+    """What a model supports and the limits the rest of the app budgets against."""
+    streaming: bool = True
+    vision: bool = False
+    context_window: int = 8_192 # Tokens (prompt + reply)
+    max_output_tokens: int = 4_096
+    rpm: int | None = None      # Requests/minute allowed per API key (client-side token bucket)
+    tpm: int | None = None      # Tokens/minute allowed per API key
+    max_concurrency: int | None = None # In-flight calls per provider (utils/scheduler.py; None = its default)
+    image_limits: ImageLimits = ImageLimits() # Largest useful image; bigger uploads are downscaled
+    input_cost: float | None = None   # USD per 1M prompt tokens (list price; None = unknown)
+    output_cost: float | None = None  # USD per 1M completion tokens
+
+
+@dataclass(frozen=True)
+class ProviderAdapter:
+    """
+    Declarative description of one display model.
+
+    Hooks receive the adapter itself first so one function can serve every
+    model that speaks the same wire protocol.
+        build_request(adapter, messages, temperature, max_tokens, api_key, stream) -> (url, headers, payload)
+        parse_response(adapter, response_json) -> str
+        parse_stream(adapter, lines) -> Iterator[str]      # lines: raw SSE lines
+        map_error(adapter, status, details, url, headers) -> APIError
+        call / stream (optional): SDK-backed overrides for the blocking/streaming paths.
+    """
+    name: str            # Display name used in the UI and as the registry key
+    provider: str        # Group for connection pools and limits (several NVIDIA models share one)
+    secret_key: str      # Key name in .streamlit/secrets.toml
+    upstream_model: str  # Model id sent to the provider
+    endpoint: str        # Base URL of the chat endpoint
+    build_request: Callable
+    parse_response: Callable
+    parse_stream: Callable
+    map_error: Callable = None
+    call: Callable | None = None
+    stream: Callable | None = None
+    capabilities: Capabilities = field(default_factory=Capabilities)
+
+    @property
+    def label(self) -> str:
+        """Prefix used in error messages, e.g. 'NVIDIA (NVIDIA Mistral Small)'."""
+        return self.name if self.name == self.provider else f"{self.provider} ({self.name})"
+
+    def error(self, status: int, details, url: str, headers=None) -> APIError:
+        mapper = self.map_error or default_error
+        return mapper(self, status, details, url, headers or {})
+
+# --- Error Mapping ---
+
+def parse_retry_after(value) -> float | None:
+    """Retry-After may be delta-seconds or an HTTP date; returns seconds to wait."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def default_error(adapter: ProviderAdapter, status: int, details, url: str, headers) -> APIError:
+    return APIError(
+        f"❌ {adapter.label} API Error: Status {status} from {url}. Details: {details}",
+        status=status, provider=adapter.provider, retry_after=parse_retry_after(headers.get("Retry-After")),
+    )
+
+def error_from_response(adapter: ProviderAdapter, response, url: str) -> APIError:
+    """Builds the adapter's APIError from a requests or httpx response."""
+    try: details = response.json()
+    except ValueError: details = response.text
+    return adapter.error(response.status_code, details, _redact_key(url), response.headers)
+
+def _redact_key(url: str) -> str:
+    # Gemini passes the API key as a query parameter; keep it out of error messages
+    head, sep, query = url.partition("?")
+    if not sep:
+        return url
+    params = ["key=***" if p.startswith("key=") else p for p in query.split("&")]
+    return f"{head}?{'&'.join(params)}"
+
+# --- Server-Sent Events ---
+
+def iter_sse_data(lines: Iterable) -> Iterator[str]:
+    """
+    Yields the `data:` payload of each Server-Sent Event as it arrives.
+
+    Multi-line data fields are joined with newlines per the SSE spec; comments
+    and `event:`/`id:` fields are ignored because every provider we use repeats
+    the event type inside the JSON payload.
+    """
+    data_lines = []
+    for raw_line in lines:
+        line = raw_line.decode("utf-8", errors="replace") if isinstance(raw_line, bytes) else raw_line
+        if not line:
+            if data_lines:
+                yield "\n".join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith(":"):
+            continue
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip(" "))
+    if data_lines:
+        yield "\n".join(data_lines)
+
+def _load_event(adapter: ProviderAdapter, data: str) -> dict:
+    try: return json.loads(data)
+    except json.JSONDecodeError as e: raise APIError(f"❌ {adapter.label} Error: Invalid stream chunk: {e}. Data: {data[:200]}")
+
+# --- OpenAI-Compatible Protocol (OpenAI, Mistral, Groq, NVIDIA) ---
+
+def to_openai_messages(messages: list[dict]) -> list[dict]:
+    """Messages carrying prepared "images" become content-part lists with data URLs."""
+    converted = []
+    for m in messages:
+        if m.get("images"):
+            parts = [{"type": "text", "text": m["content"]}]
+            parts += [{"type": "image_url", "image_url": {"url": image.data_url}} for image in m["images"]]
+            converted.append({"role": m["role"], "content": parts})
+        else:
+            converted.append({"role": m["role"], "content": m["content"]})
+    return converted
+
+def openai_build_request(adapter, messages, temperature, max_tokens, api_key, stream=False):
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json",
+               "Accept": "text/event-stream" if stream else "application/json"}
+    payload = {"model": adapter.upstream_model, "messages": to_openai_messages(messages),
+               "temperature": temperature, "max_tokens": max_tokens, "stream": stream}
+    return adapter.endpoint, headers, payload
+
+def _note_openai_usage(usage: dict | None) -> None:
+    if usage:
+        note_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+def openai_parse_response(adapter, response_data: dict) -> str:
+    _note_openai_usage(response_data.get("usage"))
+    try:
+        if not response_data.get("choices") or not response_data["choices"][0].get("message") or not response_data["choices"][0]["message"].get("content"):
+            raise APIError(f"❌ {adapter.label} Error: Unexpected structure. Resp: {response_data}")
+        return response_data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise APIError(f"❌ Error parsing {adapter.label} response: {e}. Resp: {response_data}")
+
+def openai_parse_stream(adapter, lines) -> Iterator[str]:
+    """Parses `chat.completion.chunk` events."""
+    for data in iter_sse_data(lines):
+        if data == "[DONE]":
+            return
+        chunk = _load_event(adapter, data)
+        if "error" in chunk:
+            raise APIError(f"❌ {adapter.label} API Error (stream): {chunk['error']}", provider=adapter.provider)
+        _note_openai_usage(chunk.get("usage")) # Sent on the last chunk by providers that support it
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+def _openai_base_url(adapter) -> str:
+    """SDK base URL derived from the adapter endpoint, so re-pointed adapters (proxies, mock servers) work."""
+    return adapter.endpoint.removesuffix("/chat/completions")
+
+def openai_sdk_call(adapter, messages, temperature, max_tokens, api_key) -> str:
+    """Blocking OpenAI call through the cached SDK client (imports openai on first use)."""
+    from openai import OpenAIError
+    from utils.client_pool import get_openai_client
+    try:
+        client = get_openai_client(api_key, _openai_base_url(adapter))
+        response = client.chat.completions.create(
+            model=adapter.upstream_model, messages=to_openai_messages(messages),
+            temperature=temperature, max_tokens=max_tokens
+        )
+    except OpenAIError as e:
+        raise _map_openai_error(adapter, e) from e
+    if response.usage is not None:
+        note_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+    if not response.choices or not response.choices[0].message or not response.choices[0].message.content:
+         raise APIError(f"❌ OpenAI API Error: Unexpected response structure. Response: {response}")
+    return response.choices[0].message.content.strip()
+
+def openai_sdk_stream(adapter, messages, temperature, max_tokens, api_key) -> Iterator[str]:
+    from openai import OpenAIError
+    from utils.client_pool import get_openai_client
+    try:
+        client = get_openai_client(api_key, _openai_base_url(adapter))
+        stream = client.chat.completions.create(
+            model=adapter.upstream_model, messages=to_openai_messages(messages),
+            temperature=temperature, max_tokens=max_tokens, stream=True,
+            stream_options={"include_usage": True}, # Final chunk (with no choices) carries token usage
+        )
+        forget_abort = on_cancel(lambda: _abort_sdk_stream(stream))
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    note_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            forget_abort()
+            stream.close()
+    except OpenAIError as e:
+        raise _map_openai_error(adapter, e) from e
+
+def _abort_sdk_stream(stream) -> None:
+    """Wakes a reader blocked on the SDK stream by shutting its socket down (closing alone doesn't)."""
+    import socket
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def _map_openai_error(adapter, error) -> APIError:
+    from openai import APIConnectionError # Also covers APITimeoutError
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None)
+    retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+    transient = True if isinstance(error, APIConnectionError) else None
+    return APIError(f"❌ OpenAI Library Error: {error}", status=status, provider=adapter.provider,
+                    retry_after=retry_after, transient=transient)
+
+# --- Anthropic Messages Protocol ---
+
+def to_anthropic_messages(messages: list[dict]) -> list[dict]:
+    """Prepared "images" become base64 image blocks, placed before the text as Anthropic recommends."""
+    converted = []
+    for m in messages:
+        if m.get("images"):
+            blocks = [{"type": "image", "source": {"type": "base64", "media_type": image.mime_type, "data": image.data}}
+                      for image in m["images"]]
+            blocks.append({"type": "text", "text": m["content"]})
+            converted.append({"role": m["role"], "content": blocks})
+        else:
+            converted.append({"role": m["role"], "content": m["content"]})
+    return converted
+
+def anthropic_build_request(adapter, messages, temperature, max_tokens, api_key, stream=False):
+    headers = {"x-api-key": api_key, "anthropic-version": "2023-06-01", "content-type": "application/json"}
+    payload = {"model": adapter.upstream_model, "max_tokens": max_tokens, "temperature": temperature,
+               "messages": to_anthropic_messages(messages)}
+    if stream:
+        headers["accept"] = "text/event-stream"
+        payload["stream"] = True
+    return adapter.endpoint, headers, payload
+
+def anthropic_parse_response(adapter, response_data: dict) -> str:
+    usage = response_data.get("usage") or {}
+    note_usage(usage.get("input_tokens"), usage.get("output_tokens"))
+    try:
+        if not response_data.get("content") or not response_data["content"][0].get("text"):
+            raise APIError(f"❌ Claude Error: Unexpected structure. Resp: {response_data}")
+        return response_data["content"][0]["text"]
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise APIError(f"❌ Error parsing Claude response: {e}. Resp: {response_data}")
+
+def anthropic_parse_stream(adapter, lines) -> Iterator[str]:
+    """Parses Messages API events; only `content_block_delta` text is surfaced."""
+    for data in iter_sse_data(lines):
+        event = _load_event(adapter, data)
+        event_type = event.get("type")
+        if event_type == "content_block_delta":
+            delta = event.get("delta") or {}
+            if delta.get("type") == "text_delta" and delta.get("text"):
+                yield delta["text"]
+        elif event_type == "message_start":
+            note_usage(prompt_tokens=((event.get("message") or {}).get("usage") or {}).get("input_tokens"))
+        elif event_type == "message_delta":
+            note_usage(completion_tokens=(event.get("usage") or {}).get("output_tokens"))
+        elif event_type == "error":
+            raise APIError(f"❌ Claude API Error (stream): {event.get('error')}", provider=adapter.provider)
+        elif event_type == "message_stop":
+            return
+
+# --- Google Gemini Protocol ---
+
+def to_gemini_contents(messages: list[dict]) -> list[dict]:
+    """Gemini calls the assistant role 'model' and wraps text (and inline images) in parts."""
+    return [
+        {
+            "role": "model" if m["role"] == "assistant" else "user",
+            "parts": [{"inlineData": {"mimeType": image.mime_type, "data": image.data}} for image in m.get("images") or ()]
+                     + [{"text": m["content"]}],
+        }
+        for m in messages
+    ]
+
+def gemini_build_request(adapter, messages, temperature, max_tokens, api_key, stream=False):
+    method = "streamGenerateContent?alt=sse&" if stream else "generateContent?"
+    url = f"{adapter.endpoint}/{adapter.upstream_model}:{method}key={api_key}"
+    headers = {"Content-Type": "application/json"}
+    payload = {"contents": to_gemini_contents(messages), "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens}}
+    return url, headers, payload
+
+def _note_gemini_usage(usage: dict | None) -> None:
+    if usage:
+        note_usage(usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+def gemini_parse_response(adapter, response_data: dict) -> str:
+    _note_gemini_usage(response_data.get("usageMetadata"))
+    # Parse Gemini response carefully
+    if 'candidates' not in response_data:
+        if 'promptFeedback' in response_data:
+            block_reason = response_data['promptFeedback'].get('blockReason', 'Unknown')
+            raise APIError(f"❌ Gemini Response Blocked. Reason: {block_reason}")
+        raise APIError(f"❌ Gemini API Error: Unexpected structure (no 'candidates'). Response: {response_data}")
+    if not response_data['candidates']:
+        reason = response_data.get('promptFeedback', {}).get('blockReason', 'empty list')
+        raise APIError(f"❌ Gemini API Error: Empty 'candidates' list. Reason: {reason}")
+    try:
+        candidate = response_data['candidates'][0]
+        if 'content' not in candidate: raise APIError(f"❌ Gemini Error: No 'content' in candidate. Finish Reason: {candidate.get('finishReason', 'Unknown')}")
+        if not candidate['content'].get('parts'): raise APIError(f"❌ Gemini Error: No 'parts' in content.")
+        if 'text' not in candidate['content']['parts'][0]: raise APIError(f"❌ Gemini Error: No 'text' in first part.")
+        return candidate['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError) as e:
+        raise APIError(f"❌ Error parsing Gemini response: {e}. Data: {response_data}")
+
+def gemini_parse_stream(adapter, lines) -> Iterator[str]:
+    """Parses `streamGenerateContent?alt=sse` events, each a partial GenerateContentResponse."""
+    for data in iter_sse_data(lines):
+        chunk = _load_event(adapter, data)
+        if "error" in chunk:
+            raise APIError(f"❌ Gemini API Error (stream): {chunk['error']}", provider=adapter.provider)
+        _note_gemini_usage(chunk.get("usageMetadata")) # Cumulative; the last chunk has the final counts
+        candidates = chunk.get("candidates")
+        if not candidates:
+            block_reason = (chunk.get("promptFeedback") or {}).get("blockReason")
+            if block_reason: raise APIError(f"❌ Gemini Response Blocked. Reason: {block_reason}")
+            continue
+        for part in (candidates[0].get("content") or {}).get("parts") or []:
+            if part.get("text"):
+                yield part["text"]
+
+# --- Registry ---
+
+_OPENAI_PROTOCOL = dict(build_request=openai_build_request, parse_response=openai_parse_response, parse_stream=openai_parse_stream)
+
+PROVIDERS: dict[str, ProviderAdapter] = {}
+
+def register_provider(adapter: ProviderAdapter) -> ProviderAdapter:
+    """Adds (or replaces) a model in the registry."""
+    PROVIDERS[adapter.name] = adapter
+    return adapter
+
+for _adapter in (
+    ProviderAdapter(
+        name="OpenAI", provider="OpenAI", secret_key="OPENAI_API_KEY",
+        upstream_model="gpt-3.5-turbo", endpoint="https://api.openai.com/v1/chat/completions",
+        call=openai_sdk_call, stream=openai_sdk_stream, # REST path is still used by the async engine
+        capabilities=Capabilities(context_window=16_385, rpm=3_500, tpm=160_000, input_cost=0.50, output_cost=1.50,
+                                  image_limits=ImageLimits(max_edge=2_048, max_short_edge=768)),
+        **_OPENAI_PROTOCOL,
+    ),
+    ProviderAdapter(
+        name="Gemini", provider="Gemini", secret_key="GOOGLE_API_KEY",
+        upstream_model="gemini-pro", endpoint="https://generativelanguage.googleapis.com/v1/models", # Use v1
+        build_request=gemini_build_request, parse_response=gemini_parse_response, parse_stream=gemini_parse_stream,
+        capabilities=Capabilities(context_window=30_720, max_output_tokens=2_048, rpm=60, input_cost=0.50, output_cost=1.50,
+                                  image_limits=ImageLimits(max_edge=3_072)),
+    ),
+    ProviderAdapter(
+        name="Claude", provider="Claude", secret_key="ANTHROPIC_API_KEY",
+        upstream_model="claude-3-opus-20240229", endpoint="https://api.anthropic.com/v1/messages",
+        build_request=anthropic_build_request, parse_response=anthropic_parse_response, parse_stream=anthropic_parse_stream,
+        capabilities=Capabilities(context_window=200_000, vision=True, rpm=50, tpm=40_000, input_cost=15.0, output_cost=75.0),
+    ),
+    ProviderAdapter(
+        name="Mistral", provider="Mistral", secret_key="MISTRAL_API_KEY",
+        upstream_model="mistral-medium", endpoint="https://api.mistral.ai/v1/chat/completions",
+        capabilities=Capabilities(context_window=32_000, rpm=300, input_cost=2.70, output_cost=8.10),
+        **_OPENAI_PROTOCOL,
+    ),
+    ProviderAdapter(
+        name="Groq", provider="Groq", secret_key="GROQ_API_KEY", # Assuming you add GROQ_API_KEY to secrets if using Groq
+        upstream_model="mixtral-8x7b-32768", endpoint="https://api.groq.com/openai/v1/chat/completions",
+        capabilities=Capabilities(context_window=32_768, rpm=30, tpm=5_000, max_concurrency=4, input_cost=0.27, output_cost=0.27),
+        **_OPENAI_PROTOCOL,
+    ),
+    # --- NVIDIA: Placeholder endpoint/model ids - consult NVIDIA AI Playground / API docs ---
+    ProviderAdapter(
+        name="NVIDIA Mistral Small", provider="NVIDIA", secret_key="NVIDIA_Mistral_Small_24B_Instruct",
+        upstream_model="mistralai/mistral-7b-instruct-v0.2", endpoint="https://ai.api.nvidia.com/v1/chat/completions",
+        capabilities=Capabilities(context_window=32_768, rpm=40, max_concurrency=4),
+        **_OPENAI_PROTOCOL,
+    ),
+    ProviderAdapter(
+        name="NVIDIA DeepSeek Qwen", provider="NVIDIA", secret_key="NVIDIA_DeepSeek_R1_Distill_Qwen_32B",
+        upstream_model="deepseek-ai/deepseek-coder-33b-instruct", endpoint="https://ai.api.nvidia.com/v1/chat/completions",
+        capabilities=Capabilities(context_window=16_384, rpm=40, max_concurrency=4),
+        **_OPENAI_PROTOCOL,
+    ),
+):
+    register_provider(_adapter)
+
+def get_adapter(model: str) -> ProviderAdapter:
+    adapter = PROVIDERS.get(model)
+    if adapter is None:
+        raise ValueError(f"❌ Unsupported model selected: '{model}'. Check utils/providers.py.")
+    return adapter
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float | None:
+    """USD cost at the adapter's list prices, or None when they aren't declared."""
+    caps = get_adapter(model).capabilities
+    if caps.input_cost is None or caps.output_cost is None:
+        return None
+    return (prompt_tokens * caps.input_cost + completion_tokens * caps.output_cost) / 1_000_000
+
+def supported_models() -> list[str]:
+    return list(PROVIDERS)
+
+def secrets_key_mapping() -> dict[str, str]:
+    """Maps the user-facing model name to the key name in secrets.toml."""
+    return {name: adapter.secret_key for name, adapter in PROVIDERS.items()}
@@ -0,0 +1,345 @@
+# utils/resilience.py
+"""
+Shared resilience layer for every provider call: client-side rate limiting,
+retries with jittered exponential backoff, and a circuit breaker.
+
+State is process-wide (like the client registry), so all Streamlit sessions
+talking to the same provider share one view of its limits and health.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from utils.errors import APIError
+
+# --- Token Bucket ---
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens/second up to `capacity`.
+
+    reserve() always succeeds: it takes the tokens (the balance may go negative)
+    and returns how long the caller must wait before sending. That keeps the
+    bucket usable from both threads (time.sleep) and asyncio (asyncio.sleep),
+    and queues concurrent callers fairly in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        tokens = min(tokens, self.capacity) # A single oversized request must still be able to run
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    @classmethod
+    def per_minute(cls, limit: int) -> "TokenBucket":
+        return cls(rate=limit / 60.0, capacity=float(limit))
+
+# --- Retry Policy ---
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3         # Total tries, including the first
+    base_delay: float = 0.5       # Seconds before the first retry
+    max_delay: float = 20.0       # Cap for a single backoff sleep
+    max_retry_after: float = 60.0 # Give up instead of honouring a longer Retry-After
+
+    def delay(self, attempt: int, error: APIError) -> float | None:
+        """
+        Seconds to wait before retry number `attempt` (1-based), or None to give up.
+
+        Uses "full jitter" exponential backoff, but never waits less than the
+        provider's Retry-After.
+        """
+        if attempt >= self.max_attempts or not getattr(error, "transient", False):
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if error.retry_after is not None:
+            if error.retry_after > self.max_retry_after:
+                return None
+            return max(backoff, error.retry_after)
+        return backoff
+
+# --- Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures and rejects
+    calls immediately for `recovery_timeout` seconds. It then lets one probe
+    through (half-open); success closes it, failure re-opens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            # Recovery window elapsed: allow a single probe
+            if self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opens += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_neutral(self) -> None:
+        """
+        An answer that says nothing about provider health (e.g. a 4xx). It ends
+        a closed breaker's failure streak but never closes an open or half-open
+        one: the reply may come from a request sent before the breaker opened.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Frees the half-open probe slot when a call ends without an outcome (e.g. cancelled)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+# --- Per-Provider Guard ---
+
+class ProviderGuard:
+    """Rate limits, breaker and counters for one provider group."""
+
+    def __init__(self, provider: str, breaker: CircuitBreaker):
+        self.provider = provider
+        self.breaker = breaker
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+            "throttled": 0, "throttle_wait_s": 0.0, "short_circuited": 0,
+        }
+
+    def bucket(self, kind: str, key_id: str, limit: int | None) -> TokenBucket | None:
+        if not limit:
+            return None
+        with self._lock:
+            bucket = self._buckets.get((kind, key_id))
+            if bucket is None:
+                bucket = self._buckets[(kind, key_id)] = TokenBucket.per_minute(limit)
+            return bucket
+
+    def count(self, name: str, amount=1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+
+class ResilienceManager:
+    """
+    Process-wide entry point used by llm_api (sync) and async_engine (async).
+
+    Typical flow for one attempt:
+        wait = manager.before_call(adapter, api_key, est_tokens)  # may raise if the circuit is open
+        sleep(wait); call provider
+        manager.record_success(adapter) / manager.record_failure(adapter, error)
+        delay = manager.retry_delay(adapter, attempt, error)      # None = give up
+    """
+
+    def __init__(self, policy: RetryPolicy | None = None, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._guards: dict[str, ProviderGuard] = {}
+        self._lock = threading.Lock()
+
+    def guard(self, provider: str) -> ProviderGuard:
+        with self._lock:
+            guard = self._guards.get(provider)
+            if guard is None:
+                guard = self._guards[provider] = ProviderGuard(
+                    provider, CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+                )
+            return guard
+
+    def before_call(self, adapter, api_key: str, est_tokens: int = 0) -> float:
+        """Checks the breaker and reserves rate-limit capacity; returns seconds to wait first."""
+        guard = self.guard(adapter.provider)
+        if not guard.breaker.allow():
+            guard.count("short_circuited")
+            raise APIError(
+                f"❌ {adapter.label} is temporarily unavailable after repeated failures "
+                f"(circuit open, retry in {guard.breaker.retry_in():.0f}s).",
+                provider=adapter.provider, transient=False,
+            )
+        guard.count("calls")
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else "-"
+        wait = 0.0
+        caps = adapter.capabilities
+        rpm_bucket = guard.bucket("rpm", key_id, caps.rpm)
+        if rpm_bucket is not None:
+            wait = max(wait, rpm_bucket.reserve(1))
+        tpm_bucket = guard.bucket("tpm", key_id, caps.tpm)
+        if tpm_bucket is not None and est_tokens:
+            wait = max(wait, tpm_bucket.reserve(est_tokens))
+        if wait > 0:
+            guard.count("throttled")
+            guard.count("throttle_wait_s", wait)
+        return wait
+
+    def record_success(self, adapter) -> None:
+        guard = self.guard(adapter.provider)
+        guard.breaker.record_success()
+        guard.count("successes")
+
+    def record_failure(self, adapter, error: Exception) -> None:
+        guard = self.guard(adapter.provider)
+        guard.count("failures")
+        if getattr(error, "transient", False):
+            guard.breaker.record_failure()
+        else:
+            # A client error (400/401/404) shows the provider is answering, but must not skip a cooldown
+            guard.breaker.record_neutral()
+
+    def retry_delay(self, adapter, attempt: int, error: Exception) -> float | None:
+        if not isinstance(error, APIError):
+            return None
+        delay = self.policy.delay(attempt, error)
+        if delay is not None:
+            self.guard(adapter.provider).count("retries")
+        return delay
+
+    def call(self, adapter, api_key: str, fn, est_tokens: int = 0, slot=None):
+        """
+        Runs fn() with rate limiting, retries and the circuit breaker (blocking).
+
+        `slot`, if given, returns a context manager held around each attempt
+        only (e.g. a scheduler slot), never across throttle or retry waits.
+        """
+        attempt = 1
+        while True:
+            wait = self.before_call(adapter, api_key, est_tokens)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if slot is None:
+                    result = fn()
+                else:
+                    with slot():
+                        result = fn()
+            except APIError as e:
+                self.record_failure(adapter, e)
+                delay = self.retry_delay(adapter, attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.guard(adapter.provider).breaker.release_probe()
+                raise
+            self.record_success(adapter)
+            return result
+
+    async def acall(self, adapter, api_key: str, make_coro, est_tokens: int = 0, slot=None):
+        """
+        Async counterpart of call(); make_coro() must return a fresh coroutine
+        per attempt, and `slot` an async context manager.
+        """
+        import asyncio
+        attempt = 1
+        while True:
+            wait = self.before_call(adapter, api_key, est_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                if slot is None:
+                    result = await make_coro()
+                else:
+                    async with slot():
+                        result = await make_coro()
+            except APIError as e:
+                self.record_failure(adapter, e)
+                delay = self.retry_delay(adapter, attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException: # Includes asyncio.CancelledError
+                self.guard(adapter.provider).breaker.release_probe()
+                raise
+            self.record_success(adapter)
+            return result
+
+    def health(self, provider: str) -> str:
+        """'closed' (healthy), 'half_open' (probing) or 'open' (failing fast)."""
+        with self._lock:
+            guard = self._guards.get(provider)
+        return guard.breaker.state if guard else CircuitBreaker.CLOSED
+
+    def stats(self) -> dict:
+        with self._lock:
+            guards = list(self._guards.values())
+        return {
+            guard.provider: {
+                **guard.counters,
+                "circuit": guard.breaker.state,
+                "circuit_opens": guard.breaker.opens,
+            }
+            for guard in guards
+        }
+
+
+# --- Module-Level Manager ---
+manager = ResilienceManager()
+
+def provider_health(provider: str) -> str:
+    return manager.health(provider)
+
+def resilience_stats() -> dict:
+    return manager.stats()
@@ -0,0 +1,226 @@
+# utils/retrieval.py
+"""
+Local, in-process retrieval over uploaded documents.
+
+Parsed documents are split into overlapping word windows and indexed with
+BM25 in an inverted index (term -> {chunk_id: term frequency}). Each turn then
+sends only the top-k chunks for the question instead of the whole document,
+so a 300-page PDF costs a few hundred prompt tokens rather than overflowing
+the context window. No network and no extra dependencies.
+
+Documents can be added one at a time and deleted without rebuilding: a delete
+re-tokenizes only that document's chunks and removes exactly their postings,
+so the corpus statistics stay exact.
+"""
+
+import heapq
+import math
+import re
+import threading
+from dataclasses import dataclass
+
+from utils.context import estimate_tokens
+
+DEFAULT_CHUNK_WORDS = 180   # ~250 tokens per chunk
+DEFAULT_OVERLAP_WORDS = 40  # Keeps sentences that straddle a boundary retrievable
+DEFAULT_TOP_K = 4
+DEFAULT_CONTEXT_BUDGET = 1_500 # Tokens of retrieved text added to a prompt
+
+_WORD_RE = re.compile(r"\S+")
+_TERM_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its of on or our she "
+    "so than that the their them then there these they this to was we were what when where which who "
+    "will with you your".split()
+)
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word terms without stopwords (shared by indexing and queries)."""
+    return [term for term in _TERM_RE.findall(text.lower()) if term not in _STOPWORDS]
+
+# --- Chunking ---
+
+@dataclass(slots=True)
+class Chunk:
+    id: int
+    doc_id: str
+    source: str  # Display name, e.g. the uploaded file name
+    ordinal: int # Position of the chunk within its document
+    text: str
+
+
+def chunk_text(text: str, chunk_words: int = DEFAULT_CHUNK_WORDS, overlap_words: int = DEFAULT_OVERLAP_WORDS) -> list[str]:
+    """
+    Splits text into windows of `chunk_words` words, each overlapping the previous
+    one by `overlap_words`. Chunks are slices of the original text, so line
+    breaks and formatting inside a chunk are preserved.
+    """
+    if overlap_words >= chunk_words:
+        raise ValueError("overlap_words must be smaller than chunk_words")
+    spans = [match.span() for match in _WORD_RE.finditer(text)]
+    if not spans:
+        return []
+    step = chunk_words - overlap_words
+    chunks = []
+    for start in range(0, len(spans), step):
+        window = spans[start:start + chunk_words]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + chunk_words >= len(spans):
+            break
+    return chunks
+
+# --- Index ---
+
+class ChunkIndex:
+    """
+    BM25 index over document chunks.
+
+    add_document() indexes incrementally, delete_document() removes a document's
+    postings in place, and search() scores only chunks that share a term with
+    the query. Safe to share between threads.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75,
+                 chunk_words: int = DEFAULT_CHUNK_WORDS, overlap_words: int = DEFAULT_OVERLAP_WORDS):
+        self.k1 = k1
+        self.b = b
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self._postings: dict[str, dict[int, int]] = {}
+        self._chunks: dict[int, Chunk] = {}
+        self._lengths: dict[int, int] = {}
+        self._docs: dict[str, list[int]] = {}
+        self._total_length = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def documents(self) -> list[str]:
+        with self._lock:
+            return list(self._docs)
+
+    def add_document(self, doc_id: str, text: str, source: str | None = None) -> int:
+        """
+        Chunks and indexes a document; returns the number of chunks added.
+        Re-adding an existing doc_id replaces its previous contents.
+        """
+        pieces = chunk_text(text, self.chunk_words, self.overlap_words)
+        # Tokenize outside the lock; only the posting updates need it
+        tokenized = [(piece, tokenize(piece)) for piece in pieces]
+        with self._lock:
+            if doc_id in self._docs:
+                self._remove_locked(doc_id)
+            ids = []
+            for ordinal, (piece, terms) in enumerate(tokenized):
+                chunk_id = self._next_id
+                self._next_id += 1
+                self._chunks[chunk_id] = Chunk(chunk_id, doc_id, source or doc_id, ordinal, piece)
+                self._lengths[chunk_id] = len(terms)
+                self._total_length += len(terms)
+                for term, count in _term_counts(terms).items():
+                    self._postings.setdefault(term, {})[chunk_id] = count
+                ids.append(chunk_id)
+            self._docs[doc_id] = ids
+        return len(tokenized)
+
+    def delete_document(self, doc_id: str) -> bool:
+        """Removes a document's chunks and postings; returns False if it wasn't indexed."""
+        with self._lock:
+            if doc_id not in self._docs:
+                return False
+            self._remove_locked(doc_id)
+            return True
+
+    def _remove_locked(self, doc_id: str) -> None:
+        for chunk_id in self._docs.pop(doc_id):
+            chunk = self._chunks.pop(chunk_id)
+            self._total_length -= self._lengths.pop(chunk_id)
+            for term in set(tokenize(chunk.text)):
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K, doc_ids: set[str] | None = None) -> list[tuple[float, Chunk]]:
+        """
+        Returns up to k (score, chunk) pairs, best first.
+
+        Args:
+            query (str): The user's question.
+            k (int): Number of chunks to return.
+            doc_ids (set[str] | None): Restrict results to these documents.
+        """
+        terms = _term_counts(tokenize(query))
+        with self._lock:
+            total_chunks = len(self._chunks)
+            if not terms or not total_chunks:
+                return []
+            avg_length = self._total_length / total_chunks or 1.0
+            scores: dict[int, float] = {}
+            for term, query_count in terms.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + query_count * idf * tf * (self.k1 + 1) / (tf + norm)
+            if doc_ids is not None:
+                scores = {cid: s for cid, s in scores.items() if self._chunks[cid].doc_id in doc_ids}
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self._chunks[chunk_id]) for chunk_id, score in best]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "chunks": len(self._chunks),
+                "terms": len(self._postings),
+                "postings": sum(len(p) for p in self._postings.values()),
+            }
+
+
+def _term_counts(terms: list[str]) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for term in terms:
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+# --- Prompt Assembly ---
+
+def format_context(hits: list[tuple[float, Chunk]], budget: int = DEFAULT_CONTEXT_BUDGET) -> str:
+    """Renders retrieved chunks as a source-labelled excerpt block within a token budget."""
+    parts = []
+    used = 0
+    for _, chunk in hits:
+        block = f"[{chunk.source} · part {chunk.ordinal + 1}]\n{chunk.text}"
+        cost = estimate_tokens(block)
+        if parts and used + cost > budget:
+            break
+        parts.append(block)
+        used += cost
+    return "\n\n".join(parts)
+
+
+def augment_prompt(question: str, index: ChunkIndex, k: int = DEFAULT_TOP_K,
+                   budget: int = DEFAULT_CONTEXT_BUDGET) -> tuple[str, list[tuple[float, Chunk]]]:
+    """
+    Prepends the top-k chunks for `question` to it. Returns (prompt, hits);
+    the prompt is the question unchanged when nothing relevant was found.
+    """
+    hits = index.search(question, k=k)
+    if not hits:
+        return question, []
+    excerpts = format_context(hits, budget)
+    prompt = (
+        "Answer using the following excerpts from the uploaded documents where relevant.\n\n"
+        f"{excerpts}\n\n---\n\nQuestion: {question}"
+    )
+    return prompt, hits
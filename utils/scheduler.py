@@ -0,0 +1,435 @@
+# utils/scheduler.py
+"""
+Process-wide scheduler for upstream LLM calls.
+
+Every chat request (all Streamlit sessions, compare mode, the batch runner)
+asks the scheduler for a slot before it reaches a provider:
+
+- Each provider has a concurrency limit; requests beyond it wait in a queue.
+- Interactive requests are always served before batch requests.
+- Within a priority, waiting sessions are served round-robin, so one session
+  with many queued requests can't starve the others.
+- Identical concurrent requests (same flight key) share one upstream call:
+  later callers wait for the first one's result (run) or read along with its
+  stream (stream) instead of sending their own.
+
+A slot covers one upstream attempt: callers take it per attempt (see the
+`slot` argument of utils.resilience.ResilienceManager.call), so retry backoff
+and Retry-After waits never hold capacity other requests could use. The
+caller's own thread still performs the call; the scheduler only decides when
+it may start. State is process-wide, like the resilience layer.
+"""
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from utils.cancellation import CancelScope, cancel_scope, current_scope, on_cancel
+from utils.errors import APIError, RequestCancelled
+from utils.metrics import percentile
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH) # Served strictly in this order
+DEFAULT_CONCURRENCY = 8 # In-flight calls per provider unless configured
+_ANONYMOUS = "-" # Queue for callers that don't name a session
+
+# --- Tickets ---
+
+class Ticket:
+    """One request's place in a provider queue; wait() returns once it may call upstream."""
+    __slots__ = ("provider", "session", "priority", "enqueued_at", "granted_at", "state", "_event", "_on_grant")
+
+    WAITING, GRANTED, DONE = "waiting", "granted", "done"
+
+    def __init__(self, provider: str, session: str, priority: str, on_grant=None):
+        self.provider = provider
+        self.session = session
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted_at: float | None = None
+        self.state = self.WAITING
+        self._event = threading.Event()
+        self._on_grant = on_grant # Called (under the scheduler lock) when granted or withdrawn; must not block
+
+    def _wake(self) -> None:
+        self._event.set()
+        if self._on_grant is not None:
+            self._on_grant()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._event.wait(timeout)
+
+
+class _Lane:
+    """Queues, limit and counters for one provider."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # priority -> session -> that session's waiting tickets (FIFO); session order is the round-robin order
+        self.queues: dict[str, OrderedDict[str, deque]] = {priority: OrderedDict() for priority in PRIORITIES}
+        self.waits: deque = deque(maxlen=1_000) # Recent queue wait times (seconds)
+        self.counters = {"granted": 0, "queued": 0, "coalesced": 0, "cancelled": 0}
+
+    def depth(self, priority: str | None = None) -> int:
+        priorities = PRIORITIES if priority is None else (priority,)
+        return sum(len(tickets) for p in priorities for tickets in self.queues[p].values())
+
+    def next_ticket(self) -> Ticket | None:
+        for priority in PRIORITIES:
+            sessions = self.queues[priority]
+            if sessions:
+                session, tickets = next(iter(sessions.items()))
+                ticket = tickets.popleft()
+                del sessions[session]
+                if tickets:
+                    sessions[session] = tickets # Back of the line for this session's next request
+                return ticket
+        return None
+
+# --- Single-Flight ---
+
+class _Flight:
+    """A blocking call shared by identical concurrent requests."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class _SharedStream:
+    """
+    One upstream stream read by every identical concurrent request.
+
+    A single pump thread iterates the source (in the context of the request
+    that started it, so metrics.track() records stay attached to that request)
+    and buffers its deltas for the life of the stream; a request that joins late
+    still receives the whole answer. Readers only wait on the buffer, and a
+    reader whose own CancelScope is cancelled leaves at once. Once every reader
+    has gone, the stream's scope is cancelled, which aborts the upstream
+    request even while it is still waiting for its first byte.
+    """
+
+    def __init__(self, open_source, on_finished):
+        self._open_source = open_source
+        self._on_finished = on_finished
+        self._parts: list[str] = []
+        self._done = False
+        self._abandoned = False
+        self._error: BaseException | None = None
+        self._readers = 0
+        self._cond = threading.Condition()
+        self._scope = CancelScope() # The upstream request's, shared by every reader
+
+    def start(self) -> None:
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._pump,), name="shared-stream", daemon=True).start()
+
+    def _cancel_reader(self, state: dict) -> None:
+        with self._cond:
+            state["cancelled"] = True
+            self._cond.notify_all()
+
+    def join(self) -> bool:
+        """Registers one more reader, unless the stream already finished or was abandoned."""
+        with self._cond:
+            if self._done or self._abandoned:
+                return False
+            self._readers += 1
+            return True
+
+    def read(self):
+        """Generator for a reader registered with join()."""
+        index = 0
+        state = {"cancelled": False}
+        reader_scope = current_scope()
+        forget = reader_scope.add(lambda: self._cancel_reader(state)) if reader_scope is not None else None
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._parts) and not self._done and not state["cancelled"]:
+                        self._cond.wait()
+                    if state["cancelled"]:
+                        raise RequestCancelled("Request was cancelled by its owner.")
+                    if index < len(self._parts):
+                        part = self._parts[index]
+                        index += 1
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield part
+        finally:
+            if forget is not None:
+                forget()
+            with self._cond:
+                self._readers -= 1
+                abandon = self._readers == 0 and not self._done
+                if abandon:
+                    self._abandoned = True
+            if abandon:
+                self._scope.cancel() # Aborts the upstream request; the pump then closes the source
+
+    def _pump(self) -> None:
+        source = None
+        error = None
+        try:
+            with cancel_scope(self._scope):
+                source = self._open_source()
+                for delta in source:
+                    with self._cond:
+                        if self._abandoned:
+                            break
+                        self._parts.append(delta)
+                        self._cond.notify_all()
+        except Exception as e:
+            error = e
+        except BaseException:
+            error = APIError("❌ Stream was interrupted.")
+        finally:
+            try:
+                if source is not None:
+                    with cancel_scope(self._scope):
+                        source.close() # Closed on this thread: the source's context managers exit where they entered
+            except Exception as e:
+                error = error or e
+            with self._cond:
+                if self._abandoned and error is None:
+                    error = APIError("❌ Stream was abandoned by every requester.")
+                self._error = error
+                self._done = True
+                self._cond.notify_all()
+            self._on_finished()
+
+# --- Scheduler ---
+
+class Scheduler:
+    """
+    Args:
+        default_limit (int): In-flight calls per provider when neither
+            set_limit() nor the adapter's capabilities say otherwise.
+    """
+
+    def __init__(self, default_limit: int = DEFAULT_CONCURRENCY):
+        self.default_limit = default_limit
+        self._limits: dict[str, int] = {}
+        self._lanes: dict[str, _Lane] = {}
+        self._flights: dict[str, _Flight | _SharedStream] = {}
+        self._lock = threading.Lock()
+
+    def set_limit(self, provider: str, limit: int) -> None:
+        """Overrides a provider's concurrency limit; waiting requests are admitted if it grew."""
+        with self._lock:
+            self._limits[provider] = max(1, int(limit))
+            lane = self._lanes.get(provider)
+            if lane is not None:
+                lane.limit = self._limits[provider]
+                self._dispatch(lane)
+
+    def _lane(self, provider: str, limit_hint: int | None) -> _Lane:
+        lane = self._lanes.get(provider)
+        if lane is None:
+            limit = self._limits.get(provider) or limit_hint or self.default_limit
+            lane = self._lanes[provider] = _Lane(limit)
+        return lane
+
+    # --- Slots ---
+
+    def enqueue(self, provider: str, session: str | None = None, priority: str = INTERACTIVE,
+                limit_hint: int | None = None, on_grant=None) -> Ticket:
+        """
+        Queues a request; the ticket is granted right away when the provider has
+        a free slot. `on_grant` is called when the ticket is granted or withdrawn.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(PRIORITIES)}.")
+        ticket = Ticket(provider, session or _ANONYMOUS, priority, on_grant)
+        with self._lock:
+            lane = self._lane(provider, limit_hint)
+            lane.queues[priority].setdefault(ticket.session, deque()).append(ticket)
+            if lane.depth() > 1 or lane.active >= lane.limit:
+                lane.counters["queued"] += 1
+            self._dispatch(lane)
+        return ticket
+
+    def _dispatch(self, lane: _Lane) -> None:
+        while lane.active < lane.limit:
+            ticket = lane.next_ticket()
+            if ticket is None:
+                return
+            lane.active += 1
+            lane.counters["granted"] += 1
+            ticket.state = Ticket.GRANTED
+            ticket.granted_at = time.monotonic()
+            lane.waits.append(ticket.granted_at - ticket.enqueued_at)
+            ticket._wake()
+
+    def finish(self, ticket: Ticket) -> None:
+        """Releases a granted slot, or withdraws a ticket that is still waiting."""
+        with self._lock:
+            if ticket.state == Ticket.DONE:
+                return
+            lane = self._lanes[ticket.provider]
+            if ticket.state == Ticket.GRANTED:
+                lane.active -= 1
+                self._dispatch(lane)
+            elif ticket.state == Ticket.WAITING:
+                tickets = lane.queues[ticket.priority].get(ticket.session)
+                if tickets is not None and ticket in tickets:
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del lane.queues[ticket.priority][ticket.session]
+                lane.counters["cancelled"] += 1
+            waiting = ticket.state == Ticket.WAITING
+            ticket.state = Ticket.DONE
+            if waiting:
+                ticket._wake() # Wakes a waiter that is being cancelled
+
+    @contextmanager
+    def slot(self, provider: str, session: str | None = None, priority: str = INTERACTIVE,
+             limit_hint: int | None = None):
+        """
+        Blocks until the provider has capacity for this request; the slot is held inside the block.
+
+        Raises:
+            RequestCancelled: If the current CancelScope is cancelled while the request is still queued.
+        """
+        ticket = self.enqueue(provider, session, priority, limit_hint)
+        try:
+            forget = on_cancel(lambda: self.finish(ticket)) # Withdraws the ticket and wakes the wait below
+            try:
+                ticket.wait()
+            finally:
+                forget()
+            self._raise_if_withdrawn(ticket)
+            yield ticket
+        finally:
+            self.finish(ticket)
+
+    @staticmethod
+    def _raise_if_withdrawn(ticket: Ticket) -> None:
+        if ticket.state == Ticket.DONE: # Cancelled while queued (or just as it was granted; the slot is back)
+            raise RequestCancelled("Request was cancelled while waiting for a slot.")
+
+    @asynccontextmanager
+    async def aslot(self, provider: str, session: str | None = None, priority: str = INTERACTIVE,
+                    limit_hint: int | None = None):
+        """slot() for asyncio code: waits on a future (no worker thread); cancellation withdraws the ticket."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_grant():
+            def resolve():
+                if not granted.done():
+                    granted.set_result(None)
+            try:
+                loop.call_soon_threadsafe(resolve)
+            except RuntimeError: # Loop already closed: nobody is waiting any more
+                pass
+
+        ticket = self.enqueue(provider, session, priority, limit_hint, on_grant)
+        try:
+            forget = on_cancel(lambda: self.finish(ticket)) # A cancelled CancelScope withdraws it too
+            try:
+                await granted
+            finally:
+                forget()
+            self._raise_if_withdrawn(ticket)
+            yield ticket
+        finally:
+            self.finish(ticket)
+
+    # --- Single-Flight ---
+
+    def run(self, key: str, provider: str, fn, limit_hint: int | None = None):
+        """
+        Returns fn(). A concurrent call with the same key waits for the running
+        one and gets its result (or its exception). fn takes its own slot() per
+        upstream attempt.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = not isinstance(flight, _Flight)
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._lane(provider, limit_hint).counters["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e if isinstance(e, Exception) else APIError("❌ The shared request was interrupted.")
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def stream(self, key: str, provider: str, make_stream, limit_hint: int | None = None):
+        """
+        Yields the deltas of make_stream(), which takes its own slot() per
+        upstream attempt. A concurrent request with the same key reads the same
+        upstream stream.
+        """
+        leader = False
+        with self._lock:
+            shared = self._flights.get(key)
+            if isinstance(shared, _SharedStream) and shared.join():
+                self._lane(provider, limit_hint).counters["coalesced"] += 1
+            else:
+                def on_finished():
+                    with self._lock:
+                        if self._flights.get(key) is shared:
+                            del self._flights[key]
+
+                shared = self._flights[key] = _SharedStream(make_stream, on_finished)
+                shared.join()
+                leader = True
+        if leader:
+            shared.start()
+        yield from shared.read()
+
+    # --- Stats ---
+
+    def stats(self) -> dict:
+        """Per provider: limit, active calls, queue depth per priority, wait percentiles and counters."""
+        with self._lock:
+            return {
+                provider: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    **{f"queued_{priority}": lane.depth(priority) for priority in PRIORITIES},
+                    "sessions_waiting": len({s for p in PRIORITIES for s in lane.queues[p]}),
+                    "wait_p50_s": percentile(list(lane.waits), 50),
+                    "wait_p95_s": percentile(list(lane.waits), 95),
+                    "wait_max_s": max(lane.waits, default=0.0),
+                    **lane.counters,
+                }
+                for provider, lane in self._lanes.items()
+            }
+
+
+# --- Module-Level Scheduler ---
+scheduler = Scheduler()
+
+def configure_scheduler(limits: dict[str, int] | None = None, default_limit: int | None = None) -> None:
+    """Sets per-provider concurrency limits (and the default for providers not listed)."""
+    if default_limit is not None:
+        scheduler.default_limit = default_limit
+    for provider, limit in (limits or {}).items():
+        scheduler.set_limit(provider, limit)
+
+def scheduler_stats() -> dict:
+    return scheduler.stats()
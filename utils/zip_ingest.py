@@ -0,0 +1,225 @@
+# utils/zip_ingest.py
+"""
+Recursive, concurrent ingestion of ZIP archives.
+
+Members are streamed out of the archive one at a time with hard limits on
+decompressed size (per member and in total), member count and nesting depth,
+so a zip bomb is cut off after at most the configured number of bytes rather
+than trusting the sizes declared in the archive headers. Each member is handed
+to a thread pool as soon as it has been read (with a bound on members waiting
+to be parsed, so decompressed data doesn't pile up), and nested archives are
+expanded in place. PDF members are parsed on the reading thread, one at a
+time: PyMuPDF is not thread-safe and holds the GIL anyway.
+"""
+
+import io
+import os
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Callable
+
+# --- Limits ---
+
+@dataclass(frozen=True)
+class ZipLimits:
+    max_member_bytes: int = 25 * 1024 * 1024  # Decompressed size allowed per member
+    max_total_bytes: int = 200 * 1024 * 1024  # Decompressed size allowed across the whole archive tree
+    max_members: int = 2_000                   # Members parsed across the whole tree
+    max_depth: int = 3                         # Nested archives allowed inside the upload
+    max_ratio: float = 200.0                   # Declared compression ratio treated as a bomb
+
+
+@dataclass
+class ZipMember:
+    """One archive member and its extracted text, tied to its full path (nested paths use '!/')."""
+    path: str
+    kind: str
+    size: int
+    text: str | None = None
+    error: str | None = None
+
+
+class _Budget:
+    """Limits shared by the whole archive tree (main thread only)."""
+    def __init__(self, limits: ZipLimits):
+        self.limits = limits
+        self.bytes_left = limits.max_total_bytes
+        self.members_left = limits.max_members
+
+# --- Type Dispatch ---
+
+_TEXT_EXTENSIONS = {
+    ".txt", ".md", ".rst", ".csv", ".tsv", ".json", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".xml", ".html",
+    ".css", ".py", ".js", ".ts", ".java", ".c", ".h", ".cpp", ".hpp", ".go", ".rs", ".rb", ".php", ".sh", ".sql",
+}
+
+def member_kind(path: str) -> str | None:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf": return "pdf"
+    if ext == ".docx": return "docx"
+    if ext == ".ipynb": return "ipynb"
+    if ext in (".png", ".jpg", ".jpeg"): return "image"
+    if ext == ".zip": return "zip"
+    if ext in _TEXT_EXTENSIONS: return "txt"
+    return None
+
+def _parse_member(kind: str, data: bytes) -> str:
+    """Uses the regular parse_* functions (PDFs on the reading thread, the rest on workers)."""
+    from utils import file_parser
+    if kind == "pdf":
+        return file_parser.parse_pdf(data)
+    if kind == "docx":
+        return file_parser.parse_docx(data)
+    if kind == "ipynb":
+        return file_parser.parse_ipynb(data)
+    if kind == "image":
+        description, _ = file_parser.parse_image(data)
+        return description
+    return file_parser.parse_txt(data)
+
+def _parse_into(member: "ZipMember", data: bytes) -> None:
+    from utils.file_parser import is_parse_error
+    try:
+        text = _parse_member(member.kind, data)
+    except Exception as e:
+        member.error = f"{type(e).__name__}: {e}"
+        return
+    if is_parse_error(text): # The parser already reported the details
+        member.error = f"could not be parsed as {member.kind}"
+    else:
+        member.text = text
+
+# --- Reading ---
+
+# One unreadable member (bad CRC, encrypted, unsupported compression, truncated
+# data) is recorded on that member; the rest of the archive is still ingested.
+_MEMBER_READ_ERRORS = (zipfile.BadZipFile, RuntimeError, NotImplementedError, zlib.error, OSError, EOFError)
+
+def _read_capped(zf: zipfile.ZipFile, info: zipfile.ZipInfo, cap: int) -> bytes | None:
+    """Streams a member's decompressed bytes; returns None if it exceeds `cap`."""
+    chunks = []
+    read = 0
+    with zf.open(info) as handle:
+        while True:
+            chunk = handle.read(min(1024 * 1024, cap + 1 - read))
+            if not chunk:
+                break
+            read += len(chunk)
+            if read > cap:
+                return None
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def _collect(source: bytes | BinaryIO, prefix: str, depth: int, budget: _Budget,
+             members: list[ZipMember], submit: Callable[[ZipMember, bytes], None]) -> None:
+    """Walks one archive level, appending ZipMember records and submitting each member as soon as it is read."""
+    limits = budget.limits
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    with zipfile.ZipFile(stream) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            path = f"{prefix}{info.filename}"
+            kind = member_kind(info.filename)
+            member = ZipMember(path=path, kind=kind or "other", size=info.file_size)
+            members.append(member)
+
+            if kind is None:
+                member.error = "skipped (unsupported type)"
+                continue
+            if budget.members_left <= 0:
+                member.error = f"skipped (member limit of {limits.max_members} reached)"
+                continue
+            if info.compress_size and info.file_size / info.compress_size > limits.max_ratio and info.file_size > 1024 * 1024:
+                member.error = f"skipped (suspicious compression ratio {info.file_size / info.compress_size:.0f}:1)"
+                continue
+            cap = min(limits.max_member_bytes, budget.bytes_left)
+            if info.file_size > cap:
+                member.error = f"skipped (declared size {info.file_size} bytes exceeds limit of {cap})"
+                continue
+            if kind == "zip" and depth >= limits.max_depth:
+                member.error = f"skipped (nesting deeper than {limits.max_depth})"
+                continue
+
+            try:
+                data = _read_capped(zf, info, cap) # Headers can lie; enforce the cap on real bytes
+            except _MEMBER_READ_ERRORS as e:
+                member.error = f"unreadable ({e})"
+                continue
+            if data is None:
+                member.error = f"skipped (decompressed size exceeds limit of {cap} bytes)"
+                continue
+            budget.bytes_left -= len(data)
+            budget.members_left -= 1
+            member.size = len(data)
+
+            if kind == "zip":
+                try:
+                    _collect(data, f"{path}!/", depth + 1, budget, members, submit)
+                    member.text = ""
+                except zipfile.BadZipFile as e:
+                    member.error = f"invalid nested archive: {e}"
+            else:
+                submit(member, data)
+
+# --- Public API ---
+
+def ingest_zip(source: bytes | BinaryIO, limits: ZipLimits | None = None, workers: int = 4) -> list[ZipMember]:
+    """
+    Extracts the text of every supported member of a ZIP archive, recursing into nested ZIPs.
+
+    Args:
+        source (bytes | file-like): Archive bytes, or a seekable binary file
+            object (e.g. Streamlit's UploadedFile) to avoid an extra copy.
+        limits (ZipLimits | None): Size/count/depth caps; defaults are generous
+            for document bundles but stop zip bombs.
+        workers (int): Threads used to parse members concurrently.
+
+    Returns:
+        list[ZipMember]: Members in archive order (nested members follow their
+            archive), each with either `text` or an `error`/skip reason.
+
+    Raises:
+        zipfile.BadZipFile: If the top-level archive is not a ZIP file.
+    """
+    budget = _Budget(limits or ZipLimits())
+    members: list[ZipMember] = []
+    if workers <= 1:
+        _collect(source, "", 0, budget, members, _parse_into)
+        return members
+
+    # At most this many read-but-unparsed members are held in memory at once
+    waiting = threading.BoundedSemaphore(workers * 2)
+
+    def run(member: ZipMember, data: bytes) -> None:
+        try:
+            _parse_into(member, data)
+        finally:
+            waiting.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit(member: ZipMember, data: bytes) -> None:
+            if member.kind == "pdf":
+                _parse_into(member, data)
+                return
+            waiting.acquire() # Backpressure: wait for a worker before reading further
+            pool.submit(run, member, data)
+
+        _collect(source, "", 0, budget, members, submit)
+    return members
+
+
+def format_members(members: list[ZipMember], filename: str) -> str:
+    """Renders ingested members as one text document, each section headed by its path."""
+    parts = [f"Contents of ZIP file '{filename}':\n"]
+    for member in members:
+        if member.error:
+            parts.append(f"- {member.path} ({member.size} bytes): {member.error}\n")
+        elif member.kind == "zip":
+            parts.append(f"- {member.path} (nested archive, {member.size} bytes)\n")
+        else:
+            parts.append(f"\n### {member.path} ({member.size} bytes)\n{member.text}\n")
+    return "".join(parts)